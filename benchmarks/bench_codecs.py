@@ -0,0 +1,65 @@
+"""
+Measures the decoding throughput and memory of every supported compressed format:
+a generated 16 kHz mono recording is encoded with ffmpeg, then loaded
+with Recording.from_file_path in fresh processes (ffmpeg is required).
+The throughput is given in seconds of audio decoded per second,
+and the peak resident memory added by the loading in MB.
+Run from the git root directory with:
+    python -m benchmarks.bench_codecs [minutes]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.bench_recording_load import write_wav
+
+CODECS = {
+    ".mp3": ["-c:a", "libmp3lame", "-b:a", "64k"],
+    ".ogg": ["-c:a", "libvorbis", "-q:a", "3"],
+    ".opus": ["-c:a", "libopus", "-b:a", "32k"],
+    ".m4a": ["-c:a", "aac", "-b:a", "64k"],
+    ".flac": ["-c:a", "flac"],
+}
+
+
+def measure(path: str) -> None:
+    import resource
+    import time
+
+    from src.utils import Recording
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    recording = Recording.from_file_path(path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{recording.duration} {elapsed} {(peak - baseline) / 1024}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2])
+        sys.exit()
+    if shutil.which("ffmpeg") is None:
+        sys.exit("This benchmark needs ffmpeg to encode and decode the recordings.")
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 30.
+    print(f"{minutes:g} minutes of 16 kHz mono audio")
+    print(f"{'codec':<8}{'file MB':>10}{'seconds':>10}{'x realtime':>12}{'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source.wav")
+        write_wav(source, minutes)
+        for extension, options in CODECS.items():
+            path = os.path.join(directory, f"recording{extension}")
+            subprocess.run(
+                ["ffmpeg", "-nostdin", "-v", "error", "-y", "-i", source, *options, path], check=True
+            )
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_codecs", "--measure", path],
+                check=True, capture_output=True, text=True,
+            ).stdout.split()
+            duration, elapsed, peak = map(float, output)
+            size = os.path.getsize(path) / 2 ** 20
+            print(f"{extension:<8}{size:>10.1f}{elapsed:>10.3f}{duration / elapsed:>12.1f}{peak:>10.1f}")
+            os.remove(path)
@@ -0,0 +1,84 @@
+"""
+Measures the throughput of get_protocol_summaries called by parallel request threads,
+with a single connection, like the former shared connection, and with a connection pool.
+The protocols are written to the test database of tests/docker-compose.yml,
+which must be running (docker compose -f tests/docker-compose.yml up db-test),
+and removed afterwards.
+Run from the git root directory with:
+    python -m benchmarks.bench_database_pool [protocols] [threads]
+"""
+import random
+import sys
+import threading
+import time
+from datetime import date
+
+from src.utils.DataBaseConnection import DataBaseConnection
+
+DB_CONFIG = {
+    "db_name": "protocols_test",
+    "user_name": "protocol_server",
+    "password": "server_pwd",
+    "host": "localhost",
+    "port": 5800,
+}
+ORGANIZATION = "bench_database_pool"
+CALLS = 200
+
+
+def make_protocol(generator: random.Random) -> dict:
+    return {
+        "title": f"Protocol {generator.randint(1, 10000)}",
+        "date": date(generator.randint(2000, 2024), generator.randint(1, 12), generator.randint(1, 28)),
+        "place": "Room",
+        "numberOfAttendees": generator.randint(2, 30),
+        "agendaItems": [
+            {"title": f"Item {i}", "explanation": "Explanation " * generator.randint(10, 100)}
+            for i in range(generator.randint(1, 7))
+        ],
+    }
+
+
+def run(database: DataBaseConnection, threads: int) -> float:
+    """
+    Calls get_protocol_summaries CALLS times from the given number of threads.
+    :return: The number of calls per second.
+    """
+    remaining = [CALLS]
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            database.get_protocol_summaries(ORGANIZATION)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return CALLS / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    protocols = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    database = DataBaseConnection(**DB_CONFIG)
+    generator = random.Random(0)
+    for _ in range(protocols):
+        database.save_protocol(make_protocol(generator), ORGANIZATION)
+    try:
+        print(f"{protocols} protocols, {threads} threads, {CALLS} calls")
+        print(f"{'connections':>12}{'calls/s':>10}")
+        for connections in (1, threads):
+            pooled = DataBaseConnection(**DB_CONFIG, min_connections=connections, max_connections=connections)
+            print(f"{connections:>12}{run(pooled, threads):>10.1f}")
+            pooled.close()
+    finally:
+        with database.cursor() as cursor:
+            cursor.execute("DELETE FROM ProtocolMetadata WHERE organization = %s", (ORGANIZATION,))
+        database.close()
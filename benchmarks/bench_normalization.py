@@ -0,0 +1,55 @@
+"""
+Compares the transcription of a 48 kHz stereo recording as uploaded
+with its transcription after the normalisation to 16 kHz mono,
+against a local fake Vosk server processing a limited number of bytes per second
+on each connection (the cost of the audio grows with its sample rate and channels).
+The samples the diarization gets are reported as well.
+Run from the git root directory with:
+    python -m benchmarks.bench_normalization [minutes]
+"""
+import sys
+import time
+
+import torch
+
+from src.utils import AudioTranscript, Recording
+from tests.fake_vosk_server import FakeVoskServer
+
+# Bytes processed per second on each connection
+BANDWIDTH = 2e6
+
+
+def make_recording(minutes: float, sample_rate: int = 48000) -> Recording:
+    generator = torch.Generator().manual_seed(0)
+    waveform = torch.rand(2, int(minutes * 60 * sample_rate), generator=generator) * 0.2 - 0.1
+    return Recording(".wav", None, (waveform, sample_rate))
+
+
+def make_turns(duration: float, turn: float = 8.) -> list[tuple[str, float, float]]:
+    return [
+        (f"SPEAKER_{i % 3:02}", i * turn, min((i + 1) * turn, duration))
+        for i in range(int(duration // turn) + (duration % turn > 0))
+    ]
+
+
+def run(recording: Recording, normalize: bool) -> tuple[float, float, int, int]:
+    start = time.perf_counter()
+    if normalize:
+        recording = recording.normalized()
+    normalized = time.perf_counter() - start
+    segments = recording.trim_recording(make_turns(recording.duration))
+    with FakeVoskServer(bandwidth=BANDWIDTH) as server:
+        AudioTranscript(segments, pool_size=4, server_url=server.url).to_transcript()
+        sent = server.bytes
+    elapsed = time.perf_counter() - start
+    samples = recording.waveform["waveform"].numel()
+    return normalized, elapsed, sent, samples
+
+
+if __name__ == "__main__":
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 2.
+    print(f"{minutes:g} minutes of 48 kHz stereo audio, Vosk processing {BANDWIDTH / 1e6:g} MB/s per connection")
+    print(f"{'mode':<12}{'normalize s':>12}{'total s':>10}{'sent MB':>10}{'diarized samples':>18}")
+    for mode, normalize in (("as uploaded", False), ("16 kHz mono", True)):
+        normalized, elapsed, sent, samples = run(make_recording(minutes), normalize)
+        print(f"{mode:<12}{normalized:>12.3f}{elapsed:>10.3f}{sent / 1e6:>10.1f}{samples:>18}")
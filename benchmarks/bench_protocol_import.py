@@ -0,0 +1,40 @@
+"""
+Compares the import of historical protocols one by one with save_protocol
+and at once with save_protocols.
+The protocols are written to the test database of tests/docker-compose.yml,
+which must be running (docker compose -f tests/docker-compose.yml up db-test),
+and removed afterwards.
+Run from the git root directory with:
+    python -m benchmarks.bench_protocol_import [protocols]
+"""
+import random
+import sys
+import time
+
+from benchmarks.bench_database_pool import DB_CONFIG, make_protocol
+from src.utils.DataBaseConnection import DataBaseConnection
+
+ORGANIZATION = "bench_protocol_import"
+
+
+if __name__ == "__main__":
+    counts = [int(count) for count in sys.argv[1:]] or [100, 1000, 5000]
+    database = DataBaseConnection(**DB_CONFIG)
+    generator = random.Random(0)
+    try:
+        print(f"{'protocols':>10}{'mode':>8}{'seconds':>10}{'protocols/s':>13}")
+        for count in counts:
+            protocols = [make_protocol(generator) for _ in range(count)]
+            start = time.perf_counter()
+            for protocol in protocols:
+                database.save_protocol(protocol, ORGANIZATION)
+            single = time.perf_counter() - start
+            start = time.perf_counter()
+            database.save_protocols(protocols, ORGANIZATION)
+            bulk = time.perf_counter() - start
+            for mode, elapsed in (("single", single), ("bulk", bulk)):
+                print(f"{count:>10}{mode:>8}{elapsed:>10.2f}{count / elapsed:>13.0f}")
+    finally:
+        with database.cursor() as cursor:
+            cursor.execute("DELETE FROM ProtocolMetadata WHERE organization = %s", (ORGANIZATION,))
+        database.close()
@@ -0,0 +1,75 @@
+"""
+Compares get_protocol_summaries, which aggregates the agenda items in a single query,
+with the former two queries matching every item with every protocol in Python,
+for organizations with more and more protocols.
+The protocols are written to the test database of tests/docker-compose.yml,
+which must be running (docker compose -f tests/docker-compose.yml up db-test),
+and removed afterwards.
+Run from the git root directory with:
+    python -m benchmarks.bench_protocol_summaries [protocols]
+"""
+import random
+import sys
+import time
+
+from benchmarks.bench_database_pool import DB_CONFIG, make_protocol
+from src.utils.DataBaseConnection import DataBaseConnection
+
+ORGANIZATION = "bench_protocol_summaries"
+
+
+def former_summaries(database: DataBaseConnection, organization: str) -> list:
+    with database.cursor() as cursor:
+        cursor.execute(
+            "SELECT p.id, p.title, p.date, p.place, p.numberofattendees "
+            "FROM ProtocolMetadata p WHERE organization = %s;",
+            (organization,),
+        )
+        datas = cursor.fetchall()
+        cursor.execute(
+            "SELECT p.id, a.title, a.explanation FROM protocolmetadata p, agendaitem a "
+            "WHERE organization = %s AND p.id = a.id;",
+            (organization,),
+        )
+        items = cursor.fetchall()
+    return [
+        {
+            "id": d[0],
+            "title": d[1],
+            "date": d[2],
+            "place": d[3],
+            "numberOfAttendees": d[4],
+            "agendaItems": [{'title': item[1], 'explanation': item[2]} for item in items if item[0] == d[0]],
+        }
+        for d in datas
+    ]
+
+
+def measure(function, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    counts = [int(count) for count in sys.argv[1:]] or [100, 1000, 5000]
+    database = DataBaseConnection(**DB_CONFIG)
+    generator = random.Random(0)
+    saved = 0
+    try:
+        print(f"{'protocols':>10}{'items':>8}{'former s':>10}{'single s':>10}")
+        for count in sorted(counts):
+            database.save_protocols([make_protocol(generator) for _ in range(count - saved)], ORGANIZATION)
+            saved = count
+            summaries = database.get_protocol_summaries(ORGANIZATION)
+            items = sum(len(summary["agendaItems"]) for summary in summaries)
+            former = measure(lambda: former_summaries(database, ORGANIZATION))
+            single = measure(lambda: database.get_protocol_summaries(ORGANIZATION))
+            print(f"{count:>10}{items:>8}{former:>10.3f}{single:>10.3f}")
+    finally:
+        with database.cursor() as cursor:
+            cursor.execute("DELETE FROM ProtocolMetadata WHERE organization = %s", (ORGANIZATION,))
+        database.close()
@@ -0,0 +1,91 @@
+"""
+Compares the memory and latency of loading an uploaded WAV recording
+with the former double decode (pydub and torchaudio on a copy of the upload)
+and with the single decode of Recording.from_file.
+Every measurement runs in a fresh process to read its peak resident memory.
+Run from the git root directory with:
+    python -m benchmarks.bench_recording_load [durations in minutes]
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from io import BytesIO
+
+import numpy as np
+
+
+def write_wav(path: str, minutes: float, sample_rate: int = 16000) -> None:
+    generator = np.random.default_rng(0)
+    with wave.open(path, "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(sample_rate)
+        # Written by minutes to keep the memory of the parent process low
+        for _ in range(int(np.ceil(minutes))):
+            samples = generator.integers(-3000, 3000, sample_rate * 60, dtype=np.int16)
+            file.writeframes(samples.tobytes())
+
+
+def load_twice(file):
+    import torchaudio
+    from pydub import AudioSegment
+
+    read_audio = file.read()
+    content = AudioSegment.from_file(BytesIO(read_audio), format="wav")
+    waveform = torchaudio.load(BytesIO(read_audio))
+    return content, waveform
+
+
+def load_once(file):
+    from src.utils import Recording
+
+    return Recording.from_file(file, ".wav")
+
+
+def measure(mode: str, path: str) -> None:
+    """
+    Loads the file in the current process and prints the latency
+    and the peak resident memory added by the loading.
+    """
+    import torchaudio  # noqa: F401
+    from pydub import AudioSegment  # noqa: F401
+
+    from src.utils import Recording  # noqa: F401
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with open(path, "rb") as file:
+        loaded = load_twice(file) if mode == "twice" else load_once(file)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    del loaded
+    print(f"{elapsed} {(peak - baseline) / 1024}")
+
+
+def run(mode: str, path: str) -> tuple[float, float]:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_recording_load", "--measure", mode, path],
+        check=True, capture_output=True, text=True,
+    ).stdout.split()
+    return float(output[0]), float(output[1])
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3])
+        sys.exit()
+    durations = [float(minutes) for minutes in sys.argv[1:]] or [1, 30, 120]
+    print(f"{'minutes':>8}{'file MB':>10}{'mode':>8}{'seconds':>10}{'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for minutes in durations:
+            path = os.path.join(directory, f"{minutes}.wav")
+            write_wav(path, minutes)
+            size = os.path.getsize(path) / 2 ** 20
+            for mode in ("twice", "once"):
+                elapsed, peak = run(mode, path)
+                print(f"{minutes:>8g}{size:>10.1f}{mode:>8}{elapsed:>10.3f}{peak:>10.1f}")
+            os.remove(path)
@@ -0,0 +1,73 @@
+"""
+Compares the transcription of the raw speaker turns of synthetic meetings
+with the transcription of the segments planned by SegmentPlanner,
+against a local fake Vosk server with a network round-trip, a handshake
+and a limited number of bytes processed per second on each connection.
+The meetings alternate bursts of short turns, often of the same speaker,
+with a few monologues of several minutes.
+Run from the git root directory with:
+    python -m benchmarks.bench_segment_planner [minutes]
+"""
+import sys
+import time
+
+import numpy as np
+import torch
+
+from src.utils import AudioTranscript, Recording, SegmentPlanner
+from tests.fake_vosk_server import FakeVoskServer
+
+SAMPLE_RATE = 16000
+# Bytes processed per second on each connection
+BANDWIDTH = 4e5
+
+
+def make_meeting(minutes: float, seed: int = 0) -> tuple[Recording, list[tuple[str, float, float]]]:
+    """
+    Generates a recording of tone bursts separated by short pauses, like speech, and its turns.
+    """
+    generator = np.random.default_rng(seed)
+    duration = minutes * 60
+    turns = []
+    position = 0.
+    speaker = 0
+    while position < duration:
+        if generator.random() < 0.03:
+            length = generator.uniform(120, 300)
+        else:
+            length = generator.uniform(0.3, 2.)
+        end = min(position + length, duration)
+        turns.append((f"SPEAKER_{speaker:02}", position, end))
+        position = end + generator.uniform(0.1, 0.8)
+        if generator.random() < 0.4:
+            speaker = int(generator.integers(0, 4))
+    waveform = np.zeros(int(duration * SAMPLE_RATE), dtype=np.float32)
+    position = 0.
+    while position < duration:
+        start, end = int(position * SAMPLE_RATE), int((position + generator.uniform(0.2, 1.5)) * SAMPLE_RATE)
+        waveform[start:end] = 0.3 * np.sin(2 * np.pi * 200 * np.arange(end - start) / SAMPLE_RATE)[:len(waveform[start:end])]
+        position = end / SAMPLE_RATE + generator.uniform(0.1, 0.4)
+    return Recording(".wav", None, (torch.from_numpy(waveform).unsqueeze(0), SAMPLE_RATE)), turns
+
+
+def run(recording: Recording, turns: list[tuple[str, float, float]]) -> float:
+    segments = recording.trim_recording(turns)
+    with FakeVoskServer(latency=0.005, handshake_latency=0.02, bandwidth=BANDWIDTH) as server:
+        start = time.perf_counter()
+        AudioTranscript(segments, pool_size=4, server_url=server.url).to_transcript()
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 20.
+    print(f"{minutes:g} minute meetings, 4 connections, Vosk processing {BANDWIDTH / 1e3:g} kB/s per connection")
+    print(f"{'meeting':<9}{'mode':<9}{'segments':>10}{'longest s':>11}{'planning s':>12}{'total s':>10}")
+    for seed in range(3):
+        recording, turns = make_meeting(minutes, seed)
+        start = time.perf_counter()
+        planned = SegmentPlanner().plan(recording, turns)
+        planning = time.perf_counter() - start
+        for mode, segments, overhead in (("turns", turns, 0.), ("planned", planned, planning)):
+            longest = max(end - start for _, start, end in segments)
+            elapsed = run(recording, segments) + overhead
+            print(f"{seed:<9}{mode:<9}{len(segments):>10}{longest:>11.1f}{overhead:>12.3f}{elapsed:>10.2f}")
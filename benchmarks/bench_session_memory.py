@@ -0,0 +1,87 @@
+"""
+Compares the memory held by the sessions of the server once their transcript is generated,
+when the handler keeps its audio (the former behaviour), releases it,
+or spills it to disk to retain it for re-processing (AUDIO_RETENTION_SECONDS).
+The diarization and Vosk are replaced by stand-ins which read the audio like them,
+and every mode runs in a fresh process to read its resident memory.
+Run from the git root directory with:
+    python -m benchmarks.bench_session_memory [minutes] [sessions]
+"""
+import gc
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.bench_recording_load import write_wav
+
+MODES = {"kept": None, "released": "0", "spilled": "600"}
+
+
+def resident_mb() -> float:
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def measure(mode: str, path: str, sessions: int) -> None:
+    """
+    Generates the transcript of the recording in as many sessions held at once,
+    and prints the audio held by a session at the end of the transcription and afterwards,
+    and the resident memory added by the sessions.
+    """
+    from src.rest.ProtocolHandler import ProtocolHandler
+    from src.utils import Annotation, AudioTranscript, PipelineRegistry, ResultCache
+
+    def annotate(self, recording):
+        # The diarization pipeline reads the waveform of the whole recording
+        recording.waveform
+        self._is_done = True
+        return [(f"SPEAKER_0{i % 2}", i * 5., i * 5. + 4.) for i in range(int(recording.duration // 5))]
+
+    async def process_with_vosk(self):
+        transcribed[0] = handlers[-1].memory_bytes
+        return [(speaker, str(len(recording.pcm))) for speaker, recording in self._transcript]
+
+    PipelineRegistry._load = classmethod(lambda cls, model, device: object())
+    Annotation.annotate = annotate
+    AudioTranscript._process_with_vosk = process_with_vosk
+    ProtocolHandler.__result_cache__ = ResultCache(tempfile.gettempdir(), 0)
+    if MODES[mode] is None:
+        setattr(ProtocolHandler, "_ProtocolHandler__retain_audio", lambda self: None)
+    else:
+        os.environ["AUDIO_RETENTION_SECONDS"] = MODES[mode]
+    os.environ["VAD_THRESHOLD_DB"] = "-inf"
+
+    handlers = []
+    transcribed = [0]
+    gc.collect()
+    baseline = resident_mb()
+    for _ in range(sessions):
+        handlers.append(ProtocolHandler())
+        handlers[-1].generate_transcript(path)
+    gc.collect()
+    print(f"{transcribed[0] / 2 ** 20} {handlers[-1].memory_bytes / 2 ** 20} {resident_mb() - baseline}")
+
+
+def run(mode: str, path: str, sessions: int) -> list[float]:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_session_memory", "--measure", mode, path, str(sessions)],
+        check=True, capture_output=True, text=True,
+    ).stdout.split()
+    return [float(value) for value in output[-3:]]
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+        sys.exit()
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 30.
+    sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print(f"{minutes:g} minute 44.1 kHz recordings, {sessions} sessions held at once")
+    print(f"{'mode':<10}{'transcribing MB':>17}{'after MB':>10}{'resident MB':>13}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "recording.wav")
+        write_wav(path, minutes, sample_rate=44100)
+        for mode in MODES:
+            transcribing, after, resident = run(mode, path, sessions)
+            print(f"{mode:<10}{transcribing:>17.1f}{after:>10.1f}{resident:>13.1f}")
@@ -0,0 +1,44 @@
+"""
+Compares the serial transcription (one connection per segment) with the pooled
+concurrent transcription against a local fake Vosk server.
+Run from the git root directory with:
+    python -m benchmarks.bench_vosk_pool [number of segments]
+"""
+import sys
+import time
+
+import torch
+
+from src.utils import AudioTranscript, Recording
+from tests.fake_vosk_server import FakeVoskServer
+
+
+def make_segments(n: int, sample_rate: int = 16000) -> list[tuple[str, Recording]]:
+    generator = torch.Generator().manual_seed(0)
+    return [
+        (f"SPEAKER_{i % 3:02}",
+         Recording(".wav", None, (torch.rand(1, int(sample_rate * (0.5 + 2.5 * torch.rand(1, generator=generator).item())),
+                                             generator=generator) * 0.2 - 0.1, sample_rate)))
+        for i in range(n)
+    ]
+
+
+def run(segments, pool_size: int, latency: float, handshake_latency: float) -> float:
+    with FakeVoskServer(latency=latency, handshake_latency=handshake_latency) as server:
+        transcript = AudioTranscript(segments, pool_size=pool_size, server_url=server.url)
+        start = time.perf_counter()
+        result = transcript.to_transcript()
+        elapsed = time.perf_counter() - start
+    assert len(transcript.processed_result) == len(segments), result
+    return elapsed
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    segments = make_segments(n)
+    print(f"{n} segments, simulated round-trip 2 ms, simulated handshake 10 ms")
+    print(f"{'mode':<12}{'seconds':>10}{'segments/s':>14}")
+    for pool_size in [0, 1, 2, 4, 8]:
+        elapsed = run(segments, pool_size, latency=0.002, handshake_latency=0.01)
+        mode = "serial" if pool_size == 0 else f"pool {pool_size}"
+        print(f"{mode:<12}{elapsed:>10.2f}{n / elapsed:>14.1f}")
@@ -0,0 +1,35 @@
+"""
+Compares sending the audio chunks in lockstep with their results (window 1)
+with the pipelined streaming of chunks (window > 1) against a local fake Vosk server.
+Run from the git root directory with:
+    python -m benchmarks.bench_vosk_streaming [number of segments]
+"""
+import sys
+import time
+
+from benchmarks.bench_vosk_pool import make_segments
+from src.utils import AudioTranscript
+from tests.fake_vosk_server import FakeVoskServer
+
+
+def run(segments, pool_size: int, window: int, chunk_seconds: float, latency: float) -> float:
+    with FakeVoskServer(latency=latency, processing=0.0002) as server:
+        transcript = AudioTranscript(segments, pool_size=pool_size, server_url=server.url,
+                                     window=window, chunk_seconds=chunk_seconds)
+        start = time.perf_counter()
+        transcript.to_transcript()
+        elapsed = time.perf_counter() - start
+    assert len(transcript.processed_result) == len(segments)
+    return elapsed
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    segments = make_segments(n)
+    print(f"{n} segments of 0.5 to 3 seconds, simulated round-trip 5 ms")
+    print(f"{'pool':>5}{'chunk (s)':>11}{'window':>8}{'seconds':>10}{'segments/s':>14}")
+    for pool_size in [1, 4]:
+        for chunk_seconds in [0.2, 0.5]:
+            for window in [1, 4, 16]:
+                elapsed = run(segments, pool_size, window, chunk_seconds, latency=0.005)
+                print(f"{pool_size:>5}{chunk_seconds:>11}{window:>8}{elapsed:>10.2f}{n / elapsed:>14.1f}")
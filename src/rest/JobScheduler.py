@@ -0,0 +1,352 @@
+import multiprocessing
+import os
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from src.rest.JobStore import JobStore
+from src.rest.ProtocolHandler import ProtocolHandler
+from src.utils.Metrics import Metrics
+from src.utils.PipelineRegistry import PipelineRegistry
+from src.utils.TextTranscript import TextTranscript
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ThreadBackend:
+    """
+    Runs the transcript generation in the scheduler's worker thread.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+
+    def run(self, protocol: ProtocolHandler, audio: str, extension: str) -> None:
+        transcript = protocol.generate_transcript(audio, extension)
+        if transcript is None and not protocol.transcript_generation_done:
+            protocol.set_generated_transcript(None)
+
+    def shutdown(self) -> None:
+        pass
+
+
+_progress_queue = None
+
+
+def _init_worker(progress_queue) -> None:
+    global _progress_queue
+    _progress_queue = progress_queue
+    try:
+        PipelineRegistry.get(device="cpu")
+    except Exception as e:
+        print(f"Could not load the diarization pipeline in the worker: {e}")
+
+
+def _report_progress(job_id: str, handler: ProtocolHandler, stop: threading.Event) -> None:
+    while not stop.wait(ProcessBackend.__report_interval__):
+        _progress_queue.put((
+            job_id,
+            handler.annotation_done,
+            handler.transcript_generation_percentage,
+            list(handler.transcript_generation_result),
+        ))
+
+
+def _transcribe_in_process(job_id: str, audio: str, extension: str) -> list[tuple[str, str]] | None:
+    handler = ProtocolHandler()
+    stop = threading.Event()
+    reporter = threading.Thread(target=_report_progress, args=(job_id, handler, stop), daemon=True)
+    reporter.start()
+    try:
+        transcript = handler.generate_transcript(audio, extension)
+    finally:
+        stop.set()
+        reporter.join()
+    if transcript is None or handler.transcript_generation_percentage < 0:
+        return None
+    return transcript.transcript
+
+
+class ProcessBackend:
+    """
+    Runs the transcript generation in a pool of worker processes,
+    so that diarization does not hold the GIL of the web process.
+    Each worker loads the diarization pipeline once when it starts.
+    The workers read the uploaded audio from its spooled file,
+    and they periodically report their progress back to the web process.
+    The workers are forked when the backend is created, which must
+    therefore happen before the server starts other threads.
+    """
+
+    __report_interval__ = 0.5
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        context = multiprocessing.get_context("fork")
+        self._progress_queue = context.Queue()
+        self._protocols: dict[str, ProtocolHandler] = {}
+        self._protocols_lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._progress_queue,),
+        )
+        self._executor.submit(int).result()
+        self._listener = threading.Thread(target=self._listen, daemon=True)
+        self._listener.start()
+
+    def _listen(self) -> None:
+        while True:
+            message = self._progress_queue.get()
+            if message is None:
+                return
+            job_id, annotation_done, percentage, result = message
+            with self._protocols_lock:
+                protocol = self._protocols.get(job_id)
+                if protocol is not None:
+                    protocol.update_progress(annotation_done, percentage, False, result)
+
+    def run(self, protocol: ProtocolHandler, audio: str, extension: str) -> None:
+        with self._protocols_lock:
+            self._protocols[protocol.id] = protocol
+        try:
+            result = self._executor.submit(_transcribe_in_process, protocol.id, audio, extension).result()
+        except Exception:
+            traceback.print_exc()
+            result = None
+        finally:
+            with self._protocols_lock:
+                self._protocols.pop(protocol.id, None)
+        if result is None:
+            protocol.set_generated_transcript(None)
+        else:
+            protocol.set_generated_transcript(TextTranscript(result))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._progress_queue.put(None)
+
+
+class JobScheduler:
+    """
+    A bounded scheduler for transcript generation jobs.
+    Jobs are queued per subject and dispatched round-robin between subjects,
+    so that a single user uploading many recordings does not starve the others.
+    At most `workers` jobs run concurrently, and at most `max_queued`
+    (resp. `max_queued_per_subject`) jobs wait to be run.
+    The uploaded audio of a job is a spooled file, removed once the job has run.
+    If a job store is given, the state of the jobs is saved to it when they are submitted and when they end,
+    and, if the store is shared with other processes, periodically while they wait and run
+    (the saves telling that the process is alive).
+    """
+
+    __persist_interval__ = 0.5
+
+    __backends__ = {"thread": ThreadBackend, "process": ProcessBackend}
+
+    def __init__(
+        self,
+        workers: int = 1,
+        backend: str = "thread",
+        max_queued: int = 16,
+        max_queued_per_subject: int = 4,
+        store: JobStore | None = None,
+    ):
+        if backend not in JobScheduler.__backends__:
+            raise ValueError(f"Backend {backend} not supported for the moment")
+        self._backend_name = backend
+        self._backend = JobScheduler.__backends__[backend](workers)
+        self._max_queued = max_queued
+        self._max_queued_per_subject = max_queued_per_subject
+        self._queues: dict[str, deque] = {}
+        self._subjects: deque[str] = deque()
+        self._running: set[str] = set()
+        # The protocol, subject, audio and extension of the queued and running jobs
+        self._jobs: dict[str, tuple[ProtocolHandler, str, str, str]] = {}
+        self._store = store
+        # Saves are serialized, so that a periodic save cannot overwrite the final state of a job
+        self._persist_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        # The pool of the process holds the progress of its jobs, which only the other processes read from the store
+        if store is not None and store.persistent:
+            self._threads.append(threading.Thread(target=self._persist_periodically, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    @classmethod
+    def from_environment(cls, store: JobStore | None = None) -> "JobScheduler":
+        return cls(
+            workers=int(os.environ.get("PROTOGEN_WORKERS", 1)),
+            backend=os.environ.get("PROTOGEN_WORKER_BACKEND", "thread"),
+            max_queued=int(os.environ.get("PROTOGEN_MAX_QUEUED", 16)),
+            max_queued_per_subject=int(os.environ.get("PROTOGEN_MAX_QUEUED_PER_SUBJECT", 4)),
+            store=store,
+        )
+
+    @property
+    def backend(self) -> str:
+        return self._backend_name
+
+    @property
+    def queued(self) -> int:
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def submit(
+        self,
+        protocol: ProtocolHandler,
+        subject: str,
+        audio: str,
+        lock: threading.Lock,
+        extension: str = ".wav",
+    ) -> int:
+        """
+        Queues the transcript generation of the given protocol.
+        :param protocol: The protocol handler whose transcript is generated.
+        :param subject: The user who uploaded the recording.
+        :param audio: The path of the spooled audio file, owned by the scheduler from now on.
+        :param lock: The lock of the protocol held while generating the transcript.
+        :param extension: The extension of the uploaded audio file.
+        :return: The position of the job in the queue (1 being the next job to run).
+        :raises QueueFullError: if the global or the per-subject queue is full.
+        """
+        with self._condition:
+            queue = self._queues.get(subject, deque())
+            if sum(len(q) for q in self._queues.values()) >= self._max_queued:
+                Metrics.increment("scheduler.rejected")
+                raise QueueFullError("Too many recordings are waiting to be processed.")
+            if len(queue) >= self._max_queued_per_subject:
+                Metrics.increment("scheduler.rejected")
+                raise QueueFullError("You have too many recordings waiting to be processed.")
+            if subject not in self._queues:
+                self._queues[subject] = queue
+                self._subjects.append(subject)
+            queue.append((protocol, audio, lock, extension))
+            self._jobs[protocol.id] = protocol, subject, audio, extension
+            self._update_gauges()
+            self._condition.notify()
+            position = self._position(protocol.id)
+        self._persist(protocol.id)
+        return position
+
+    def position(self, job_id: str) -> int | None:
+        """
+        Returns the position of a job in the queue: 0 if it is running,
+        1 if it is the next one to run, ..., and None if the job is unknown
+        or already finished.
+        """
+        with self._condition:
+            if job_id in self._running:
+                return 0
+            return self._position(job_id)
+
+    def _position(self, job_id: str) -> int | None:
+        for rank, subject in enumerate(self._subjects):
+            queue = self._queues[subject]
+            for index, (protocol, *_) in enumerate(queue):
+                if protocol.id != job_id:
+                    continue
+                before = 0
+                for other_rank, other in enumerate(self._subjects):
+                    length = len(self._queues[other])
+                    before += min(length, index)
+                    if other_rank < rank and length > index:
+                        before += 1
+                return before + 1
+        return None
+
+    def _next(self):
+        subject = self._subjects.popleft()
+        queue = self._queues[subject]
+        job = queue.popleft()
+        if queue:
+            self._subjects.append(subject)
+        else:
+            self._queues.pop(subject)
+        return job
+
+    def _update_gauges(self) -> None:
+        Metrics.set_gauge("scheduler.queued", sum(len(q) for q in self._queues.values()))
+        Metrics.set_gauge("scheduler.running", len(self._running))
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._subjects and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                protocol, audio, lock, extension = self._next()
+                self._running.add(protocol.id)
+                self._update_gauges()
+            try:
+                with lock, Metrics.timer("scheduler.job"):
+                    self._backend.run(protocol, audio, extension)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                _remove(audio)
+                self._persist(protocol.id)
+                with self._condition:
+                    self._running.discard(protocol.id)
+                    self._jobs.pop(protocol.id, None)
+                    self._update_gauges()
+
+    def _persist(self, job_id: str) -> None:
+        """
+        Saves the state of a job to the store, with its audio and its position in the queue.
+        """
+        if self._store is None:
+            return
+        with self._persist_lock:
+            with self._condition:
+                if job_id not in self._jobs:
+                    return
+                protocol, subject, audio, extension = self._jobs[job_id]
+                position = 0 if job_id in self._running else self._position(job_id)
+            state = protocol.state()
+            state.update({"audio": audio, "extension": extension, "queuePosition": position})
+            try:
+                version = self._store.save(subject, state)
+                # Otherwise the transcript was edited meanwhile, and the edited state is kept
+                if version is not None:
+                    protocol.version = version
+            except Exception:
+                traceback.print_exc()
+
+    def _persist_periodically(self) -> None:
+        while True:
+            with self._condition:
+                if self._condition.wait_for(lambda: self._stopped, JobScheduler.__persist_interval__):
+                    return
+                jobs = list(self._jobs)
+            for job_id in jobs:
+                self._persist(job_id)
+
+    def shutdown(self) -> None:
+        with self._condition:
+            self._stopped = True
+            # The jobs of a persistent store are resumed from their audio after a restart
+            if self._store is None or not self._store.persistent:
+                for queue in self._queues.values():
+                    for _, audio, _, _ in queue:
+                        _remove(audio)
+            self._queues.clear()
+            self._subjects.clear()
+            self._condition.notify_all()
+        self._backend.shutdown()
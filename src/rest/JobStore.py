@@ -0,0 +1,109 @@
+import copy
+import os
+import threading
+import time
+
+
+class JobStore:
+    """
+    The store of the state of the transcript generation jobs: their progress, transcript and protocol,
+    so that any process of the server can answer for a job, and the jobs outlive the process running them.
+    This default store keeps the states in memory and is therefore limited to a single process.
+    A state is a JSON-serializable dict holding at least the "id" of the job and whether it is "done".
+    Every save increments the "version" of the state, so that a process never overwrites
+    a state saved by another process since it read it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: dict[str, tuple[str, dict, float]] = {}
+
+    @staticmethod
+    def from_environment(database=None) -> "JobStore":
+        """
+        Creates the store given by the environment variable JOB_STORE:
+        "memory" (the default), "sqlite:///<path of the database file>",
+        or "postgres" for the database of the server.
+        :param database: The DataBaseConnection of the database of the server.
+        """
+        from src.rest.SqlJobStore import SqlJobStore
+
+        store = os.environ.get("JOB_STORE", "memory")
+        if store == "memory":
+            return JobStore()
+        if store.startswith("sqlite:///"):
+            return SqlJobStore.sqlite(store[len("sqlite:///"):])
+        if store == "postgres":
+            return SqlJobStore.postgres(database)
+        raise ValueError(f"Job store {store} not supported for the moment")
+
+    @property
+    def persistent(self) -> bool:
+        """
+        Whether the states outlive the process.
+        """
+        return False
+
+    def save(self, subject: str, state: dict) -> int | None:
+        """
+        Saves the state of a job, replacing the previous one if the state is based on it,
+        i.e. if its "version" (0 if missing) is the version of the saved state.
+        Otherwise another process saved the job meanwhile, and the state is discarded.
+        :param subject: The user who uploaded the recording of the job.
+        :param state: The state of the job.
+        :return: The version of the saved state, or None if the state was discarded.
+        """
+        with self._lock:
+            entry = self._states.get(state["id"])
+            version = state.get("version", 0)
+            if entry is not None and entry[1]["version"] != version:
+                return None
+            self._states[state["id"]] = subject, {**copy.deepcopy(state), "version": version + 1}, time.time()
+            return version + 1
+
+    def get(self, job_id: str, subject: str) -> dict | None:
+        """
+        Returns the state of a job of the user, with its version, or None if there is none.
+        """
+        with self._lock:
+            entry = self._states.get(job_id)
+            if entry is None or entry[0] != subject:
+                return None
+            return copy.deepcopy(entry[1])
+
+    def delete(self, job_id: str, subject: str) -> None:
+        with self._lock:
+            entry = self._states.get(job_id)
+            if entry is not None and entry[0] == subject:
+                del self._states[job_id]
+
+    def claim_stale(self, stale_seconds: float) -> list[tuple[str, dict]]:
+        """
+        Claims the unfinished jobs whose state was not saved for the given time,
+        i.e. whose process stopped. A job is claimed by a single caller,
+        its state being saved again in the same operation.
+        :return: The (subject, state) of the claimed jobs.
+        """
+        now = time.time()
+        with self._lock:
+            claimed = []
+            for job_id, (subject, state, updated) in self._states.items():
+                if not state["done"] and updated < now - stale_seconds:
+                    self._states[job_id] = subject, state, now
+                    claimed.append((subject, copy.deepcopy(state)))
+            return claimed
+
+    def delete_expired(self, ttl: float) -> int:
+        """
+        Deletes the finished jobs whose state was not saved for the given time, e.g. abandoned sessions,
+        so that the transcripts of the users are not kept forever.
+        :return: The number of deleted jobs.
+        """
+        expires = time.time() - ttl
+        with self._lock:
+            expired = [
+                job_id for job_id, (_, state, updated) in self._states.items() if state["done"] and updated < expires
+            ]
+            for job_id in expired:
+                del self._states[job_id]
+            return len(expired)
@@ -3,15 +3,26 @@ import copy
 import hashlib
 import hmac
 import json
+import os
 import secrets
+import time
 
-from src.utils import (Annotation, AudioTranscript, FunctionTool, OpenAIClient,
-                       Recording, TextTranscript)
+from src.utils import (AlignedTranscript, Annotation, AudioTranscript, FunctionTool,
+                       OpenAIClient, Recording, ResultCache, SegmentPlanner, StreamingTranscript,
+                       TextTranscript, VoiceActivity)
 
 
 class ProtocolHandler:
     __C = 0
     __SECRET_KEY__ = bytes(secrets.token_hex(32), 'utf-8')
+    __result_cache__ = ResultCache.from_environment()
+    # The environment variables the generated transcript depends on, besides the recording and the model
+    __transcript_settings__ = [
+        "TRANSCRIPTION_MODE", "VOSK_HOST_URI", "VOSK_CHUNK_SECONDS",
+        "DIARIZATION_WINDOW_SECONDS", "DIARIZATION_OVERLAP_SECONDS",
+        "VAD_THRESHOLD_DB", "VAD_PADDING_SECONDS",
+        "SEGMENT_MAX_GAP_SECONDS", "SEGMENT_TARGET_SECONDS", "SEGMENT_MAX_SECONDS",
+    ]
 
     def __init__(self):
         self._recording: Recording | None = None
@@ -19,6 +30,12 @@ class ProtocolHandler:
         self._transcript: TextTranscript | None = None
         self._protocol: dict | None = None
         self._audio_transcript : AudioTranscript | None = None
+        # Progress reported from outside this handler, e.g. by a worker process
+        self._progress: dict | None = None
+        # When the audio retained after the transcript generation is released
+        self._audio_expires: float | None = None
+        # The version of the state of the handler in the job store
+        self.version = 0
         hash_object = hmac.new(
             ProtocolHandler.__SECRET_KEY__,
             f"{ProtocolHandler.__C:03}".encode(),
@@ -28,6 +45,39 @@ class ProtocolHandler:
         self._id = base64.urlsafe_b64encode(hash_digest).decode().rstrip("=")
         ProtocolHandler.__C += 1
 
+    @classmethod
+    def from_state(cls, state: dict) -> "ProtocolHandler":
+        """
+        Rehydrates a handler from its state, e.g. saved by another process.
+        """
+        handler = cls()
+        handler._id = state["id"]
+        handler.update_progress(state["annotation_done"], state["percentage"], state["done"],
+                                [tuple(segment) for segment in state["result"]])
+        if state["transcript"] is not None:
+            handler._transcript = TextTranscript([tuple(segment) for segment in state["transcript"]])
+        handler._protocol = state["protocol"]
+        handler.version = state.get("version", 0)
+        return handler
+
+    def state(self) -> dict:
+        """
+        Returns the JSON-serializable state of the handler: its progress, transcript and protocol.
+        """
+        percentage = self.transcript_generation_percentage
+        # The transcription may end shortly before the transcript is set
+        done = self.transcript_generation_done and (self._transcript is not None or percentage < 0)
+        return {
+            "id": self._id,
+            "annotation_done": self.annotation_done,
+            "percentage": percentage,
+            "done": done,
+            "result": [list(segment) for segment in self.transcript_generation_result],
+            "transcript": None if self._transcript is None else [list(s) for s in self._transcript.transcript],
+            "protocol": self.protocol,
+            "version": self.version,
+        }
+
     @property
     def id(self):
         return self._id
@@ -36,33 +86,98 @@ class ProtocolHandler:
     def transcript(self) -> TextTranscript:
         return self._transcript
 
+    @property
+    def recording(self) -> Recording | None:
+        """
+        The normalized recording, until its audio is released.
+        """
+        return self._recording
+
     @property
     def protocol(self):
         return copy.deepcopy(self._protocol)
 
+    # The audio may be released concurrently, which is why the properties below read it once
+
     @property
     def transcript_generation_done(self) -> bool:
-        if self._audio_transcript is None:
-            return False
-        return self._audio_transcript.process_ended
+        audio_transcript = self._audio_transcript
+        if audio_transcript is None:
+            return self._progress is not None and self._progress["done"]
+        return audio_transcript.process_ended
 
     @property
     def transcript_generation_percentage(self) -> float:
-        if self._audio_transcript is None:
-            return 0.
-        return self._audio_transcript.process_perc
+        audio_transcript = self._audio_transcript
+        if audio_transcript is None:
+            return 0. if self._progress is None else self._progress["percentage"]
+        return audio_transcript.process_perc
 
     @property
     def transcript_generation_result(self) -> list[tuple[str, str]]:
-        if self._audio_transcript is None:
-            return []
-        return self._audio_transcript.processed_result
+        audio_transcript = self._audio_transcript
+        if audio_transcript is None:
+            return [] if self._progress is None else self._progress["result"]
+        return audio_transcript.processed_result
 
     @property
     def annotation_done(self) -> bool:
-        if self._annotation is None:
+        annotation = self._annotation
+        if annotation is None:
+            return self._progress is not None and self._progress["annotation_done"]
+        return annotation.is_done
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        The memory held by the audio of the handler: its recording and the segments being transcribed.
+        """
+        recording, audio_transcript = self._recording, self._audio_transcript
+        nbytes = 0 if recording is None else recording.nbytes
+        return nbytes + (0 if audio_transcript is None else audio_transcript.nbytes)
+
+    @property
+    def retained_bytes(self) -> int:
+        """
+        The size of the audio retained after the transcript generation in a memory-mapped file,
+        which occupies the disk and the page cache instead of the memory of the process.
+        """
+        recording, expires = self._recording, self._audio_expires
+        return 0 if recording is None or expires is None else recording.pcm.nbytes
+
+    def release_audio(self) -> None:
+        """
+        Releases the recording and the audio transcript, keeping the progress of the transcript generation.
+        """
+        self.update_progress(self.annotation_done, self.transcript_generation_percentage,
+                             self.transcript_generation_done, self.transcript_generation_result)
+        self._audio_transcript = None
+        self._annotation = None
+        self._recording = None
+        self._audio_expires = None
+
+    def release_expired_audio(self) -> bool:
+        """
+        Releases the audio retained after the transcript generation once its retention time elapsed.
+        :return: Whether the audio was released.
+        """
+        if self._audio_expires is None or time.monotonic() < self._audio_expires:
             return False
-        return self._annotation.is_done
+        self.release_audio()
+        return True
+
+    def __retain_audio(self) -> None:
+        """
+        Ends the audio stage once the transcript is generated: only the transcript is needed afterwards,
+        so the audio is released, or spilled to a memory-mapped file for AUDIO_RETENTION_SECONDS
+        (0 if not set) to be re-processed.
+        """
+        retention = float(os.environ.get("AUDIO_RETENTION_SECONDS", 0))
+        recording = self._recording
+        self.release_audio()
+        if retention > 0 and recording is not None:
+            self._recording = recording.spill(os.environ.get("PROTOGEN_SPOOL_DIR"))
+            self._audio_expires = time.monotonic() + retention
 
     @protocol.setter
     def protocol(self, value):
@@ -75,20 +190,100 @@ class ProtocolHandler:
         } == set(value.keys())
         self._protocol = value
 
-    def __create_audio_transcript(self, audio_file) -> None:
-        self._recording = Recording.from_file(audio_file)
+    def __load_recording(self, audio_file, extension: str) -> None:
+        if isinstance(audio_file, str):
+            recording = Recording.from_file_path(audio_file)
+        else:
+            recording = Recording.from_file(audio_file, extension)
+        # The diarization and the transcription both work on the 16 kHz mono recording
+        self._recording = recording.normalized()
+
+    def __annotate(self, digest: str | None) -> list[tuple[str, float, float]]:
+        cache = ProtocolHandler.__result_cache__
+        key = ResultCache.key(digest, "annotation", model=Annotation.__model__)
+        annotation = cache.get(key)
+        if annotation is not None:
+            self.update_progress(annotation_done=True, percentage=0., done=False)
+            return [tuple(turn) for turn in annotation]
         self._annotation = Annotation("cpu")
-        annotated_recording = self._annotation.annotate(self._recording)
-        trimmed_recordings = self._recording.trim_recording(annotated_recording)
-        self._audio_transcript = AudioTranscript(trimmed_recordings)
+        annotation = self._annotation.annotate(self._recording)
+        cache.put(key, annotation)
+        return annotation
+
+    def __create_audio_transcript(self, digest: str | None) -> None:
+        mode = os.environ.get("TRANSCRIPTION_MODE", "segments")
+        if mode == "streaming":
+            self._annotation = Annotation("cpu")
+            self._audio_transcript = StreamingTranscript(
+                self._recording, self._annotation, voice_activity=VoiceActivity(), planner=SegmentPlanner()
+            )
+            return
+        annotated_recording = self.__annotate(digest)
+        if mode == "full":
+            self._audio_transcript = AlignedTranscript(self._recording, annotated_recording)
+            return
+        segments = SegmentPlanner().plan(self._recording, annotated_recording)
+        trimmed_recordings = self._recording.trim_recording(segments)
+        # Only the speech of the turns is sent to Vosk
+        self._audio_transcript = AudioTranscript(VoiceActivity().filter(trimmed_recordings))
 
-    def generate_transcript(self, audio_file) -> TextTranscript:
+    def generate_transcript(self, audio_file, extension: str = ".wav") -> TextTranscript:
+        """
+        Generates the transcript of a recording.
+        The annotation and the transcript of a recording are cached by the hash of its decoded audio,
+        so that a recording uploaded again is not processed again.
+        The audio is released once the transcript is generated, or retained on disk for a while.
+        :param audio_file: The path of the recording's file, or a binary file object.
+        :param extension: The extension of the recording's file, if it is a file object.
+        """
         try:
-            self.__create_audio_transcript(audio_file)
+            self.__load_recording(audio_file, extension)
+            cache = ProtocolHandler.__result_cache__
+            digest = ResultCache.digest(self._recording) if cache.enabled else None
+            key = ResultCache.key(
+                digest, "transcript", model=Annotation.__model__,
+                **{name: os.environ.get(name) for name in ProtocolHandler.__transcript_settings__},
+            )
+            cached = cache.get(key)
+            if cached is not None:
+                self.set_generated_transcript(TextTranscript([tuple(segment) for segment in cached]))
+                return self._transcript
+            self.__create_audio_transcript(digest)
             self._transcript = self._audio_transcript.to_transcript()
+            if self._audio_transcript.process_perc >= 0:
+                cache.put(key, self._transcript.transcript)
             return self._transcript
         except Exception:
             pass
+        finally:
+            self.__retain_audio()
+
+    def update_progress(self, annotation_done: bool, percentage: float, done: bool,
+                        result: list[tuple[str, str]] | None = None) -> None:
+        """
+        Updates the progress of a transcript generated outside this handler.
+        :param annotation_done: Whether the speaker annotation is done.
+        :param percentage: The percentage of transcribed segments in [0, 1], or -1 on failure.
+        :param done: Whether the transcript generation ended.
+        :param result: The (speaker, text) segments transcribed so far.
+        """
+        self._progress = {
+            "annotation_done": annotation_done,
+            "percentage": percentage,
+            "done": done,
+            "result": result or [],
+        }
+
+    def set_generated_transcript(self, transcript: TextTranscript | None) -> None:
+        """
+        Sets the transcript generated outside this handler, None meaning that the generation failed.
+        """
+        if transcript is None:
+            self.update_progress(annotation_done=True, percentage=-1., done=True)
+            return
+        self._transcript = transcript
+        self.update_progress(annotation_done=True, percentage=1., done=True,
+                             result=transcript.transcript)
 
     def edit_transcript(self, transcript: list[tuple[str, str]] | str | dict):
         if self._transcript is None:
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+from src.rest.ProtocolHandler import ProtocolHandler
+from src.utils.Metrics import Metrics
+
+
+class ProtocolPool:
+    """
+    The protocol handlers of the sessions of this process, with their locks, by (protocol id, subject).
+    Abandoned sessions would otherwise keep their recording in memory forever, so the pool
+        * expires the finished sessions that were not accessed for a given time,
+        * releases the audio retained after the transcript generation once its retention time elapsed,
+        * releases the audio of the least recently used sessions whose transcript is generated
+          while the audio held by the pool exceeds its budget.
+    The audio of a session is released or spilled to a memory-mapped file when its transcript is generated,
+    so the budget mostly bounds the audio retained on disk: in memory, it is only a backstop,
+    the audio of the sessions being transcribed being never released.
+    The size of the pool and the bytes it holds are reported by the protocol_pool.* metrics.
+    """
+
+    def __init__(self, ttl: float, max_bytes: int, on_expire: Callable[[str, str], None] | None = None):
+        """
+        :param ttl: The time in seconds after which a finished session that is not accessed expires.
+        :param max_bytes: The budget of the audio held by the pool, in memory or retained on disk, in bytes.
+        :param on_expire: Called with the protocol id and the subject of every expired session.
+        """
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._on_expire = on_expire
+        self._lock = threading.Lock()
+        # The entries and the time of their last access, from the least to the most recently used
+        self._entries: OrderedDict[tuple[str, str], tuple[ProtocolHandler, threading.Lock, float]] = OrderedDict()
+
+    @classmethod
+    def from_environment(cls, on_expire: Callable[[str, str], None] | None = None) -> "ProtocolPool":
+        return cls(
+            ttl=float(os.environ.get("PROTOCOL_TTL_SECONDS", 3600)),
+            max_bytes=int(float(os.environ.get("PROTOCOL_POOL_MAX_MB", 1024)) * 2 ** 20),
+            on_expire=on_expire,
+        )
+
+    @property
+    def ttl(self) -> float:
+        return self._ttl
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, protocol_id: str, subject: str) -> tuple[ProtocolHandler, threading.Lock] | None:
+        """
+        Returns the handler of a session and its lock, marking the session as recently used,
+        or None if the pool does not hold the session.
+        """
+        with self._lock:
+            entry = self._entries.get((protocol_id, subject))
+            if entry is None:
+                return None
+            protocol, lock, _ = entry
+            self._entries[(protocol_id, subject)] = protocol, lock, time.monotonic()
+            self._entries.move_to_end((protocol_id, subject))
+            return protocol, lock
+
+    def put(self, protocol: ProtocolHandler, subject: str, lock: threading.Lock) -> None:
+        with self._lock:
+            self._entries[(protocol.id, subject)] = protocol, lock, time.monotonic()
+            self._entries.move_to_end((protocol.id, subject))
+            Metrics.set_gauge("protocol_pool.size", len(self._entries))
+
+    def setdefault(
+        self, protocol: ProtocolHandler, subject: str, lock: threading.Lock
+    ) -> tuple[ProtocolHandler, threading.Lock]:
+        """
+        Puts a session into the pool unless it already holds it.
+        :return: The handler of the session held by the pool and its lock.
+        """
+        with self._lock:
+            entry = self._entries.get((protocol.id, subject))
+            if entry is not None:
+                protocol, lock, _ = entry
+            self._entries[(protocol.id, subject)] = protocol, lock, time.monotonic()
+            self._entries.move_to_end((protocol.id, subject))
+            Metrics.set_gauge("protocol_pool.size", len(self._entries))
+            return protocol, lock
+
+    def pop(self, protocol_id: str, subject: str) -> tuple[ProtocolHandler, threading.Lock] | None:
+        with self._lock:
+            entry = self._entries.pop((protocol_id, subject), None)
+            Metrics.set_gauge("protocol_pool.size", len(self._entries))
+        return None if entry is None else entry[:2]
+
+    def evict(self) -> None:
+        """
+        Expires the idle finished sessions and the retained audio, then releases the audio of the least
+        recently used sessions whose transcript is generated until the pool fits in its budget.
+        The sessions whose lock is held, e.g. while their transcript is generated, are left alone.
+        """
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, (protocol, lock, accessed) in list(self._entries.items()):
+                if accessed < now - self._ttl and protocol.transcript_generation_done and not lock.locked():
+                    del self._entries[key]
+                    expired.append(key)
+            entries = [(key, protocol, lock) for key, (protocol, lock, _) in self._entries.items()]
+            Metrics.set_gauge("protocol_pool.size", len(self._entries))
+        Metrics.increment("protocol_pool.expired", len(expired))
+        if self._on_expire is not None:
+            for protocol_id, subject in expired:
+                self._on_expire(protocol_id, subject)
+        for _, protocol, lock in entries:
+            if lock.acquire(blocking=False):
+                try:
+                    protocol.release_expired_audio()
+                finally:
+                    lock.release()
+        sizes = [protocol.memory_bytes + protocol.retained_bytes for _, protocol, _ in entries]
+        total = sum(sizes)
+        for (_, protocol, lock), size in zip(entries, sizes):
+            if total <= self._max_bytes:
+                break
+            if size == 0 or protocol.transcript is None or not lock.acquire(blocking=False):
+                continue
+            try:
+                protocol.release_audio()
+            finally:
+                lock.release()
+            total -= size
+            Metrics.increment("protocol_pool.released")
+        Metrics.set_gauge("protocol_pool.bytes", total)
@@ -1,16 +1,28 @@
+import base64
+import binascii
 import json
 import os
-import requests
-from jose import jwt
+import shutil
+import tempfile
 import threading
 import traceback
+from datetime import date
 
-from flask import Flask, jsonify, request
+from flask import Flask, g, jsonify, request
 from flask_cors import CORS, cross_origin
-from werkzeug.datastructures import FileStorage
 
+from src.rest.JobScheduler import JobScheduler, QueueFullError
+from src.rest.JobStore import JobStore
 from src.rest.ProtocolHandler import ProtocolHandler, secrets
+from src.rest.ProtocolPool import ProtocolPool
+from src.rest.ProtocolSessions import ConcurrentEditError, ProtocolSessions
+from src.rest.RequestAuthenticator import RequestAuthenticator
+from src.rest.TokenValidator import TokenValidator
 from src.utils.DataBaseConnection import DataBaseConnection
+from src.utils.Metrics import Metrics
+from src.utils.PipelineRegistry import PipelineRegistry
+from src.utils.Recording import Recording
+from src.utils.TextTranscript import TextTranscript
 
 app = Flask(__name__)
 CORS(app)
@@ -25,29 +37,129 @@ app.config.update({
     "OIDC_INTROSPECTION_AUTH_METHOD": "client_secret_post"
 })
 
-protocol_pool : dict[tuple[str, str], tuple[ProtocolHandler, threading.Lock]] = {}
-protocol_pool_lock = threading.Lock()
-
 db_metadata = json.load(open(os.path.join(rest_dir, "../../.venv/database_metadata.json"), "r"))
 
 database = DataBaseConnection(**db_metadata)
 
+job_store = JobStore.from_environment(database)
+
+
+def _expire_protocol(protocol_id: str, subject: str) -> None:
+    # A shared store keeps the session for the other processes, which may still be using it
+    if not job_store.persistent:
+        job_store.delete(protocol_id, subject)
+
+
+protocol_pool = ProtocolPool.from_environment(on_expire=_expire_protocol)
+
+scheduler = JobScheduler.from_environment(job_store)
+
+if scheduler.backend == "thread":
+    PipelineRegistry.warm_up(device="cpu")
+
+# The time after which the unfinished jobs of a stopped process are resumed by another one
+JOB_STALE_SECONDS = float(os.environ.get("JOB_STALE_SECONDS", 30))
+
+
+sessions = ProtocolSessions(
+    protocol_pool, job_store, scheduled=lambda protocol_id: scheduler.position(protocol_id) is not None
+)
+
+
+def _queue_position(protocol_id: str, subject: str) -> int | None:
+    position = scheduler.position(protocol_id)
+    # The jobs of the other processes tell their position through the store
+    if position is None and job_store.persistent:
+        state = job_store.get(protocol_id, subject)
+        position = None if state is None or state["done"] else state.get("queuePosition")
+    return position
+
+
+def _recover_jobs() -> None:
+    """
+    Resumes the unfinished jobs of the stopped processes from their spooled audio,
+    and marks the ones whose audio is gone as failed.
+    """
+    for subject, state in job_store.claim_stale(JOB_STALE_SECONDS):
+        protocol = ProtocolHandler.from_state(state)
+        audio = state.get("audio")
+        if audio is not None and os.path.exists(audio):
+            lock = threading.Lock()
+            protocol_pool.put(protocol, subject, lock)
+            try:
+                scheduler.submit(protocol, subject, audio, lock, state.get("extension", ".wav"))
+                continue
+            except QueueFullError:
+                os.remove(audio)
+                protocol_pool.pop(protocol.id, subject)
+        protocol.set_generated_transcript(None)
+        job_store.save(subject, protocol.state())
+
+
+def _recover_jobs_periodically() -> None:
+    while True:
+        try:
+            _recover_jobs()
+        except Exception:
+            traceback.print_exc()
+        threading.Event().wait(JOB_STALE_SECONDS)
+
+
+if job_store.persistent:
+    threading.Thread(target=_recover_jobs_periodically, daemon=True).start()
+
+# The interval between two evictions of the idle sessions and of the audio exceeding the budget
+PROTOCOL_EVICTION_INTERVAL = 30.
+
+
+def _evict_periodically() -> None:
+    while True:
+        threading.Event().wait(PROTOCOL_EVICTION_INTERVAL)
+        try:
+            protocol_pool.evict()
+            # The sessions of a shared store are kept for the other processes until they expire everywhere
+            if job_store.persistent:
+                Metrics.increment("job_store.expired", job_store.delete_expired(protocol_pool.ttl))
+        except Exception:
+            traceback.print_exc()
 
-def validate_token(token):
-    jwks_url = "https://keycloak-armms.rayenmanai.site/realms/ARMMS-Platform/protocol/openid-connect/certs"
-    response = requests.get(jwks_url)
-    response.raise_for_status()
-    jwks = response.json()
+
+threading.Thread(target=_evict_periodically, daemon=True).start()
+
+
+token_validator = TokenValidator.from_environment(
+    jwks_url="https://keycloak-armms.rayenmanai.site/realms/ARMMS-Platform/protocol/openid-connect/certs",
+    audience="ProtoGen-Authorization",
+    issuer="https://keycloak-armms.rayenmanai.site/realms/ARMMS-Platform",
+)
+
+
+RequestAuthenticator(token_validator, public_endpoints={"get_metrics"}).init_app(app)
+
+
+# The number of protocols returned by /api/protocols at once, by default and at most
+PROTOCOLS_PAGE_SIZE = int(os.environ.get("PROTOCOLS_PAGE_SIZE", 50))
+PROTOCOLS_MAX_PAGE_SIZE = int(os.environ.get("PROTOCOLS_MAX_PAGE_SIZE", 200))
+SUMMARY_FIELDS = ["id", "title", "date", "place", "numberOfAttendees", "agendaItems"]
+
+
+def _encode_cursor(summary: dict) -> str:
+    """
+    Encodes the key of the last protocol of a page into an opaque cursor.
+    """
+    key = [None if summary["date"] is None else summary["date"].isoformat(), summary["id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[date | None, int]:
+    """
+    :raises ValueError: if the cursor is malformed.
+    """
     try:
-        decoded_token = jwt.decode(
-            token,
-            jwks,
-            audience="ProtoGen-Authorization",
-            issuer="https://keycloak-armms.rayenmanai.site/realms/ARMMS-Platform"
-        )
-        return decoded_token
-    except Exception:
-        return {"error": traceback.format_exc()}
+        protocol_date, protocol_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return None if protocol_date is None else date.fromisoformat(protocol_date), int(protocol_id)
+    except (TypeError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor {cursor}") from e
 
 
 @app.after_request
@@ -56,9 +168,58 @@ def add_cors_headers(response):
     response.headers["Access-Control-Allow-Credentials"] = "true"
     response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
     response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
+    response.headers["Access-Control-Expose-Headers"] = "X-Next-Cursor"
     return response
 
 
+@app.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    return jsonify(Metrics.snapshot()), 200
+
+
+# The size of the chunks in which uploads are copied to their spool file
+SPOOL_CHUNK_SIZE = 1 << 20
+
+
+def _spool_upload(file, extension: str) -> str:
+    """
+    Copies an uploaded file in chunks to a temporary file, in the directory
+    given by the environment variable PROTOGEN_SPOOL_DIR (the system's temporary directory if not set),
+    so that the upload is never held in memory as a whole.
+    :param extension: The extension of the temporary file, telling how to decode it.
+    :return: The path of the temporary file.
+    """
+    spool = tempfile.NamedTemporaryFile(
+        prefix="protogen-", suffix=extension, dir=os.environ.get("PROTOGEN_SPOOL_DIR"), delete=False
+    )
+    try:
+        with spool:
+            shutil.copyfileobj(file.stream, spool, SPOOL_CHUNK_SIZE)
+    except Exception:
+        os.remove(spool.name)
+        raise
+    return spool.name
+
+
+def _group_by_speaker(cropped: dict) -> dict[str, str]:
+    for segment in cropped["segments"]:
+        segment["text"] = (
+            segment["text"][: max(100, len(segment["text"]))] + "..."
+        )
+    result = {}
+    for speaker in set(map(lambda s: s["speaker"], cropped["segments"])):
+        result[speaker] = " ".join(
+            map(
+                lambda s: s["text"],
+                filter(
+                    lambda s: s["speaker"] == speaker,
+                    cropped["segments"],
+                ),
+            )
+        )
+    return result
+
+
 @app.route("/api/speakers", methods=["GET"])
 @cross_origin(origins=[
     "http://localhost:5000",
@@ -66,11 +227,10 @@ def add_cors_headers(response):
     "https://protogen-armms.rayenmanai.site"
 ], supports_credentials=True)
 def generate_speaker_text():
-    token = request.headers['Authorization'].split(None, 1)[1].strip()
-    subject = validate_token(token)['sub']
+    subject = g.subject
     protocol_id = request.args["id"]
     try:
-        protocol, _ = protocol_pool[(protocol_id, subject)]
+        protocol, _ = sessions.find(protocol_id, subject)
     except KeyError:
         return jsonify({"error": "The speakers you are trying to save do not exist."}), 404
     if not protocol.transcript_generation_done:
@@ -80,41 +240,22 @@ def generate_speaker_text():
         return jsonify({"percentage": percentage * 100.,
                         "isAnnotationDone": ann_done,
                         "isDone": transcript_done,
-                        "persons": []})
+                        "queuePosition": _queue_position(protocol_id, subject),
+                        "persons": [],
+                        "partialPersons": _group_by_speaker(
+                            TextTranscript(protocol.transcript_generation_result).transcript_as_dict())})
 
     if protocol.transcript_generation_percentage < - 1e-3:
-        protocol_pool_lock.acquire()
-        protocol_pool.pop((protocol_id, subject))
-        protocol_pool_lock.release()
+        sessions.forget(protocol_id, subject)
         return jsonify({"error": "Unable to read the audio."}), 401
-    cropped = protocol.transcript.transcript_as_dict()
-    for segment in cropped["segments"]:
-        segment["text"] = (
-            segment["text"][: max(100, len(segment["text"]))] + "..."
-        )
-    result = {}
-    for speaker in set(map(lambda s: s["speaker"], cropped["segments"])):
-        result[speaker] = " ".join(
-            map(
-                lambda s: s["text"],
-                filter(
-                    lambda s: s["speaker"] == speaker,
-                    cropped["segments"],
-                ),
-            )
-        )
+    result = _group_by_speaker(protocol.transcript.transcript_as_dict())
     return jsonify({"percentage": 100.,
                     "isAnnotationDone": True,
                     "isDone": True,
+                    "queuePosition": None,
                     "persons": result}), 200
 
 
-def safe_transcript_generation(protocol: ProtocolHandler, file: FileStorage, lock: threading.Lock):
-    lock.acquire()
-    ProtocolHandler.generate_transcript(protocol, file)
-    lock.release()
-
-
 @app.route("/api/upload-audio", methods=["POST"])
 @cross_origin(origins=[
     "http://localhost:5000",
@@ -124,22 +265,28 @@ def safe_transcript_generation(protocol: ProtocolHandler, file: FileStorage, loc
 def upload_recording():
     if "file" not in request.files:
         return jsonify({"error": "No file was received by the server"}), 400
-    token = request.headers['Authorization'].split(None, 1)[1].strip()
-    subject = validate_token(token)['sub']
+    subject = g.subject
     file = request.files["file"]
     if file.filename == "":
         return jsonify({"error": "Empty filename"}), 400
-    if file:
+    # Recordings without extension are WAV files, like before other formats were supported
+    extension = os.path.splitext(file.filename)[-1].lower() or ".wav"
+    if file and Recording.is_supported(extension):
+        audio = None
         try:
+            audio = _spool_upload(file, extension)
             protocol = ProtocolHandler()
-            protocol_pool_lock.acquire()
             lock = threading.Lock()
-            protocol_pool[(protocol.id, subject)] = protocol, lock
-            protocol_pool_lock.release()
-            thread = threading.Thread(target=safe_transcript_generation, args=(protocol, file, lock))
-            thread.start()
-            return jsonify({"id": protocol.id}), 200
+            protocol_pool.put(protocol, subject, lock)
+            position = scheduler.submit(protocol, subject, audio, lock, extension)
+            return jsonify({"id": protocol.id, "queuePosition": position}), 200
+        except QueueFullError as e:
+            os.remove(audio)
+            sessions.forget(protocol.id, subject)
+            return jsonify({"error": str(e)}), 429, {"Retry-After": "30"}
         except Exception as e:
+            if audio is not None and os.path.exists(audio):
+                os.remove(audio)
             return jsonify({"error": str(e)}), 500
 
     return jsonify({"error": "Invalid file type"}), 400
@@ -152,20 +299,23 @@ def upload_recording():
 ], supports_credentials=True)
 @app.route("/api/annotate", methods=["POST", "PUT"])
 def edit_speakers():
-    token = request.headers['Authorization'].split(None, 1)[1].strip()
-    subject = validate_token(token)['sub']
+    subject = g.subject
     try:
         speaker_map = request.json
         protocol_id = request.args["id"]
+
+        def edit(protocol: ProtocolHandler) -> dict:
+            protocol.edit_speakers(speaker_map)
+            return protocol.transcript.transcript_as_dict()
+
         try:
-            protocol, lock = protocol_pool[(protocol_id, subject)]
+            sessions.find(protocol_id, subject)
         except KeyError:
             return jsonify({"error": "The speakers you are trying to save do not exist."}), 404
-        lock.acquire()
-        protocol.edit_speakers(speaker_map)
-        transcript = protocol.transcript.transcript_as_dict()
-        lock.release()
+        transcript = sessions.edit(protocol_id, subject, edit)
         return jsonify(transcript), 200
+    except ConcurrentEditError as e:
+        return jsonify({"error": str(e)}), 409
     except AssertionError:
         return jsonify({"error": "The speakers' names do not match!"}), 404
     except KeyError as e:
@@ -181,22 +331,25 @@ def edit_speakers():
 ], supports_credentials=True)
 @app.route("/api/transcript", methods=["POST"])
 def get_proto_draft_text():
-    token = request.headers['Authorization'].split(None, 1)[1].strip()
-    subject = validate_token(token)['sub']
+    subject = g.subject
     try:
         protocol_id = request.args["id"]
+
+        def edit(protocol: ProtocolHandler) -> dict:
+            try:
+                protocol.transcript.transcript = request.json
+            except Exception as e:
+                print(e)
+            return protocol.generate_protocol()
+
         try:
-            protocol, lock = protocol_pool[(protocol_id, subject)]
+            sessions.find(protocol_id, subject)
         except KeyError:
             return jsonify({"error": "The protocol you are trying to edit does not exist."}), 404
-        lock.acquire()
-        try:
-            protocol.transcript.transcript = request.json
-        except Exception as e:
-            print(e)
-        protocol_draft = protocol.generate_protocol()
-        lock.release()
+        protocol_draft = sessions.edit(protocol_id, subject, edit)
         return jsonify(protocol_draft), 200
+    except ConcurrentEditError as e:
+        return jsonify({"error": str(e)}), 409
     except AssertionError as e:
         return (
             jsonify({"error": f"Could not generate protocol due to:\n{str(e)}!"}),
@@ -215,26 +368,19 @@ def get_proto_draft_text():
 ], supports_credentials=True)
 @app.route("/api/protocol", methods=["POST"])
 def save_protocol():
-    token = request.headers['Authorization'].split(None, 1)[1].strip()
-    decoded_token: dict[str, any] = validate_token(token)
-    subject = decoded_token['sub']
+    subject = g.subject
     try:
-        organizations = decoded_token['organization_info']
-        assert len(organizations.keys()) == 1
-        name = list(organizations.keys())[0]
-        organization_id = organizations[name]['id']
+        organization_id = g.organization_id
+        assert organization_id is not None, "The user does not belong to exactly one organization."
         protocol_id = request.args.get("id")
         try:
-            protocol, lock = protocol_pool[(protocol_id, subject)]
+            protocol, lock = sessions.find(protocol_id, subject)
         except KeyError:
             return jsonify({"error": "The protocol you are trying to save does not exist."}), 404
-        lock.acquire()
-        protocol.protocol = request.json
-        lock.release()
+        with lock:
+            protocol.protocol = request.json
         database.save_protocol(protocol.protocol, organization=organization_id)
-        protocol_pool_lock.acquire()
-        protocol_pool.pop((protocol_id, subject))
-        protocol_pool_lock.release()
+        sessions.forget(protocol_id, subject)
         return jsonify({"success": True}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -247,13 +393,9 @@ def save_protocol():
 ], supports_credentials=True)
 @app.route("/api/protocol", methods=["GET"])
 def get_protocol():
-    token = request.headers['Authorization'].split(None, 1)[1].strip()
-    decoded_token: dict[str, any] = validate_token(token)
     try:
-        organizations = decoded_token['organization_info']
-        assert len(organizations.keys()) == 1
-        name = list(organizations.keys())[0]
-        organization_id = organizations[name]['id']
+        organization_id = g.organization_id
+        assert organization_id is not None, "The user does not belong to exactly one organization."
         protocol_id = int(request.args["id"])
         return jsonify(database.get_protocol_by_id(protocol_id, organization_id)), 200
     except Exception as e:
@@ -267,13 +409,9 @@ def get_protocol():
 ], supports_credentials=True)
 @app.route("/api/protocol", methods=["DELETE"])
 def delete_protocol():
-    token = request.headers['Authorization'].split(None, 1)[1].strip()
-    decoded_token: dict[str, any] = validate_token(token)
     try:
-        organizations = decoded_token['organization_info']
-        assert len(organizations.keys()) == 1
-        name = list(organizations.keys())[0]
-        organization_id = organizations[name]['id']
+        organization_id = g.organization_id
+        assert organization_id is not None, "The user does not belong to exactly one organization."
         protocol_id = int(request.args.get("id"))
         database.remove_protocol(protocol_id, organization_id)
         return jsonify({'response': 'Successfully removed the protocol'}), 200
@@ -288,15 +426,37 @@ def delete_protocol():
 ], supports_credentials=True)
 @app.route("/api/protocols", methods=["GET"])
 def get_protocols():
-    token = request.headers['Authorization'].split(None, 1)[1].strip()
-    decoded_token: dict[str, any] = validate_token(token)
+    """
+    Returns a page of the protocols of the organization, the most recent first.
+    Query parameters:
+        * limit: the number of protocols of the page (PROTOCOLS_PAGE_SIZE by default, PROTOCOLS_MAX_PAGE_SIZE at most),
+        * cursor: the X-Next-Cursor header of the previous page, to get the next one,
+        * fields: the comma-separated fields of the protocols to return, all of them by default.
+    The X-Next-Cursor header of the response is only set if there is a next page.
+    """
     try:
-        organizations = decoded_token['organization_info']
-        assert len(organizations.keys()) == 1
-        name = list(organizations.keys())[0]
-        organization_id = organizations[name]['id']
-        print(database.get_protocol_summaries(organization_id))
-        return jsonify(database.get_protocol_summaries(organization_id)), 200
+        limit = int(request.args.get("limit", PROTOCOLS_PAGE_SIZE))
+        fields = request.args.get("fields")
+        fields = SUMMARY_FIELDS if fields is None else fields.split(",")
+        after = _decode_cursor(request.args["cursor"]) if "cursor" in request.args else None
+    except ValueError as e:
+        return jsonify({"error": f"Wrong request format. Error: {str(e)}"}), 400
+    unknown = set(fields) - set(SUMMARY_FIELDS)
+    if unknown or limit < 1:
+        return jsonify({"error": f"Wrong request format. Unknown fields: {sorted(unknown)}, limit: {limit}"}), 400
+    limit = min(limit, PROTOCOLS_MAX_PAGE_SIZE)
+    try:
+        organization_id = g.organization_id
+        assert organization_id is not None, "The user does not belong to exactly one organization."
+        # One more protocol tells whether there is a next page
+        summaries = database.get_protocol_summaries(
+            organization_id, limit=limit + 1, after=after, items="agendaItems" in fields
+        )
+        headers = {}
+        if len(summaries) > limit:
+            summaries = summaries[:limit]
+            headers["X-Next-Cursor"] = _encode_cursor(summaries[-1])
+        return jsonify([{field: summary[field] for field in fields} for summary in summaries]), 200, headers
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
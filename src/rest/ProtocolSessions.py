@@ -0,0 +1,95 @@
+import threading
+from collections.abc import Callable
+from typing import TypeVar
+
+from src.rest.JobStore import JobStore
+from src.rest.ProtocolHandler import ProtocolHandler
+from src.rest.ProtocolPool import ProtocolPool
+
+T = TypeVar("T")
+
+
+class ConcurrentEditError(Exception):
+    pass
+
+
+class ProtocolSessions:
+    """
+    The protocol sessions of the users, as seen by a process of the server.
+    The sessions of this process are held by its protocol pool, and the sessions of the other processes
+    are rehydrated from the job store and then held by the pool as well, with a single lock per session.
+    With a persistent store, the store is the reference: a session held by the pool is reloaded
+    whenever another process saved a newer version of it, and an edit saved over a newer version
+    is applied again to that version, so that no edit is lost whichever process answers.
+    Example of use:
+        sessions.edit(protocol_id, subject, lambda protocol: protocol.edit_speakers(speakers))
+    """
+
+    # The number of times an edit is applied before giving up on a session edited concurrently
+    __edit_attempts__ = 3
+
+    def __init__(self, pool: ProtocolPool, store: JobStore, scheduled: Callable[[str], bool] | None = None):
+        """
+        :param pool: The protocol pool of this process.
+        :param store: The job store, shared with the other processes if it is persistent.
+        :param scheduled: Tells whether the job of a protocol is queued or running in this process,
+        e.g. from its position in the scheduler. Its handler in the pool is then the live one,
+        which the states saved by the scheduler lag behind.
+        """
+        self._pool = pool
+        self._store = store
+        self._scheduled = scheduled or (lambda protocol_id: False)
+
+    def find(self, protocol_id: str, subject: str) -> tuple[ProtocolHandler, threading.Lock]:
+        """
+        Returns the up-to-date handler of a session and its lock.
+        :raises KeyError: if the session does not exist.
+        """
+        entry = self._pool.get(protocol_id, subject)
+        if entry is not None and (not self._store.persistent or self._scheduled(protocol_id)):
+            return entry
+        state = self._store.get(protocol_id, subject)
+        if state is None:
+            if entry is None:
+                raise KeyError(protocol_id)
+            # The session of a persistent store is never missing while running, so it ended in another process
+            if entry[0].transcript_generation_done:
+                self._pool.pop(protocol_id, subject)
+                raise KeyError(protocol_id)
+            return entry
+        if entry is None:
+            return self._pool.setdefault(ProtocolHandler.from_state(state), subject, threading.Lock())
+        protocol, lock = entry
+        if state["version"] > protocol.version:
+            protocol = ProtocolHandler.from_state(state)
+            self._pool.put(protocol, subject, lock)
+        return protocol, lock
+
+    def edit(self, protocol_id: str, subject: str, edit: Callable[[ProtocolHandler], T]) -> T:
+        """
+        Applies an edit to a session under its lock and saves the session to the store.
+        If another process saved the session meanwhile, the edit is applied again to the saved version.
+        :param edit: The edit, called with the handler of the session.
+        :return: The result of the edit.
+        :raises KeyError: if the session does not exist.
+        :raises ConcurrentEditError: if the session kept being saved by other processes.
+        """
+        for _ in range(ProtocolSessions.__edit_attempts__):
+            protocol, lock = self.find(protocol_id, subject)
+            with lock:
+                result = edit(protocol)
+                version = self._store.save(subject, protocol.state())
+                if version is not None:
+                    protocol.version = version
+                    return result
+                # The handler holds the edit applied to the former version
+                state = self._store.get(protocol_id, subject)
+                if state is None:
+                    self._pool.pop(protocol_id, subject)
+                    raise KeyError(protocol_id)
+                self._pool.put(ProtocolHandler.from_state(state), subject, lock)
+        raise ConcurrentEditError("The protocol is being edited concurrently, please retry.")
+
+    def forget(self, protocol_id: str, subject: str) -> None:
+        self._pool.pop(protocol_id, subject)
+        self._store.delete(protocol_id, subject)
@@ -0,0 +1,64 @@
+from flask import Flask, g, jsonify, request
+
+from src.rest.TokenValidator import TokenValidator
+from src.utils.Metrics import Metrics
+
+
+class RequestAuthenticator:
+    """
+    Authenticates every request of a Flask application once, before its route runs.
+    The bearer token of the request is verified by a TokenValidator, which caches the claims
+    of the tokens, and the route reads the result from the request context:
+        * g.claims: the claims of the token,
+        * g.subject: the user,
+        * g.organization_id: the id of the organization of the user,
+          None unless the user belongs to exactly one organization.
+    Requests without a valid token are answered with 401 Unauthorized.
+    The time spent authenticating is reported by the auth.request timing.
+    Example of use:
+        RequestAuthenticator(validator, public_endpoints={"get_metrics"}).init_app(app)
+    """
+
+    def __init__(self, validator: TokenValidator, public_endpoints: set[str] | None = None):
+        """
+        :param validator: The validator of the tokens.
+        :param public_endpoints: The endpoints answered without authentication.
+        """
+        self._validator = validator
+        self._public_endpoints = set(public_endpoints or [])
+
+    def init_app(self, app: Flask) -> None:
+        app.before_request(self.authenticate)
+
+    @staticmethod
+    def organization_id(claims: dict) -> str | None:
+        """
+        Returns the id of the organization of the user of a token,
+        or None unless the user belongs to exactly one organization.
+        """
+        organizations = claims.get("organization_info")
+        if not isinstance(organizations, dict) or len(organizations) != 1:
+            return None
+        organization, = organizations.values()
+        return organization.get("id")
+
+    def authenticate(self):
+        # Preflight requests are answered by flask-cors, and unknown routes with 404 Not Found
+        if request.method == "OPTIONS" or request.endpoint is None or request.endpoint in self._public_endpoints:
+            return None
+        with Metrics.timer("auth.request"):
+            scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+            if scheme.lower() != "bearer" or not token.strip():
+                Metrics.increment("auth.rejected")
+                return jsonify({"error": "Missing bearer token."}), 401
+            try:
+                claims = self._validator.validate(token.strip())
+                if "sub" not in claims:
+                    raise ValueError("the token has no subject")
+            except Exception as e:
+                Metrics.increment("auth.rejected")
+                return jsonify({"error": f"Invalid token: {str(e)}"}), 401
+            g.claims = claims
+            g.subject = claims["sub"]
+            g.organization_id = RequestAuthenticator.organization_id(claims)
+        return None
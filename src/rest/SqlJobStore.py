@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from typing import ContextManager
+
+from src.rest.JobStore import JobStore
+from src.utils.DataBaseConnection import DataBaseConnection
+
+
+class SqlJobStore(JobStore):
+    """
+    A job store keeping the states of the jobs in an SQL database,
+    shared by the processes of the server, on one or several nodes.
+    The queries run on connections reused by the threads of the process: the pool of the database
+    of the server for Postgres, and the idle connections of the store for SQLite.
+    """
+
+    def __init__(self, cursor: Callable[[], ContextManager], placeholder: str):
+        """
+        :param cursor: The context manager of the transactions of the database, yielding a cursor.
+        :param placeholder: The placeholder of the parameters of the queries of the database driver.
+        """
+        super().__init__()
+        self._cursor = cursor
+        self._placeholder = placeholder
+
+    @classmethod
+    def sqlite(cls, path: str) -> "SqlJobStore":
+        import sqlite3
+
+        idle = []
+        lock = threading.Lock()
+
+        @contextmanager
+        def _cursor():
+            with lock:
+                connection = idle.pop() if idle else None
+            if connection is None:
+                connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+                # Readers do not block the writer, and conversely
+                connection.execute("PRAGMA journal_mode=WAL")
+            cursor = connection.cursor()
+            try:
+                yield cursor
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+                with lock:
+                    idle.append(connection)
+
+        store = cls(_cursor, "?")
+        # A SQLite database only holds the jobs and is not migrated,
+        # unlike the database of the server, whose migrations create the table of the Postgres store
+        store._execute("""
+        CREATE TABLE IF NOT EXISTS ProtocolJob(
+        id varchar(100) primary key,
+        subject varchar(100) not null,
+        state text not null,
+        done int not null,
+        updated double precision not null,
+        version int not null)
+        """)
+        return store
+
+    @classmethod
+    def postgres(cls, database: DataBaseConnection) -> "SqlJobStore":
+        """
+        :param database: The database of the server, whose connection pool is shared with the store
+        and whose migrations create the table of the store.
+        """
+        return cls(database.cursor, "%s")
+
+    def _execute(self, query: str, parameters: tuple = (), fetch: bool = False):
+        """
+        Executes a query in its own transaction.
+        :return: The rows of the result if fetch is set, the number of affected rows otherwise.
+        """
+        with self._cursor() as cursor:
+            cursor.execute(query.replace("?", self._placeholder), parameters)
+            return cursor.fetchall() if fetch else cursor.rowcount
+
+    @property
+    def persistent(self) -> bool:
+        return True
+
+    def save(self, subject: str, state: dict) -> int | None:
+        version = state.get("version", 0)
+        state = {key: value for key, value in state.items() if key != "version"}
+        saved = self._execute(
+            """
+            INSERT INTO ProtocolJob (id, subject, state, done, updated, version) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+            subject = excluded.subject, state = excluded.state, done = excluded.done, updated = excluded.updated,
+            version = excluded.version
+            WHERE ProtocolJob.version = ?
+            """,
+            (state["id"], subject, json.dumps(state), int(state["done"]), time.time(), version + 1, version),
+        )
+        return version + 1 if saved == 1 else None
+
+    def get(self, job_id: str, subject: str) -> dict | None:
+        rows = self._execute(
+            "SELECT state, version FROM ProtocolJob WHERE id = ? AND subject = ?", (job_id, subject), fetch=True
+        )
+        if not rows:
+            return None
+        state, version = rows[0]
+        return {**json.loads(state), "version": version}
+
+    def delete(self, job_id: str, subject: str) -> None:
+        self._execute("DELETE FROM ProtocolJob WHERE id = ? AND subject = ?", (job_id, subject))
+
+    def delete_expired(self, ttl: float) -> int:
+        return self._execute("DELETE FROM ProtocolJob WHERE done = 1 AND updated < ?", (time.time() - ttl,))
+
+    def claim_stale(self, stale_seconds: float) -> list[tuple[str, dict]]:
+        now = time.time()
+        rows = self._execute(
+            "SELECT id, subject, state, updated, version FROM ProtocolJob WHERE done = 0 AND updated < ?",
+            (now - stale_seconds,),
+            fetch=True,
+        )
+        claimed = []
+        for job_id, subject, state, updated, version in rows:
+            # Only the first process updating the row after reading it claims the job
+            if self._execute(
+                "UPDATE ProtocolJob SET updated = ? WHERE id = ? AND updated = ?", (now, job_id, updated)
+            ) == 1:
+                claimed.append((subject, {**json.loads(state), "version": version}))
+        return claimed
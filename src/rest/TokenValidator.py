@@ -0,0 +1,131 @@
+import copy
+import hashlib
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import requests
+from jose import jwt
+from jose.exceptions import JWTError
+
+from src.utils.Metrics import Metrics
+
+
+class TokenValidator:
+    """
+    Validates the access tokens issued by the identity provider against the keys of its JWKS.
+    The JWKS is cached and fetched again once its time to live elapsed, or when a token is signed
+    with a key it does not contain, e.g. after a key rotation (at most once per refresh interval,
+    so that tokens with made-up key ids cannot flood the identity provider).
+    Concurrent fetches are coalesced: a single thread fetches the JWKS while the others wait for it.
+    The claims of the verified tokens are cached by the hash of the token until the token expires,
+    so that e.g. the progress polls of a client only verify its token once.
+    """
+
+    def __init__(
+        self,
+        jwks_url: str,
+        audience: str,
+        issuer: str,
+        jwks_ttl: float = 300.,
+        refresh_interval: float = 10.,
+        max_tokens: int = 10000,
+        timeout: float = 5.,
+    ):
+        """
+        :param jwks_url: The URL of the JWKS of the identity provider.
+        :param audience: The audience the tokens must be issued for.
+        :param issuer: The issuer of the tokens.
+        :param jwks_ttl: The time in seconds after which the JWKS is fetched again.
+        :param refresh_interval: The shortest time in seconds between two fetches of the JWKS
+        caused by an unknown key, or after a failed fetch.
+        :param max_tokens: The number of verified tokens cached, the least recently used ones being evicted.
+        :param timeout: The timeout in seconds of the requests of the JWKS.
+        """
+        self._jwks_url = jwks_url
+        self._audience = audience
+        self._issuer = issuer
+        self._jwks_ttl = jwks_ttl
+        self._refresh_interval = refresh_interval
+        self._max_tokens = max_tokens
+        self._timeout = timeout
+        # The keys of the JWKS by their id, and when they were fetched
+        self._keys: dict[str | None, dict] | None = None
+        self._fetched = 0.
+        self._fetch_lock = threading.Lock()
+        self._tokens_lock = threading.Lock()
+        # The claims of the verified tokens and their expiry, by the hash of the tokens
+        self._tokens: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+
+    @classmethod
+    def from_environment(cls, jwks_url: str, audience: str, issuer: str) -> "TokenValidator":
+        return cls(
+            jwks_url=jwks_url,
+            audience=audience,
+            issuer=issuer,
+            jwks_ttl=float(os.environ.get("JWKS_TTL_SECONDS", 300)),
+        )
+
+    def _fetch(self, stale: dict | None) -> dict:
+        """
+        Fetches the JWKS, unless another thread fetched it while this one waited.
+        If the fetch fails, the stale keys are kept until the next refresh interval.
+        :param stale: The keys known to the caller.
+        :return: The keys by their id.
+        """
+        with self._fetch_lock:
+            if self._keys is not stale:
+                return self._keys
+            try:
+                response = requests.get(self._jwks_url, timeout=self._timeout)
+                response.raise_for_status()
+                keys = {key.get("kid"): key for key in response.json()["keys"]}
+            except Exception:
+                if stale is None:
+                    raise
+                traceback.print_exc()
+                keys = stale.copy()
+                self._keys, self._fetched = keys, time.monotonic() - self._jwks_ttl + self._refresh_interval
+                return keys
+            Metrics.increment("auth.jwks_fetches")
+            self._keys, self._fetched = keys, time.monotonic()
+            return keys
+
+    def _key(self, kid: str | None) -> dict:
+        """
+        Returns the key of the JWKS with the given id, or the whole JWKS if the token names no key.
+        :raises JWTError: if the JWKS has no key with that id.
+        """
+        keys, age = self._keys, time.monotonic() - self._fetched
+        if keys is None or age > self._jwks_ttl or (kid not in keys and kid is not None and age > self._refresh_interval):
+            keys = self._fetch(keys)
+        if kid is None:
+            return {"keys": list(keys.values())}
+        if kid not in keys:
+            raise JWTError(f"Unknown signing key {kid}")
+        return keys[kid]
+
+    def validate(self, token: str) -> dict:
+        """
+        Verifies a token and returns its claims.
+        :raises JWTError: if the token is invalid or expired.
+        """
+        digest = hashlib.sha256(token.encode()).hexdigest()
+        with self._tokens_lock:
+            entry = self._tokens.get(digest)
+            if entry is not None and entry[1] > time.time():
+                self._tokens.move_to_end(digest)
+                Metrics.increment("auth.token_cache_hits")
+                return copy.deepcopy(entry[0])
+        Metrics.increment("auth.token_cache_misses")
+        key = self._key(jwt.get_unverified_header(token).get("kid"))
+        claims = jwt.decode(token, key, audience=self._audience, issuer=self._issuer)
+        if "exp" in claims:
+            with self._tokens_lock:
+                self._tokens[digest] = copy.deepcopy(claims), float(claims["exp"])
+                self._tokens.move_to_end(digest)
+                while len(self._tokens) > self._max_tokens:
+                    self._tokens.popitem(last=False)
+        return claims
@@ -0,0 +1,65 @@
+from src.utils.AudioTranscript import AudioTranscript
+from src.utils.IntervalIndex import IntervalIndex
+from src.utils.Recording import Recording
+from src.utils.VoskConnectionPool import VoskConnectionPool
+
+
+class AlignedTranscript(AudioTranscript):
+    """
+    An audio transcript streaming the whole recording to Vosk in a single session,
+    with word-level timestamps. Each word is then given to the speaker whose turn
+    of the annotation contains the middle of the word (or the nearest turn),
+    so that the recording does not have to be cut into one session per turn.
+    """
+
+    def __init__(
+        self,
+        recording: Recording,
+        annotation: list[tuple[str, float, float]],
+        **kwargs,
+    ):
+        """
+        :param recording: The whole recording to transcribe.
+        :param annotation: The (speaker, start, end) turns of the recording.
+        :param kwargs: The streaming options of AudioTranscript (server_url, window, chunk_seconds).
+        """
+        super().__init__([], **kwargs)
+        self._recording = recording
+        self._annotation = annotation
+
+    @staticmethod
+    def align(results: list[dict], annotation: list[tuple[str, float, float]]) -> list[tuple[str, str]]:
+        """
+        Assigns the timestamped words of the Vosk results to the speakers of the annotation.
+        :param results: The results of Vosk, whose "result" entries list the recognized words.
+        :param annotation: The (speaker, start, end) turns of the recording.
+        :return: The (speaker, text) tuples of consecutive words of the same speaker.
+        """
+        recognized = [word for result in results for word in result.get("result", [])]
+        speakers = IntervalIndex(annotation).labels_at([(word["start"] + word["end"]) / 2 for word in recognized])
+        segments = []
+        for word, speaker in zip(recognized, speakers):
+            if speaker is None:
+                continue
+            if segments and segments[-1][0] == speaker:
+                segments[-1][1].append(word["word"])
+            else:
+                segments.append((speaker, [word["word"]]))
+        return [(speaker, " ".join(words)) for speaker, words in segments]
+
+    async def _process_with_vosk(self) -> list[tuple[str, str]]:
+        self._process_ended = False
+        self._process_perc = 0.
+        self._processed_result = []
+        pcm, sample_rate = AudioTranscript._to_pcm(self._recording)
+        chunk_size = max(1, int(sample_rate * self._chunk_seconds)) * 2
+
+        def _on_progress(answered: int, chunks: int) -> None:
+            self._process_perc = answered / max(1, chunks)
+
+        async with VoskConnectionPool(self._server_url, 1, sample_rate, words=True) as pool:
+            results = await pool.recognize(pcm, chunk_size, self._window, _on_progress)
+        self._processed_result = AlignedTranscript.align(results, self._annotation)
+        self._process_ended = True
+        self._process_perc = 1.
+        return self._processed_result
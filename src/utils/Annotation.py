@@ -1,28 +1,154 @@
-import torch
-from pyannote.audio import Pipeline
+from collections.abc import Iterator
 
+import numpy as np
+
+from src.utils.PipelineRegistry import PipelineRegistry
 from src.utils.Recording import Recording
 
 
 class Annotation:
-    __key_path__ = ".venv/PYANNOTE_KEY"
-
-    def __init__(self, device="cpu"):
-        with open(Annotation.__key_path__, "r") as file:
-            key = file.readline()
-        self.pipeline = Pipeline.from_pretrained(
-            "pyannote/speaker-diarization-3.1", use_auth_token=key
-        )
-        self.pipeline.to(torch.device(device))
+    __model__ = "pyannote/speaker-diarization-3.1"
+    # The minimal cosine similarity of the embeddings of two speakers of different windows to link them
+    __link_similarity__ = 0.5
+
+    def __init__(self, device="cpu", model: str | None = None):
+        self._model = model or Annotation.__model__
+        self._device = device
+        self.pipeline = PipelineRegistry.get(self._model, self._device)
         self._is_done = False
 
     @property
     def is_done(self):
         return self._is_done
 
+    def _diarize(self, waveform: dict) -> list[tuple[str, float, float]]:
+        with PipelineRegistry.inference(self._model, self._device) as pipeline:
+            diarization = pipeline(waveform)
+        track_list = diarization.itertracks(yield_label=True)
+        return [(speaker, turn.start, turn.end) for (turn, _, speaker) in track_list]
+
+    def _diarize_with_embeddings(
+        self, waveform: dict
+    ) -> tuple[list[tuple[str, float, float]], dict[str, np.ndarray]]:
+        with PipelineRegistry.inference(self._model, self._device) as pipeline:
+            diarization, embeddings = pipeline(waveform, return_embeddings=True)
+        track_list = diarization.itertracks(yield_label=True)
+        turns = [(speaker, turn.start, turn.end) for (turn, _, speaker) in track_list]
+        return turns, {
+            label: embedding
+            for label, embedding in zip(diarization.labels(), embeddings)
+            if not np.any(np.isnan(embedding))
+        }
+
     def annotate(self, recording: Recording) -> list[tuple[str, float, float]]:
         self._is_done = False
-        diarization = self.pipeline(recording.waveform)
-        track_list = diarization.itertracks(yield_label=True)
+        result = self._diarize(recording.waveform)
         self._is_done = True
-        return [(speaker, turn.start, turn.end) for (turn, _, speaker) in track_list]
+        return result
+
+    @staticmethod
+    def _link_speakers(
+        previous: list[tuple[str, float, float]],
+        current: list[tuple[str, float, float]],
+        start: float,
+        end: float,
+        embeddings: dict[str, np.ndarray],
+        centroids: dict[str, np.ndarray],
+        known: int,
+    ) -> dict[str, str]:
+        """
+        Maps the speakers of a window to the speakers named so far.
+        A speaker is first matched greedily with the speaker of the previous window
+        it shares the longest speaking time with in the overlap [start, end] of both windows.
+        Otherwise, it is matched with the most similar speaker not present in the overlap,
+        by cosine similarity of its embedding with the speakers' mean embeddings.
+        Unmatched speakers get new names.
+        :param embeddings: The embedding of each speaker of the window.
+        :param centroids: The mean embedding of each speaker named so far.
+        :param known: The number of speakers named so far.
+        """
+        def _overlap(a, b):
+            return max(0., min(a[2], b[2], end) - max(a[1], b[1], start))
+
+        common = {}
+        for turn in current:
+            for other in previous:
+                duration = _overlap(turn, other)
+                if duration > 0:
+                    key = (turn[0], other[0])
+                    common[key] = common.get(key, 0.) + duration
+        mapping = {}
+        for (label, name), _ in sorted(common.items(), key=lambda item: -item[1]):
+            if label not in mapping and name not in mapping.values():
+                mapping[label] = name
+        similarities = []
+        for label, embedding in embeddings.items():
+            for name, centroid in centroids.items():
+                similarity = np.dot(embedding, centroid) / (
+                    np.linalg.norm(embedding) * np.linalg.norm(centroid) + 1e-12
+                )
+                if similarity >= Annotation.__link_similarity__:
+                    similarities.append((similarity, label, name))
+        for _, label, name in sorted(similarities, reverse=True):
+            if label not in mapping and name not in mapping.values():
+                mapping[label] = name
+        for label in sorted({turn[0] for turn in current}):
+            if label not in mapping:
+                mapping[label] = f"SPEAKER_{known:02}"
+                known += 1
+        return mapping
+
+    def annotate_windows(
+        self, recording: Recording, window: float = 120., overlap: float = 20.
+    ) -> Iterator[list[tuple[str, float, float]]]:
+        """
+        Diarizes the recording in sliding windows and yields the speaker turns
+        as soon as they are final, i.e. once the window they end in is diarized.
+        Consecutive windows overlap, and the speakers of a window are named after the
+        speakers of the previous window they share the most speaking time with,
+        or after the speakers of earlier windows whose voice embedding is the most similar.
+        The timeline is cut in the middle of each overlap: the turns crossing a cut
+        are clipped, so that every instant belongs to the turns of a single window.
+        :param recording: The recording to annotate.
+        :param window: The duration of a window in seconds.
+        :param overlap: The duration shared by consecutive windows in seconds.
+        :return: An iterator of lists of (speaker, start, end) turns, in chronological order.
+        """
+        self._is_done = False
+        duration = recording.duration
+        step = max(window - overlap, 1e-3)
+        previous = []
+        names = set()
+        centroids = {}
+        counts = {}
+        cut = 0.
+        start = 0.
+        while True:
+            end = min(start + window, duration)
+            last = end >= duration
+            # Only the window is converted if the waveform of the recording is not loaded
+            (_, segment), = recording.trim_recording([(None, start, end)])
+            turns, embeddings = self._diarize_with_embeddings(segment.waveform)
+            turns = [(speaker, start + turn_start, start + turn_end) for (speaker, turn_start, turn_end) in turns]
+            mapping = Annotation._link_speakers(
+                previous, turns, start, start + overlap, embeddings, centroids, len(names)
+            )
+            names.update(mapping.values())
+            for label, embedding in embeddings.items():
+                name = mapping[label]
+                counts[name] = counts.get(name, 0) + 1
+                centroid = centroids.get(name, np.zeros_like(embedding))
+                centroids[name] = centroid + (embedding - centroid) / counts[name]
+            turns = [(mapping[speaker], turn_start, turn_end) for (speaker, turn_start, turn_end) in turns]
+            next_cut = duration if last else start + step + overlap / 2
+            finished = [
+                (speaker, max(turn_start, cut), min(turn_end, next_cut))
+                for (speaker, turn_start, turn_end) in sorted(turns, key=lambda turn: turn[1])
+                if min(turn_end, next_cut) > max(turn_start, cut)
+            ]
+            if last:
+                self._is_done = True
+            yield finished
+            if last:
+                return
+            previous, cut, start = turns, next_cut, start + step
@@ -6,18 +6,46 @@ import websockets
 
 from src.utils.Recording import Recording
 from src.utils.TextTranscript import TextTranscript
+from src.utils.VoskConnectionPool import VoskConnectionPool
 
 VOSK_SERVER_URL = f"ws://{os.environ.get('VOSK_HOST_URI')}:2700"
 
 
 class AudioTranscript:
 
-    def __init__(self, transcript: list[tuple[str, Recording]]):
+    def __init__(
+        self,
+        transcript: list[tuple[str, Recording]],
+        pool_size: int | None = None,
+        server_url: str | None = None,
+        window: int | None = None,
+        chunk_seconds: float | None = None,
+    ):
         """
         Initializes a transcript object as a list
          of (speaker, recording) tuples.
+        :param transcript: The (speaker, recording) tuples to transcribe.
+        :param pool_size: The number of Vosk connections used concurrently.
+        Defaults to the environment variable VOSK_POOL_SIZE (4 if not set),
+        0 transcribing the segments serially on a new connection each.
+        :param server_url: The URL of the Vosk server, VOSK_SERVER_URL by default.
+        :param window: The number of audio chunks sent without waiting for their results.
+        Defaults to the environment variable VOSK_STREAM_WINDOW (8 if not set),
+        1 waiting for the result of every chunk before sending the next one.
+        :param chunk_seconds: The duration of the audio chunks sent to Vosk.
+        Defaults to the environment variable VOSK_CHUNK_SECONDS (0.2 if not set).
         """
         self._transcript = transcript
+        if pool_size is None:
+            pool_size = int(os.environ.get("VOSK_POOL_SIZE", 4))
+        if window is None:
+            window = int(os.environ.get("VOSK_STREAM_WINDOW", 8))
+        if chunk_seconds is None:
+            chunk_seconds = float(os.environ.get("VOSK_CHUNK_SECONDS", 0.2))
+        self._pool_size = pool_size
+        self._window = max(1, window)
+        self._chunk_seconds = chunk_seconds
+        self._server_url = server_url or VOSK_SERVER_URL
         self._processed_result = []
         self._process_perc = 1.
         self._process_ended = True
@@ -34,6 +62,13 @@ class AudioTranscript:
     def process_ended(self):
         return self._process_ended
 
+    @property
+    def nbytes(self) -> int:
+        """
+        The memory held by the audio of the segments to transcribe, see Recording.nbytes.
+        """
+        return sum(recording.nbytes for _, recording in self._transcript)
+
     def to_transcript(self) -> TextTranscript:
         """
         Transforms the audio transcript to a text transcript.
@@ -46,26 +81,68 @@ class AudioTranscript:
             self._process_perc = -1.
             return TextTranscript([])
 
+    @staticmethod
+    def _to_pcm(recording: Recording) -> tuple[memoryview, int]:
+        # The 16-bit PCM audio of trimmed recordings is a view onto the converted whole recording
+        return recording.pcm, recording.sample_rate
+
     async def _process_with_vosk(self) -> list[tuple[str, str]]:
         self._process_ended = False
         self._process_perc = 0.
         self._processed_result = []
+        if self._pool_size > 0:
+            result = await self._process_concurrently()
+        else:
+            result = await self._process_serially()
+        self._process_ended = True
+        self._process_perc = 1.
+        return result
+
+    async def _process_concurrently(self) -> list[tuple[str, str]]:
+        """
+        Transcribes the segments concurrently on a pool of Vosk connections.
+        The processed result only grows by the segments whose predecessors
+        are all transcribed, so that it always keeps the order of the segments.
+        """
+        length = len(self._transcript)
+        if length == 0:
+            return self._processed_result
+        texts = [None] * length
+        done = [False] * length
+        sample_rate = self._transcript[0][1].sample_rate
+
+        async def _transcribe(pool: VoskConnectionPool, index: int, recording: Recording):
+            pcm, rate = AudioTranscript._to_pcm(recording)
+            chunk_size = max(1, int(rate * self._chunk_seconds)) * 2
+            texts[index] = await pool.transcribe(pcm, chunk_size, self._window)
+            done[index] = True
+            finished = len(self._processed_result)
+            while finished < length and done[finished]:
+                self._processed_result.append((self._transcript[finished][0], texts[finished]))
+                finished += 1
+            self._process_perc = sum(done) / length
+
+        async with VoskConnectionPool(self._server_url, self._pool_size, sample_rate) as pool:
+            await asyncio.gather(*[
+                _transcribe(pool, index, recording)
+                for index, (_, recording) in enumerate(self._transcript)
+            ])
+        return self._processed_result
+
+    async def _process_serially(self) -> list[tuple[str, str]]:
         length = len(self._transcript)
         it = 0
         for speaker, recording in self._transcript:
-            async with websockets.connect(VOSK_SERVER_URL) as websocket:
-                waveform, sample_rate = recording.waveform.values()
+            async with websockets.connect(self._server_url) as websocket:
+                sample_rate = recording.sample_rate
 
                 # Send config message
                 await websocket.send('{"config": {"sample_rate": %d}}' % sample_rate)
 
-                # Convert waveform to 16-bit PCM format
-                pcm_audio = (waveform * 32767.0).short().numpy().tobytes()
-
                 # Send audio in chunks
-                chunk_size = int(sample_rate * 0.2) * 2  # 0.2 seconds of audio
-                for i in range(0, len(pcm_audio), chunk_size):
-                    await websocket.send(pcm_audio[i : i + chunk_size])
+                chunk_size = max(1, int(sample_rate * self._chunk_seconds)) * 2
+                for chunk in recording.chunks(chunk_size):
+                    await websocket.send(chunk)
                     await websocket.recv()  # Receive intermediate result
 
                 await websocket.send('{"eof" : 1}')
@@ -73,6 +150,4 @@ class AudioTranscript:
                 it += 1
                 self._process_perc = it / length
                 self._processed_result.append((speaker, json.loads(result).get("text")))
-        self._process_ended = True
-        self._process_perc = 1.
-        return self._processed_result
\ No newline at end of file
+        return self._processed_result
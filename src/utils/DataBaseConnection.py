@@ -1,10 +1,51 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
 import psycopg2
+from psycopg2.extras import execute_values
+
+from src.utils.SchemaMigrations import SchemaMigrations
 
 
 class DataBaseConnection:
+    """
+    The database of the protocols, shared by the threads of the server.
+    Every call borrows a connection from a thread-safe pool and runs in its own transaction,
+    committed when the call succeeds and rolled back otherwise.
+    The pool opens its connections as they are needed, up to its maximum, and keeps them open
+    once returned, so that the calls do not pay for a new connection under load.
+    The connections that stayed idle for a while are checked before being used,
+    and the broken ones are replaced by new connections.
+    """
+
     def __init__(
-        self, db_name: str, user_name: str, password: str, host: str, port: int
+        self,
+        db_name: str,
+        user_name: str,
+        password: str,
+        host: str,
+        port: int,
+        min_connections: int | None = None,
+        max_connections: int | None = None,
+        timeout: float = 30.,
+        health_check_interval: float = 30.,
     ):
+        """
+        :param min_connections: The number of connections opened at once, when the pool is created.
+        Defaults to the environment variable DB_POOL_MIN (2 if not set).
+        :param max_connections: The number of connections open at most, all of them kept open once opened,
+        the callers waiting for a free one beyond.
+        Defaults to the environment variable DB_POOL_MAX (10 if not set).
+        :param timeout: The time in seconds a caller waits for a free connection.
+        :param health_check_interval: The time in seconds after which an idle connection is checked before being used.
+        """
+        if min_connections is None:
+            min_connections = int(os.environ.get("DB_POOL_MIN", 2))
+        if max_connections is None:
+            max_connections = int(os.environ.get("DB_POOL_MAX", 10))
         self._DB_CONFIG = {
             "dbname": db_name,
             "user": user_name,
@@ -12,131 +53,209 @@ class DataBaseConnection:
             "host": host,
             "port": port,
         }
-        # Establish the connection
-        self.connection = psycopg2.connect(**self._DB_CONFIG)
-        self.connection.autocommit = True
+        max_connections = max(max_connections, min_connections, 1)
+        self._available = threading.BoundedSemaphore(max_connections)
+        self._timeout = timeout
+        self._health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        # The idle connections and when they were returned, the most recently returned last
+        self._idle: list[tuple[object, float]] = [
+            (psycopg2.connect(**self._DB_CONFIG), time.monotonic()) for _ in range(min_connections)
+        ]
         self.initialize_tables()
 
     def __del__(self):
         try:
-            self.connection.close()
+            self.close()
         except Exception:
             pass
 
+    def _connection(self):
+        """
+        Borrows an idle connection, replacing it if it is broken, or opens a new one if none is idle.
+        """
+        with self._lock:
+            connection, returned = self._idle.pop() if self._idle else (None, None)
+        if connection is None:
+            return psycopg2.connect(**self._DB_CONFIG)
+        if not connection.closed and time.monotonic() - returned > self._health_check_interval:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                connection.rollback()
+            except psycopg2.Error:
+                connection.close()
+        if connection.closed:
+            connection = psycopg2.connect(**self._DB_CONFIG)
+        return connection
+
+    @contextmanager
+    def cursor(self):
+        """
+        Borrows a connection from the pool for a transaction and yields a cursor on it.
+        The transaction is committed at the end of the block, or rolled back if the block raises,
+        and a connection broken meanwhile is closed instead of being returned to the pool.
+        Example of use:
+            with database.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        """
+        if not self._available.acquire(timeout=self._timeout):
+            raise TimeoutError("No database connection became available.")
+        try:
+            connection = self._connection()
+            broken = False
+            try:
+                with connection.cursor() as cursor:
+                    yield cursor
+                connection.commit()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            except BaseException:
+                if not connection.closed:
+                    connection.rollback()
+                raise
+            finally:
+                if broken or connection.closed:
+                    connection.close()
+                else:
+                    with self._lock:
+                        self._idle.append((connection, time.monotonic()))
+        finally:
+            self._available.release()
+
     def drop_db(self):
-        cursor = self.connection.cursor()
         query = (
-            "DROP TABLE IF EXISTS agendaitem; " "DROP TABLE IF EXISTS protocolmetadata"
+            "DROP TABLE IF EXISTS agendaitem; "
+            "DROP TABLE IF EXISTS protocolmetadata; "
+            "DROP TABLE IF EXISTS protocoljob; "
+            "DROP TABLE IF EXISTS schema_migrations"
         )
-        cursor.execute(query)
-        cursor.close()
+        with self.cursor() as cursor:
+            cursor.execute(query)
 
     def initialize_tables(self):
-        query = """
-        CREATE TABLE IF NOT EXISTS ProtocolMetadata(
-        id bigint generated always as IDENTITY primary key, 
-        organization varchar(100) not null, 
-        title varchar(100), date date, 
-        place varchar(100), 
-        numberOfAttendees int);
-        CREATE TABLE IF NOT EXISTS AgendaItem(
-        id int not null references ProtocolMetadata on delete cascade, 
-        title varchar(100), 
-        explanation varchar(10000));
         """
-        cursor = self.connection.cursor()
-        cursor.execute(query)
-        cursor.close()
+        Brings the schema of the database up to date by applying the missing migrations.
+        """
+        SchemaMigrations.migrate(self.cursor)
 
     def close(self):
-        del self
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            connection.close()
+
+    @staticmethod
+    def _check_protocol(protocol: dict) -> None:
+        assert {
+            "title",
+            "date",
+            "place",
+            "numberOfAttendees",
+            "agendaItems",
+        } == set(protocol.keys())
+
+    @staticmethod
+    def _agenda_items(protocol_id: int, protocol: dict) -> list[tuple]:
+        return [
+            (protocol_id, position, item["title"], item["explanation"])
+            for position, item in enumerate(protocol["agendaItems"])
+        ]
 
     def save_protocol(self, protocol: dict, organization: str) -> bool:
+        """
+        Saves a protocol and its agenda items in a single transaction.
+        :return: Whether the protocol was saved.
+        """
         try:
-            assert {
-                "title",
-                "date",
-                "place",
-                "numberOfAttendees",
-                "agendaItems",
-            } == set(protocol.keys())
-            cursor = self.connection.cursor()
+            DataBaseConnection._check_protocol(protocol)
             query_1 = (
                 "INSERT INTO ProtocolMetadata "
                 "(title, date, place, organization, numberOfAttendees) "
-                "VALUES (%s, %s, %s, %s, %s)"
-            )
-            cursor.execute(
-                query_1,
-                vars=(
-                    protocol["title"],
-                    protocol["date"],
-                    protocol["place"],
-                    organization,
-                    protocol["numberOfAttendees"],
-                ),
-            )
-            cursor.close()
-            cursor = self.connection.cursor()
-            cursor.execute(
-                """SELECT MAX(id) 
-                FROM protocolmetadata 
-                WHERE organization= %s
-                      AND title = %s 
-                      AND place = %s 
-                      AND numberOfAttendees = %s""",
-                vars=(
-                    organization,
-                    protocol["title"],
-                    protocol["place"],
-                    protocol["numberOfAttendees"],
-                ),
-            )
-            protocol_id = cursor.fetchone()[0]
-            cursor.close()
-            n = len(protocol["agendaItems"])
-            query_2 = (
-                "INSERT INTO AgendaItem (id, title, explanation) "
-                "VALUES (%s, %s, %s)" + ", (%s, %s, %s)" * (n - 1)
+                "VALUES (%s, %s, %s, %s, %s) RETURNING id"
             )
-            cursor = self.connection.cursor()
-            parameters = list(
-                sum(
-                    [
-                        (
-                            protocol_id,
-                            protocol["agendaItems"][i]["title"],
-                            protocol["agendaItems"][i]["explanation"],
-                        )
-                        for i in range(n)
-                    ],
-                    (),
+            query_2 = "INSERT INTO AgendaItem (id, position, title, explanation) VALUES %s"
+            with self.cursor() as cursor:
+                cursor.execute(
+                    query_1,
+                    vars=(
+                        protocol["title"],
+                        protocol["date"],
+                        protocol["place"],
+                        organization,
+                        protocol["numberOfAttendees"],
+                    ),
                 )
-            )
-            parameters = tuple(parameters)
-            cursor.execute(query_2, vars=parameters)
-            cursor.close()
+                protocol_id = cursor.fetchone()[0]
+                execute_values(cursor, query_2, DataBaseConnection._agenda_items(protocol_id, protocol))
             return True
         except Exception as e:
             print(e)
             return False
 
+    def save_protocols(self, protocols: list[dict], organization: str, page_size: int = 1000) -> list[int]:
+        """
+        Saves many protocols of an organization at once, e.g. to import its former protocols,
+        in a single transaction: either all of them are saved or none.
+        The protocols and the agenda items are inserted by batches of page_size rows.
+        :return: The ids of the protocols, in the same order.
+        :raises AssertionError: if a protocol does not have the expected keys.
+        """
+        for protocol in protocols:
+            DataBaseConnection._check_protocol(protocol)
+        if not protocols:
+            return []
+        with self.cursor() as cursor:
+            # The ids are drawn beforehand, so that every agenda item is matched with its protocol
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence('protocolmetadata', 'id')) FROM generate_series(1, %s)",
+                (len(protocols),),
+            )
+            protocol_ids = [row[0] for row in cursor.fetchall()]
+            execute_values(
+                cursor,
+                "INSERT INTO ProtocolMetadata "
+                "(id, title, date, place, organization, numberOfAttendees) "
+                "OVERRIDING SYSTEM VALUE VALUES %s",
+                [
+                    (
+                        protocol_id,
+                        protocol["title"],
+                        protocol["date"],
+                        protocol["place"],
+                        organization,
+                        protocol["numberOfAttendees"],
+                    )
+                    for protocol_id, protocol in zip(protocol_ids, protocols)
+                ],
+                page_size=page_size,
+            )
+            execute_values(
+                cursor,
+                "INSERT INTO AgendaItem (id, position, title, explanation) VALUES %s",
+                [
+                    item
+                    for protocol_id, protocol in zip(protocol_ids, protocols)
+                    for item in DataBaseConnection._agenda_items(protocol_id, protocol)
+                ],
+                page_size=page_size,
+            )
+        return protocol_ids
+
     def get_protocol_by_id(self, protocol_id: int, organization: str) -> dict:
-        cursor = self.connection.cursor()
         query_1 = (
             "SELECT title, date, place, numberofattendees "
             "FROM ProtocolMetadata WHERE id = %s AND organization = %s;"
         )
-        cursor.execute(query_1, vars=(protocol_id, organization))
-        protocol_metadata = cursor.fetchone()
-        if protocol_metadata is None:
-            raise RuntimeError("Incorrect user or protocol not found")
-        cursor.close()
-        cursor = self.connection.cursor()
-        query_2 = "SELECT title, explanation FROM agendaitem WHERE id = %s"
-        cursor.execute(query_2, vars=(protocol_id,))
-        protocol_items = cursor.fetchall()
-        cursor.close()
+        query_2 = "SELECT title, explanation FROM agendaitem WHERE id = %s ORDER BY position"
+        with self.cursor() as cursor:
+            cursor.execute(query_1, vars=(protocol_id, organization))
+            protocol_metadata = cursor.fetchone()
+            if protocol_metadata is None:
+                raise RuntimeError("Incorrect user or protocol not found")
+            cursor.execute(query_2, vars=(protocol_id,))
+            protocol_items = cursor.fetchall()
         return {
             "title": protocol_metadata[0],
             "date": protocol_metadata[1],
@@ -151,23 +270,47 @@ class DataBaseConnection:
             ],
         }
 
-    def get_protocol_summaries(self, organization: str) -> list:
-        cursor = self.connection.cursor()
-        query_1 = """SELECT p.id, p.title, p.date, p.place, p.numberofattendees
-        FROM ProtocolMetadata p
-        WHERE organization = %s;"""
-        cursor.execute(query_1, vars=(organization,))
-        datas = cursor.fetchall()
-        cursor.close()
-        cursor = self.connection.cursor()
-        query_2 = (
-            "SELECT p.id, a.title, a.explanation "
-            "FROM protocolmetadata p, agendaitem a "
-            "WHERE organization = %s AND p.id = a.id;"
-        )
-        cursor.execute(query_2, vars=(organization,))
-        items = cursor.fetchall()
-        cursor.close()
+    def get_protocol_summaries(
+        self,
+        organization: str,
+        limit: int | None = None,
+        after: tuple[date | None, int] | None = None,
+        items: bool = True,
+    ) -> list:
+        """
+        Returns the protocols of an organization, the most recent first, in a single query.
+        The protocols are ordered by descending (date, id), the ones without date first,
+        so that a page of protocols is continued from the key of its last protocol (keyset pagination).
+        :param limit: The number of protocols returned at most, all of them if None.
+        :param after: The (date, id) of the protocol after which the protocols are returned.
+        :param items: Whether the agenda items of the protocols are returned,
+        aggregated by the database, or only their metadata.
+        """
+        conditions, parameters = ["p.organization = %s"], [organization]
+        if after is not None:
+            after_date, after_id = after
+            if after_date is None:
+                conditions.append("((p.date IS NULL AND p.id < %s) OR p.date IS NOT NULL)")
+                parameters.append(after_id)
+            else:
+                conditions.append("(p.date, p.id) < (%s, %s)")
+                parameters += [after_date, after_id]
+        if items:
+            columns = "COALESCE(i.items, '[]')"
+            join = """LEFT JOIN LATERAL (
+            SELECT json_agg(json_build_object('title', a.title, 'explanation', a.explanation) ORDER BY a.position) AS items
+            FROM AgendaItem a WHERE a.id = p.id
+        ) i ON true"""
+        else:
+            columns, join = "NULL", ""
+        query = f"""SELECT p.id, p.title, p.date, p.place, p.numberofattendees, {columns}
+        FROM ProtocolMetadata p {join}
+        WHERE {" AND ".join(conditions)}
+        ORDER BY p.date DESC NULLS FIRST, p.id DESC
+        LIMIT %s;"""
+        with self.cursor() as cursor:
+            cursor.execute(query, vars=(*parameters, limit))
+            datas = cursor.fetchall()
         return [
             {
                 "id": d[0],
@@ -175,16 +318,15 @@ class DataBaseConnection:
                 "date": d[2],
                 "place": d[3],
                 "numberOfAttendees": d[4],
-                "agendaItems": [{'title': item[1], 'explanation': item[2]} for item in items if item[0] == d[0]],
+                **({"agendaItems": d[5]} if items else {}),
             }
             for d in datas
         ]
 
     def remove_protocol(self, protocol_id, organization) -> None:
-        cursor = self.connection.cursor()
         query = "DELETE FROM ProtocolMetadata WHERE id = %s AND organization = %s;"
-        cursor.execute(query, (protocol_id, organization))
-        cursor.close()
+        with self.cursor() as cursor:
+            cursor.execute(query, (protocol_id, organization))
 
 
 if __name__ == "__main__":
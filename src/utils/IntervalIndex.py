@@ -0,0 +1,93 @@
+from bisect import bisect_right
+from itertools import accumulate
+
+
+class IntervalIndex:
+    """
+    An index of labelled time intervals, e.g. the speaker turns of an annotation,
+    answering which label covers a given time.
+    A lookup is a binary search followed by a walk back over the intervals starting before the time,
+    as long as one of them still reaches it. It takes logarithmic time when the intervals barely overlap,
+    like speaker turns, but linear time in the worst case, e.g. a long interval spanning many short ones.
+    Many times in order, e.g. the words of a transcript, are looked up together by labels_at,
+    in a single sweep over the intervals whatever their overlap.
+    """
+
+    def __init__(self, intervals: list[tuple[str, float, float]]):
+        """
+        :param intervals: The (label, start, end) tuples to index.
+        """
+        self._intervals = sorted(intervals, key=lambda interval: interval[1])
+        self._starts = [start for (_, start, _) in self._intervals]
+        # The latest end of the intervals starting before each interval (included)
+        self._max_ends = list(accumulate((end for (_, _, end) in self._intervals), max))
+        # The position of the interval reaching that latest end
+        self._last_ending = list(accumulate(
+            range(len(self._intervals)),
+            lambda best, i: i if self._intervals[i][2] >= self._intervals[best][2] else best,
+        ))
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    def covering(self, time: float) -> list[tuple[str, float, float]]:
+        """
+        Returns the intervals containing the given time, latest start first.
+        Linear in the number of intervals in the worst case, see the class.
+        """
+        result = []
+        i = bisect_right(self._starts, time) - 1
+        while i >= 0 and self._max_ends[i] >= time:
+            if self._intervals[i][2] >= time:
+                result.append(self._intervals[i])
+            i -= 1
+        return result
+
+    def label_at(self, time: float) -> str | None:
+        """
+        Returns the label of the interval containing the given time.
+        If several intervals contain it, the one starting last is chosen.
+        If none does, the label of the nearest interval is returned,
+        and None if the index is empty.
+        """
+        i = bisect_right(self._starts, time)
+        j = i - 1
+        while j >= 0 and self._max_ends[j] >= time:
+            if self._intervals[j][2] >= time:
+                return self._intervals[j][0]
+            j -= 1
+        return self._nearest(time, i, self._last_ending[i - 1] if i > 0 else None)
+
+    def labels_at(self, times: list[float]) -> list[str | None]:
+        """
+        Returns the label_at of each time, sweeping once over the intervals by start
+        while the times are visited in order, so that each interval is opened and closed once.
+        """
+        labels: list[str | None] = [None] * len(times)
+        # The intervals started so far and still open, latest start last
+        opened: list[int] = []
+        i, last_ending = 0, None
+        for k in sorted(range(len(times)), key=times.__getitem__):
+            time = times[k]
+            while i < len(self._intervals) and self._starts[i] <= time:
+                opened.append(i)
+                if last_ending is None or self._intervals[i][2] >= self._intervals[last_ending][2]:
+                    last_ending = i
+                i += 1
+            # The times only grow, so a closed interval stays closed
+            while opened and self._intervals[opened[-1]][2] < time:
+                opened.pop()
+            labels[k] = self._intervals[opened[-1]][0] if opened else self._nearest(time, i, last_ending)
+        return labels
+
+    def _nearest(self, time: float, following: int, last_ending: int | None) -> str | None:
+        """
+        Returns the label of the nearest interval to a time contained by none,
+        between the first interval starting after it and the one reaching the latest before it.
+        """
+        candidates = []
+        if following < len(self._intervals):
+            candidates.append((self._starts[following] - time, self._intervals[following][0]))
+        if last_ending is not None:
+            candidates.append((time - self._intervals[last_ending][2], self._intervals[last_ending][0]))
+        return min(candidates)[1] if candidates else None
@@ -0,0 +1,74 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    A process-wide registry of counters, gauges and timings.
+    Every value is identified by its name and the registry can be
+    read as a whole through the snapshot method, e.g. to expose it
+    through the REST server.
+    """
+
+    __lock__ = threading.Lock()
+    __counters__: dict[str, float] = {}
+    __gauges__: dict[str, float] = {}
+    __timings__: dict[str, dict[str, float]] = {}
+
+    @classmethod
+    def increment(cls, name: str, value: float = 1.) -> None:
+        with cls.__lock__:
+            cls.__counters__[name] = cls.__counters__.get(name, 0.) + value
+
+    @classmethod
+    def set_gauge(cls, name: str, value: float) -> None:
+        with cls.__lock__:
+            cls.__gauges__[name] = value
+
+    @classmethod
+    def observe(cls, name: str, seconds: float) -> None:
+        """
+        Records one observation of a duration.
+        :param name: The name of the timing.
+        :param seconds: The measured duration in seconds.
+        """
+        with cls.__lock__:
+            timing = cls.__timings__.setdefault(
+                name, {"count": 0, "total": 0., "max": 0., "last": 0.}
+            )
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+            timing["last"] = seconds
+
+    @classmethod
+    @contextmanager
+    def timer(cls, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.observe(name, time.perf_counter() - start)
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        with cls.__lock__:
+            return {
+                "counters": dict(cls.__counters__),
+                "gauges": dict(cls.__gauges__),
+                "timings": {
+                    name: {
+                        **timing,
+                        "mean": timing["total"] / timing["count"],
+                    }
+                    for name, timing in cls.__timings__.items()
+                },
+            }
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls.__lock__:
+            cls.__counters__.clear()
+            cls.__gauges__.clear()
+            cls.__timings__.clear()
@@ -0,0 +1,108 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from src.utils.Metrics import Metrics
+
+
+class PipelineRegistry:
+    """
+    A process-wide registry of diarization pipelines.
+    A pipeline is loaded lazily the first time it is requested for a given
+    (model, device) pair, and is then shared by every Annotation object.
+    The number of concurrent inferences on a shared pipeline is bounded
+    by the environment variable PYANNOTE_MAX_CONCURRENCY (1 by default).
+    """
+
+    __key_path__ = ".venv/PYANNOTE_KEY"
+    __default_model__ = "pyannote/speaker-diarization-3.1"
+
+    __lock__ = threading.Lock()
+    __pipelines__: dict[tuple[str, str], any] = {}
+    __key_locks__: dict[tuple[str, str], threading.Lock] = {}
+    __semaphores__: dict[tuple[str, str], threading.BoundedSemaphore] = {}
+
+    @staticmethod
+    def max_concurrency() -> int:
+        return max(1, int(os.environ.get("PYANNOTE_MAX_CONCURRENCY", 1)))
+
+    @classmethod
+    def _load(cls, model: str, device: str):
+        import torch
+        from pyannote.audio import Pipeline
+
+        with open(cls.__key_path__, "r") as file:
+            key = file.readline()
+        pipeline = Pipeline.from_pretrained(model, use_auth_token=key)
+        pipeline.to(torch.device(device))
+        return pipeline
+
+    @classmethod
+    def _key_lock(cls, key: tuple[str, str]) -> threading.Lock:
+        with cls.__lock__:
+            if key not in cls.__key_locks__:
+                cls.__key_locks__[key] = threading.Lock()
+                cls.__semaphores__[key] = threading.BoundedSemaphore(
+                    cls.max_concurrency()
+                )
+            return cls.__key_locks__[key]
+
+    @classmethod
+    def get(cls, model: str | None = None, device: str = "cpu"):
+        """
+        Returns the shared pipeline of the given model on the given device,
+        loading it if it was never requested before.
+        Concurrent first requests for the same key load the model only once.
+        :param model: The name of the pretrained pipeline.
+        :param device: The torch device the pipeline runs on.
+        :return: The shared pipeline.
+        """
+        key = (model or cls.__default_model__, device)
+        pipeline = cls.__pipelines__.get(key)
+        if pipeline is not None:
+            return pipeline
+        with cls._key_lock(key):
+            if key not in cls.__pipelines__:
+                with Metrics.timer("pipeline.load"):
+                    cls.__pipelines__[key] = cls._load(*key)
+                Metrics.increment("pipeline.loaded")
+            return cls.__pipelines__[key]
+
+    @classmethod
+    @contextmanager
+    def inference(cls, model: str | None = None, device: str = "cpu"):
+        """
+        Context manager bounding the number of concurrent inferences
+        on the shared pipeline and measuring their duration.
+        """
+        key = (model or cls.__default_model__, device)
+        cls._key_lock(key)
+        semaphore = cls.__semaphores__[key]
+        with Metrics.timer("pipeline.wait"):
+            semaphore.acquire()
+        try:
+            with Metrics.timer("pipeline.inference"):
+                yield cls.get(*key)
+        finally:
+            semaphore.release()
+
+    @classmethod
+    def warm_up(cls, model: str | None = None, device: str = "cpu") -> None:
+        """
+        Loads the pipeline in the background so that the first
+        upload does not pay for the model loading.
+        """
+        def _load():
+            try:
+                cls.get(model, device)
+            except Exception as e:
+                print(f"Could not warm up the diarization pipeline: {e}")
+
+        threading.Thread(target=_load, daemon=True).start()
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls.__lock__:
+            cls.__pipelines__.clear()
+            cls.__key_locks__.clear()
+            cls.__semaphores__.clear()
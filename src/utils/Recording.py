@@ -1,6 +1,12 @@
 import os
-from io import BytesIO
+import shutil
+import struct
+import subprocess
+import tempfile
+from collections.abc import Iterator
 
+import numpy as np
+import torch
 import torchaudio
 from pydub import AudioSegment
 
@@ -9,7 +15,12 @@ class Recording:
     _extension: str
     _content: AudioSegment
 
-    _supported_extensions = [".wav"]
+    _supported_extensions = [".wav", ".mp3", ".ogg", ".opus", ".m4a", ".flac"]
+    # Decoded by ffmpeg if it is installed, torchaudio decoding them in memory otherwise
+    _compressed_extensions = [".mp3", ".ogg", ".opus", ".m4a", ".flac"]
+    __ffmpeg__ = "ffmpeg"
+    # The sample rate the diarization pipeline and the Vosk models work with
+    __sample_rate__ = 16000
 
     @property
     def extension(self) -> str:
@@ -17,13 +28,104 @@ class Recording:
 
     @property
     def content(self) -> AudioSegment:
+        """
+        The recording as a pydub AudioSegment.
+        Unless it was given, it is only built from the 16-bit PCM audio when it is asked for.
+        """
+        if self._content is None:
+            self._content = AudioSegment(
+                data=bytes(self.pcm),
+                sample_width=2,
+                frame_rate=self._sample_rate,
+                channels=self._channels,
+            )
         return self._content
 
     @property
     def waveform(self):
+        """
+        The recording as a float tensor of shape (channels, samples).
+        The waveform of a segment is a slice of the waveform of the recording it was trimmed from
+        if that one is loaded, and the waveform of a memory-mapped recording
+        is only converted from its PCM audio when it is asked for.
+        """
+        if self._waveform is None:
+            if self._parent is not None and self._parent._waveform is not None:
+                waveform = self._parent.waveform["waveform"]
+                if waveform.ndim == 1:
+                    waveform = waveform.unsqueeze(0)
+                waveform = waveform[:, self._offset:self._offset + self._length]
+            else:
+                samples = np.frombuffer(self.pcm, dtype="<i2").reshape(-1, self._channels)
+                waveform = torch.from_numpy(np.divide(samples.T, 32768.0, dtype=np.float32))
+            self._waveform = waveform, self._sample_rate
         waveform, sample_rate = self._waveform
         return {"waveform": waveform, "sample_rate": sample_rate}
 
+    @property
+    def pcm(self) -> memoryview:
+        """
+        The 16-bit PCM audio of the recording, channels interleaved.
+        The audio of a whole recording is converted once, on first access,
+        and the audio of its segments is a view onto that buffer.
+        """
+        if self._parent is not None:
+            start = self._offset * self._channels * 2
+            return self._parent.pcm[start:start + self._length * self._channels * 2]
+        if self._pcm is None:
+            waveform, _ = self._waveform
+            if waveform.ndim == 1:
+                waveform = waveform.unsqueeze(0)
+            # Scaled back like the decoders scale 16-bit samples, so that 16-bit files round-trip exactly
+            samples = (waveform * 32768.0).round().clamp(-32768, 32767).short().numpy()
+            self._pcm = memoryview(np.ascontiguousarray(samples.T)).cast("B")
+        return self._pcm
+
+    @property
+    def sample_rate(self) -> int:
+        return self._sample_rate
+
+    @property
+    def channels(self) -> int:
+        return self._channels
+
+    @property
+    def duration(self) -> float:
+        """
+        The duration of the recording in seconds.
+        """
+        return self._length / self._sample_rate
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The memory held by the audio buffers of the recording and of its normalized recordings.
+        The buffers shared with the recording it was trimmed from,
+        and the memory-mapped samples, backed by their file, are left aside.
+        """
+        nbytes = 0
+        if self._waveform is not None:
+            waveform = self._waveform[0]
+            parent = None if self._parent is None else self._parent._waveform
+            if parent is None or waveform.untyped_storage().data_ptr() != parent[0].untyped_storage().data_ptr():
+                nbytes += waveform.numel() * waveform.element_size()
+        if self._pcm is not None and not isinstance(self._pcm.obj, np.memmap):
+            nbytes += self._pcm.nbytes
+        if self._content is not None:
+            nbytes += len(self._content.raw_data)
+        return nbytes + sum(recording.nbytes for recording in self._normalized.values())
+
+    @property
+    def offset(self) -> int:
+        """
+        The position of the first sample of the recording in the recording it was trimmed from.
+        """
+        return self._offset
+
+    @classmethod
+    def is_supported(cls, extension: str) -> bool:
+        return extension.lower() in cls._supported_extensions
+
     @extension.setter
     def extension(self, extension: str) -> None:
         if extension not in self._supported_extensions:
@@ -35,62 +137,233 @@ class Recording:
         self._content = content
 
     def __init__(
-        self, extension: str, content: AudioSegment, waveform: tuple[any, int]
+        self,
+        extension: str,
+        content: AudioSegment,
+        waveform: tuple[any, int] | None,
+        pcm: tuple[np.ndarray, int] | None = None,
     ):
+        """
+        :param extension: The extension of the recording's file.
+        :param content: The recording as a pydub AudioSegment, built lazily if None.
+        :param waveform: The (float tensor, sample rate) waveform of the recording,
+        converted lazily from the PCM audio if None.
+        :param pcm: The (16-bit samples of shape (samples, channels), sample rate) audio
+        of the recording, e.g. memory-mapped from a file. Required if the waveform is None.
+        """
         self.extension = extension
         self.content = content
         self._waveform = waveform
+        self._pcm = None
+        self._parent = None
+        self._offset = 0
+        self._normalized = {}
+        if waveform is not None:
+            samples, self._sample_rate = waveform
+            self._channels = 1 if samples.ndim == 1 else samples.shape[0]
+            self._length = samples.shape[-1]
+        else:
+            samples, self._sample_rate = pcm
+            self._length, self._channels = samples.shape
+            self._pcm = memoryview(samples).cast("B")
+
+    def chunks(self, chunk_size: int) -> Iterator[memoryview]:
+        """
+        Iterates over the 16-bit PCM audio of the recording without copying it.
+        :param chunk_size: The size of the chunks in bytes.
+        """
+        pcm = self.pcm
+        for i in range(0, len(pcm), chunk_size):
+            yield pcm[i:i + chunk_size]
+
+    @staticmethod
+    def _wav_data(file_path: str) -> tuple[int, int, int, int] | None:
+        """
+        Locates the samples of a 16-bit PCM WAV file.
+        :return: The (offset, frames, channels, sample rate) of its data chunk,
+        or None if the file is not a 16-bit PCM WAV file.
+        """
+        size = os.path.getsize(file_path)
+        with open(file_path, "rb") as file:
+            header = file.read(12)
+            if len(header) < 12:
+                return None
+            riff, _, wave = struct.unpack("<4sI4s", header)
+            if riff != b"RIFF" or wave != b"WAVE":
+                return None
+            fmt = None
+            while len(header := file.read(8)) == 8:
+                chunk_id, chunk_size = struct.unpack("<4sI", header)
+                if chunk_id == b"fmt ":
+                    fmt = struct.unpack("<HHIIHH", file.read(16))
+                    file.seek(chunk_size - 16 + chunk_size % 2, os.SEEK_CUR)
+                elif chunk_id == b"data":
+                    if fmt is None:
+                        return None
+                    audio_format, channels, sample_rate, _, _, bits = fmt
+                    if audio_format != 1 or bits != 16:
+                        return None
+                    offset = file.tell()
+                    # Streamed WAV files may not know the size of their data chunk
+                    length = min(chunk_size, size - offset)
+                    return offset, length // (2 * channels), channels, sample_rate
+                else:
+                    file.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+        return None
+
+    @classmethod
+    def _decode(cls, file_path: str, extension: str) -> "Recording":
+        """
+        Decodes a compressed recording with ffmpeg, which streams the audio
+        straight into a file of 16 kHz mono 16-bit PCM samples next to the recording.
+        That file is memory-mapped, so that neither the decoded audio
+        nor any intermediate copy of it is held in memory.
+        """
+        sample_rate = Recording.__sample_rate__
+        descriptor, pcm_path = tempfile.mkstemp(suffix=".pcm", dir=os.path.dirname(os.path.abspath(file_path)))
+        os.close(descriptor)
+        try:
+            subprocess.run(
+                [
+                    cls.__ffmpeg__, "-nostdin", "-v", "error", "-y", "-i", file_path,
+                    "-map", "0:a:0", "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", pcm_path,
+                ],
+                check=True,
+                capture_output=True,
+            )
+            frames = os.path.getsize(pcm_path) // 2
+            if frames == 0:
+                raise ValueError(f"The recording {file_path} contains no audio")
+            samples = np.memmap(pcm_path, dtype="<i2", mode="r", shape=(frames, 1))
+        finally:
+            # The mapping keeps the samples readable until the recording is released
+            os.remove(pcm_path)
+        return cls(
+            extension=extension,
+            content=None,
+            waveform=None,
+            pcm=(samples, sample_rate),
+        )
 
     @classmethod
     def from_file_path(cls, file_path: str) -> "Recording":
-        extension = os.path.splitext(file_path)[-1]
-        content = AudioSegment.from_file(file_path)
-        recording = cls(
+        """
+        Loads a recording from a file.
+        The samples of 16-bit PCM WAV files are memory-mapped instead of read,
+        and compressed recordings are decoded by ffmpeg into memory-mapped samples,
+        so that the recording does not occupy memory until its waveform is asked for.
+        """
+        extension = os.path.splitext(file_path)[-1].lower()
+        if extension in cls._compressed_extensions and shutil.which(cls.__ffmpeg__):
+            return cls._decode(file_path, extension)
+        data = cls._wav_data(file_path) if extension == ".wav" else None
+        if data is None or data[1] == 0:
+            return cls(
+                extension=extension,
+                content=None,
+                waveform=torchaudio.load(file_path),
+            )
+        offset, frames, channels, sample_rate = data
+        samples = np.memmap(file_path, dtype="<i2", mode="r", offset=offset, shape=(frames, channels))
+        return cls(
             extension=extension,
-            content=content,
-            waveform=torchaudio.load(file_path),
+            content=None,
+            waveform=None,
+            pcm=(samples, sample_rate),
         )
-        return recording
 
     @classmethod
     def from_file(cls, file, extension=".wav") -> "Recording":
-        read_audio = file.read()
-        byte_obj = BytesIO(read_audio)
-        content = AudioSegment.from_file(byte_obj, format=extension[1:])
-        byte_obj = BytesIO(read_audio)
-        recording = cls(
+        """
+        Decodes a recording from a binary file object, only once:
+        its AudioSegment is built from the decoded audio if it is asked for.
+        """
+        return cls(
             extension=extension,
-            content=content,
-            waveform=torchaudio.load(byte_obj),
+            content=None,
+            waveform=torchaudio.load(file, format=extension[1:]),
         )
+
+    def spill(self, directory: str | None = None) -> "Recording":
+        """
+        Moves the 16-bit PCM audio of the recording to a memory-mapped file,
+        so that the audio kept e.g. for re-processing does not occupy memory.
+        The file is removed right away: the mapping keeps it readable
+        and its space is freed with the last reference to the spilled recording.
+        :param directory: The directory of the file, the system temporary directory by default.
+        :return: The spilled recording, or this recording if it is already memory-mapped.
+        """
+        if self._parent is None and self._pcm is not None and isinstance(self._pcm.obj, np.memmap):
+            return self
+        if self._length == 0:
+            samples = np.zeros((0, self._channels), dtype="<i2")
+            return Recording(extension=self.extension, content=None, waveform=None, pcm=(samples, self._sample_rate))
+        descriptor, pcm_path = tempfile.mkstemp(suffix=".pcm", dir=directory)
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                for chunk in self.chunks(1 << 20):
+                    file.write(chunk)
+            samples = np.memmap(pcm_path, dtype="<i2", mode="r", shape=(self._length, self._channels))
+        finally:
+            os.remove(pcm_path)
+        return Recording(extension=self.extension, content=None, waveform=None, pcm=(samples, self._sample_rate))
+
+    def _view(self, start_idx: int, end_idx: int) -> "Recording":
+        recording = Recording.__new__(Recording)
+        recording._extension = self._extension
+        recording._content = None
+        recording._waveform = None
+        recording._pcm = None
+        recording._parent = self._parent or self
+        recording._offset = self._offset + start_idx
+        recording._length = end_idx - start_idx
+        recording._sample_rate = self._sample_rate
+        recording._channels = self._channels
+        recording._normalized = {}
         return recording
 
+    def normalized(self, sample_rate: int | None = None) -> "Recording":
+        """
+        Returns the recording down-mixed to mono and resampled to the given sample rate,
+        16 kHz by default, so that neither the diarization nor the transcription
+        processes more samples than their models use.
+        The normalized recording is computed once and cached,
+        and a recording already in that format is returned as is.
+        :param sample_rate: The sample rate of the normalized recording.
+        """
+        sample_rate = sample_rate or Recording.__sample_rate__
+        if self._channels == 1 and self._sample_rate == sample_rate:
+            return self
+        if sample_rate not in self._normalized:
+            waveform = self.waveform["waveform"]
+            if waveform.ndim == 1:
+                waveform = waveform.unsqueeze(0)
+            # Down-mixed first, so that a single channel is resampled
+            waveform = waveform.mean(dim=0, keepdim=True)
+            if self._sample_rate != sample_rate:
+                waveform = torchaudio.functional.resample(waveform, self._sample_rate, sample_rate)
+            self._normalized[sample_rate] = Recording(
+                extension=self.extension,
+                content=None,
+                waveform=(waveform, sample_rate),
+            )
+        return self._normalized[sample_rate]
+
     def trim_recording(
         self, annotation: list[tuple[str, float, float]]
     ) -> list[tuple[str, "Recording"]]:
-        waveform, sample_rate = self._waveform
-
-        # Ensure waveform is 2D for consistency (shape: [channels, samples])
-        if waveform.ndim == 1:
-            waveform = waveform.unsqueeze(0)
-
+        """
+        Splits the recording into the turns of the annotation.
+        The segments are views onto this recording: their waveform is a slice
+        of its tensor (or converted from their PCM audio if it is not loaded),
+        their PCM audio a slice of its PCM buffer,
+        and their AudioSegment is only built when it is asked for.
+        :param annotation: The (speaker, start, end) turns to cut out.
+        :return: The (speaker, recording) tuples of the turns.
+        """
         split_segments = []
         for speaker, start, end in annotation:
-            # Extract segment using PyTorch slicing
-            start_idx = int(start * sample_rate)
-            end_idx = int(end * sample_rate)
-            segment = waveform[:, start_idx:end_idx]
-            segment_waveform = segment, sample_rate
-
-            # Extract segment form AudioSegment
-            start_idx = int(start * 1000)
-            end_idx = int(end * 1000)
-            segment_audio = self.content[start_idx:end_idx]
-
-            recording = Recording(
-                extension=self.extension,
-                content=segment_audio,
-                waveform=segment_waveform,
-            )
-            split_segments.append((speaker, recording))
+            start_idx = min(max(int(start * self._sample_rate), 0), self._length)
+            end_idx = min(max(int(end * self._sample_rate), start_idx), self._length)
+            split_segments.append((speaker, self._view(start_idx, end_idx)))
         return split_segments
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from src.utils.Metrics import Metrics
+from src.utils.Recording import Recording
+
+
+class ResultCache:
+    """
+    A content-addressed cache of processing results on the local disk.
+    Results are stored as JSON files named after a key combining the hash
+    of the decoded audio with the configuration that produced them,
+    so that the same recording uploaded again is not processed again.
+    Reading a result marks it as recently used, and the least recently used
+    results are evicted once the cache exceeds its size.
+    The files are written atomically, so that the cache can be shared by processes.
+    """
+
+    # The size of the chunks of audio hashed at once
+    __hash_chunk_size__ = 1 << 20
+
+    def __init__(self, directory: str, max_bytes: int):
+        """
+        :param directory: The directory of the cache, created if needed.
+        :param max_bytes: The size of the cache in bytes, 0 disabling the cache.
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_environment(cls) -> "ResultCache":
+        return cls(
+            directory=os.environ.get(
+                "RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "protogen-cache")
+            ),
+            max_bytes=int(float(os.environ.get("RESULT_CACHE_MAX_MB", 256)) * 2 ** 20),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_bytes > 0
+
+    @staticmethod
+    def digest(recording: Recording) -> str:
+        """
+        Hashes the decoded 16-bit PCM audio of a recording, with its sample rate and channels.
+        """
+        digest = hashlib.sha256(f"{recording.sample_rate}:{recording.channels}:".encode())
+        for chunk in recording.chunks(ResultCache.__hash_chunk_size__):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(digest: str, kind: str, **config) -> str:
+        """
+        Builds the key of a result.
+        :param digest: The digest of the processed audio.
+        :param kind: The kind of the result, e.g. "annotation".
+        :param config: The configuration the result depends on, e.g. the model.
+        """
+        description = json.dumps({"kind": kind, "config": config}, sort_keys=True)
+        return hashlib.sha256(f"{digest}:{description}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.json")
+
+    def get(self, key: str):
+        """
+        Returns the result stored under the key, or None if there is none.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r") as file:
+                value = json.load(file)
+            os.utime(path)
+        except (OSError, ValueError):
+            Metrics.increment("cache.misses")
+            return None
+        Metrics.increment("cache.hits")
+        return value
+
+    def put(self, key: str, value) -> None:
+        """
+        Stores a JSON-serializable result under the key, then evicts the least recently used results
+        until the cache fits in its size.
+        """
+        if not self.enabled:
+            return
+        descriptor, temporary = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "w") as file:
+                json.dump(value, file)
+            os.replace(temporary, self._path(key))
+        except Exception:
+            os.remove(temporary)
+            raise
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self._directory):
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self._max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    Metrics.increment("cache.evictions")
+                except OSError:
+                    pass
+                total -= size
+            Metrics.set_gauge("cache.bytes", total)
@@ -0,0 +1,114 @@
+from typing import Callable, ContextManager
+
+
+class SchemaMigrations:
+    """
+    The versioned schema of the protocol database.
+    Every change of the schema is a migration with a new version number, appended to MIGRATIONS
+    and never edited once released. The versions applied to a database are recorded in its
+    schema_migrations table, so that a server starting on an older database applies the missing ones.
+    Every migration runs in its own transaction under an advisory lock,
+    so that servers starting together apply it only once.
+    Example of use:
+        SchemaMigrations.migrate(database.cursor)
+    """
+
+    # Any key shared by the servers of a database: pg_advisory_xact_lock takes a bigint
+    LOCK_KEY = 0x70726F746F636F6C
+
+    # (version, description, query)
+    MIGRATIONS: list[tuple[int, str, str]] = [
+        (
+            1,
+            "Create the protocol tables",
+            """
+            CREATE TABLE IF NOT EXISTS ProtocolMetadata(
+            id bigint generated always as IDENTITY primary key,
+            organization varchar(100) not null,
+            title varchar(100), date date,
+            place varchar(100),
+            numberOfAttendees int);
+            CREATE TABLE IF NOT EXISTS AgendaItem(
+            id int not null references ProtocolMetadata on delete cascade,
+            title varchar(100),
+            explanation varchar(10000));
+            """,
+        ),
+        (
+            2,
+            "Index the protocols by organization and order the agenda items of a protocol",
+            """
+            CREATE INDEX IF NOT EXISTS protocolmetadata_organization_date_id
+            ON ProtocolMetadata (organization, date, id);
+            ALTER TABLE AgendaItem ADD COLUMN IF NOT EXISTS position int;
+            -- The items saved so far keep the order in which they were inserted
+            UPDATE AgendaItem a SET position = o.position
+            FROM (SELECT ctid, row_number() OVER (PARTITION BY id ORDER BY ctid) - 1 AS position FROM AgendaItem) o
+            WHERE a.ctid = o.ctid;
+            ALTER TABLE AgendaItem ALTER COLUMN position SET NOT NULL;
+            -- Serves the lookups by protocol, e.g. of the cascade delete, already in the order of the items
+            CREATE INDEX IF NOT EXISTS agendaitem_id_position ON AgendaItem (id, position);
+            """,
+        ),
+        (
+            3,
+            "Create the table of the job store",
+            # Used by the job store when JOB_STORE is postgres, see SqlJobStore
+            """
+            CREATE TABLE IF NOT EXISTS ProtocolJob(
+            id varchar(100) primary key,
+            subject varchar(100) not null,
+            state text not null,
+            done int not null,
+            updated double precision not null,
+            version int not null);
+            """,
+        ),
+    ]
+
+    @staticmethod
+    def latest_version() -> int:
+        return max(version for version, _, _ in SchemaMigrations.MIGRATIONS)
+
+    @staticmethod
+    def version(cursor: Callable[[], ContextManager]) -> int:
+        """
+        Returns the version of the schema of a database, 0 if no migration was applied.
+        :param cursor: The context manager of the transactions of the database, e.g. DataBaseConnection.cursor.
+        """
+        with cursor() as c:
+            c.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+            if not c.fetchone()[0]:
+                return 0
+            c.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            return c.fetchone()[0]
+
+    @staticmethod
+    def migrate(cursor: Callable[[], ContextManager]) -> list[int]:
+        """
+        Applies the migrations missing from a database, in the order of their versions.
+        :param cursor: The context manager of the transactions of the database, e.g. DataBaseConnection.cursor.
+        :return: The versions applied, empty if the schema was up to date.
+        """
+        with cursor() as c:
+            c.execute("SELECT pg_advisory_xact_lock(%s)", (SchemaMigrations.LOCK_KEY,))
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS schema_migrations("
+                "version int primary key, "
+                "description varchar(200) not null, "
+                "applied_at timestamptz not null default now())"
+            )
+        applied = []
+        for version, description, query in sorted(SchemaMigrations.MIGRATIONS):
+            with cursor() as c:
+                c.execute("SELECT pg_advisory_xact_lock(%s)", (SchemaMigrations.LOCK_KEY,))
+                c.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+                if c.fetchone() is not None:
+                    continue
+                c.execute(query)
+                c.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description),
+                )
+            applied.append(version)
+        return applied
@@ -0,0 +1,109 @@
+import math
+import os
+
+import numpy as np
+
+from src.utils.Recording import Recording
+from src.utils.VoiceActivity import VoiceActivity
+
+
+class SegmentPlanner:
+    """
+    Plans the segments transcribed by Vosk from the speaker turns of an annotation.
+    Many short turns cost a session each, and a very long turn is a single long decode
+    that cannot be spread over the connections, so adjacent turns of the same speaker
+    are merged when they are separated by a short gap, and long turns are split
+    into segments of about the target duration, at their quietest points.
+    """
+
+    def __init__(
+        self,
+        max_gap: float | None = None,
+        target: float | None = None,
+        max_duration: float | None = None,
+        frame_seconds: float = 0.03,
+    ):
+        """
+        :param max_gap: The longest gap in seconds between two turns of the same speaker that are merged.
+        Defaults to the environment variable SEGMENT_MAX_GAP_SECONDS (1 if not set).
+        :param target: The duration in seconds of the segments long turns are split into.
+        Defaults to the environment variable SEGMENT_TARGET_SECONDS (30 if not set).
+        :param max_duration: The longest duration in seconds of a segment,
+        beyond which turns are not merged anymore and are split.
+        Defaults to the environment variable SEGMENT_MAX_SECONDS (twice the target if not set).
+        :param frame_seconds: The duration of the frames whose energy locates the quiet points.
+        """
+        if max_gap is None:
+            max_gap = float(os.environ.get("SEGMENT_MAX_GAP_SECONDS", 1))
+        if target is None:
+            target = float(os.environ.get("SEGMENT_TARGET_SECONDS", 30))
+        if max_duration is None:
+            max_duration = float(os.environ.get("SEGMENT_MAX_SECONDS", 2 * target))
+        self._max_gap = max_gap
+        self._target = target
+        self._max_duration = max(max_duration, target)
+        self._frame_seconds = frame_seconds
+
+    def merge(self, annotation: list[tuple[str, float, float]]) -> list[tuple[str, float, float]]:
+        """
+        Merges the consecutive turns of a speaker separated by at most the maximal gap,
+        as long as the merged turn does not exceed the maximal duration.
+        :param annotation: The (speaker, start, end) turns.
+        :return: The merged (speaker, start, end) turns, in chronological order.
+        """
+        merged = []
+        for speaker, start, end in sorted(annotation, key=lambda turn: turn[1]):
+            if merged:
+                previous_speaker, previous_start, previous_end = merged[-1]
+                if (
+                    previous_speaker == speaker
+                    and start - previous_end <= self._max_gap
+                    and max(end, previous_end) - previous_start <= self._max_duration
+                ):
+                    merged[-1] = speaker, previous_start, max(end, previous_end)
+                    continue
+            merged.append((speaker, start, end))
+        return merged
+
+    def split(self, recording: Recording, turn: tuple[str, float, float]) -> list[tuple[str, float, float]]:
+        """
+        Splits a turn longer than the maximal duration into segments of about the target duration.
+        Each cut is placed at the quietest frame within a quarter of a segment around its nominal position,
+        as far as the segments on both sides of the cut do not exceed the maximal duration.
+        :param recording: The recording the turn belongs to.
+        :param turn: The (speaker, start, end) turn to split.
+        :return: The (speaker, start, end) segments of the turn.
+        """
+        speaker, start, end = turn
+        if end - start <= self._max_duration:
+            return [turn]
+        count = math.ceil((end - start) / self._target)
+        length = (end - start) / count
+        (_, view), = recording.trim_recording([(speaker, start, end)])
+        energy, frame = VoiceActivity.frame_energy(view, self._frame_seconds)
+        frame_duration = frame / recording.sample_rate
+        cuts = [start]
+        for k in range(1, count):
+            nominal = start + k * length
+            # The remaining segments must still cover the rest of the turn
+            low = max(cuts[-1] + length / 2, nominal - length / 4, end - (count - k) * self._max_duration)
+            high = min(nominal + length / 4, cuts[-1] + self._max_duration)
+            # The frames whose middle lies within [low, high]
+            first = math.ceil((low - start) / frame_duration - 0.5)
+            last = min(math.floor((high - start) / frame_duration - 0.5) + 1, len(energy))
+            if first < last:
+                quietest = first + int(np.argmin(energy[first:last]))
+                cuts.append(start + (quietest + 0.5) * frame_duration)
+            else:
+                cuts.append(min(max(nominal, low), high))
+        cuts.append(end)
+        return [(speaker, cut, next_cut) for cut, next_cut in zip(cuts, cuts[1:])]
+
+    def plan(self, recording: Recording, annotation: list[tuple[str, float, float]]) -> list[tuple[str, float, float]]:
+        """
+        Merges the short turns of the annotation, then splits the long ones.
+        :param recording: The annotated recording.
+        :param annotation: The (speaker, start, end) turns of the recording.
+        :return: The (speaker, start, end) segments to transcribe, in chronological order.
+        """
+        return [segment for turn in self.merge(annotation) for segment in self.split(recording, turn)]
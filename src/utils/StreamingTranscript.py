@@ -0,0 +1,105 @@
+import asyncio
+import os
+
+from src.utils.Annotation import Annotation
+from src.utils.AudioTranscript import AudioTranscript
+from src.utils.Recording import Recording
+from src.utils.SegmentPlanner import SegmentPlanner
+from src.utils.VoiceActivity import VoiceActivity
+from src.utils.VoskConnectionPool import VoskConnectionPool
+
+
+class StreamingTranscript(AudioTranscript):
+    """
+    An audio transcript overlapping the diarization and the transcription:
+    the recording is diarized in sliding windows in a background thread,
+    and the speaker turns are transcribed as soon as their window is diarized,
+    so that the total time approaches the longest of both stages instead of their sum.
+    The processed result grows in chronological order while the recording is processed.
+    """
+
+    def __init__(
+        self,
+        recording: Recording,
+        annotation: Annotation,
+        diarization_window: float | None = None,
+        diarization_overlap: float | None = None,
+        voice_activity: VoiceActivity | None = None,
+        planner: SegmentPlanner | None = None,
+        **kwargs,
+    ):
+        """
+        :param recording: The whole recording to transcribe.
+        :param annotation: The annotation diarizing the recording.
+        :param diarization_window: The duration of the diarization windows in seconds.
+        Defaults to the environment variable DIARIZATION_WINDOW_SECONDS (120 if not set).
+        :param diarization_overlap: The duration shared by consecutive diarization windows in seconds.
+        Defaults to the environment variable DIARIZATION_OVERLAP_SECONDS (20 if not set).
+        :param voice_activity: The voice activity detection trimming the silence of the turns,
+        if any. The silent turns are left out of the result.
+        :param planner: The planner merging and splitting the turns of every diarization window, if any.
+        :param kwargs: The options of AudioTranscript (pool_size, server_url, window, chunk_seconds).
+        """
+        super().__init__([], **kwargs)
+        self._recording = recording
+        self._annotation = annotation
+        if diarization_window is None:
+            diarization_window = float(os.environ.get("DIARIZATION_WINDOW_SECONDS", 120))
+        if diarization_overlap is None:
+            diarization_overlap = float(os.environ.get("DIARIZATION_OVERLAP_SECONDS", 20))
+        self._diarization_window = diarization_window
+        self._diarization_overlap = diarization_overlap
+        self._voice_activity = voice_activity
+        self._planner = planner
+
+    async def _process_with_vosk(self) -> list[tuple[str, str]]:
+        self._process_ended = False
+        self._process_perc = 0.
+        self._processed_result = []
+        sample_rate = self._recording.sample_rate
+        duration = max(self._recording.duration, 1e-9)
+        chunk_size = max(1, int(sample_rate * self._chunk_seconds)) * 2
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        turns = []
+        texts = {}
+        # The number of turns whose text was added to the result, or which were left out
+        written = [0]
+
+        async def _diarize():
+            windows = self._annotation.annotate_windows(
+                self._recording, self._diarization_window, self._diarization_overlap
+            )
+            try:
+                while (finished := await loop.run_in_executor(None, next, windows, None)) is not None:
+                    if self._planner is not None:
+                        finished = self._planner.plan(self._recording, finished)
+                    for turn in finished:
+                        await queue.put((len(turns), turn))
+                        turns.append(turn)
+            finally:
+                for _ in range(max(1, self._pool_size)):
+                    await queue.put(None)
+
+        async def _transcribe(pool: VoskConnectionPool):
+            while (item := await queue.get()) is not None:
+                index, (speaker, start, end) = item
+                segments = self._recording.trim_recording([(speaker, start, end)])
+                if self._voice_activity is not None:
+                    segments = self._voice_activity.filter(segments)
+                text = None
+                if segments:
+                    pcm, _ = AudioTranscript._to_pcm(segments[0][1])
+                    text = await pool.transcribe(pcm, chunk_size, self._window)
+                texts[index] = text
+                while written[0] in texts:
+                    if texts[written[0]] is not None:
+                        self._processed_result.append((turns[written[0]][0], texts[written[0]]))
+                    self._process_perc = min(turns[written[0]][2] / duration, 1.)
+                    written[0] += 1
+
+        async with VoskConnectionPool(self._server_url, max(1, self._pool_size), sample_rate) as pool:
+            await asyncio.gather(_diarize(), *[_transcribe(pool) for _ in range(max(1, self._pool_size))])
+        self._process_ended = True
+        self._process_perc = 1.
+        return self._processed_result
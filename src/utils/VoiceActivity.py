@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+
+from src.utils.Metrics import Metrics
+from src.utils.Recording import Recording
+
+
+class VoiceActivity:
+    """
+    An energy-based voice activity detection, trimming the silence
+    around speaker turns before they are transcribed.
+    The energy of the audio is computed on short frames of the 16-bit PCM audio at once,
+    and a frame is voiced if its energy is above the absolute threshold
+    and above the noise floor of the segment (its quietest frames) by a margin,
+    unless the segment has no pause.
+    """
+
+    def __init__(
+        self,
+        threshold_db: float | None = None,
+        padding: float | None = None,
+        frame_seconds: float = 0.03,
+        margin_db: float = 10.,
+    ):
+        """
+        :param threshold_db: The energy in dBFS below which a frame is silent.
+        Defaults to the environment variable VAD_THRESHOLD_DB (-45 if not set),
+        -inf disabling the detection.
+        :param padding: The duration of audio kept around the voiced frames in seconds,
+        so that the quiet ends of words are not cut off.
+        Defaults to the environment variable VAD_PADDING_SECONDS (0.2 if not set).
+        :param frame_seconds: The duration of the frames in seconds.
+        :param margin_db: The energy above the noise floor of a segment a frame needs to be voiced.
+        """
+        if threshold_db is None:
+            threshold_db = float(os.environ.get("VAD_THRESHOLD_DB", -45))
+        if padding is None:
+            padding = float(os.environ.get("VAD_PADDING_SECONDS", 0.2))
+        self._threshold_db = threshold_db
+        self._padding = padding
+        self._frame_seconds = frame_seconds
+        self._margin_db = margin_db
+
+    @staticmethod
+    def frame_energy(recording: Recording, frame_seconds: float) -> tuple[np.ndarray, int]:
+        """
+        Computes the energy of the consecutive frames of a recording, an incomplete last frame excluded.
+        :param frame_seconds: The duration of the frames in seconds.
+        :return: The energy of every frame in dBFS and the number of samples per frame.
+        """
+        frame = max(1, int(frame_seconds * recording.sample_rate))
+        width = frame * recording.channels
+        samples = np.frombuffer(recording.pcm, dtype="<i2")
+        samples = samples[:len(samples) - len(samples) % width].reshape(-1, width)
+        power = np.einsum("ij,ij->i", samples, samples, dtype=np.float64) / width
+        return 10 * np.log10(power / 32768. ** 2 + 1e-12), frame
+
+    def voiced_frames(self, recording: Recording) -> tuple[np.ndarray, int]:
+        """
+        Classifies the frames of a recording as voiced or silent.
+        :return: The boolean array of the voiced frames and the number of samples per frame.
+        """
+        energy, frame = VoiceActivity.frame_energy(recording, self._frame_seconds)
+        if len(energy) == 0:
+            return np.zeros(0, dtype=bool), frame
+        # Segments without pauses have no noise floor: their quietest frames are speech as well
+        floor = min(np.percentile(energy, 10) + self._margin_db, energy.max() - self._margin_db)
+        return energy >= max(self._threshold_db, floor), frame
+
+    def speech_bounds(self, recording: Recording) -> tuple[float, float] | None:
+        """
+        Returns the (start, end) of the speech of a recording in seconds,
+        padded and relative to the recording, or None if the recording is silent.
+        """
+        if self._threshold_db == -np.inf:
+            return 0., recording.duration
+        voiced, frame = self.voiced_frames(recording)
+        indices = np.flatnonzero(voiced)
+        if len(indices) == 0:
+            return None
+        start = max(0., indices[0] * frame / recording.sample_rate - self._padding)
+        end = min(recording.duration, (indices[-1] + 1) * frame / recording.sample_rate + self._padding)
+        return start, end
+
+    def trim(self, recording: Recording) -> Recording | None:
+        """
+        Trims the leading and trailing silence of a recording.
+        :return: A view of the speech of the recording, or None if it is silent.
+        """
+        bounds = self.speech_bounds(recording)
+        if bounds is None:
+            return None
+        if bounds == (0., recording.duration):
+            return recording
+        (_, trimmed), = recording.trim_recording([(None, *bounds)])
+        return trimmed
+
+    def filter(self, segments: list[tuple[str, Recording]]) -> list[tuple[str, Recording]]:
+        """
+        Trims the silence of every segment and drops the silent ones.
+        The removed duration is counted by the metric "vad.removed_seconds",
+        and the dropped segments by "vad.dropped_segments".
+        :param segments: The (speaker, recording) segments to filter.
+        :return: The (speaker, recording) segments containing speech, trimmed.
+        """
+        filtered = []
+        removed = 0.
+        dropped = 0
+        for speaker, recording in segments:
+            trimmed = self.trim(recording)
+            if trimmed is None:
+                removed += recording.duration
+                dropped += 1
+                continue
+            removed += recording.duration - trimmed.duration
+            filtered.append((speaker, trimmed))
+        Metrics.increment("vad.removed_seconds", removed)
+        Metrics.increment("vad.dropped_segments", dropped)
+        return filtered
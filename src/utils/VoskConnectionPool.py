@@ -0,0 +1,168 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import websockets
+
+from src.utils.Metrics import Metrics
+
+
+class VoskConnectionPool:
+    """
+    A bounded pool of websocket connections to a Vosk server.
+    At most `size` connections are opened, lazily, and each of them is
+    configured once and then reused for many segments: a segment is
+    finalized with a reset message instead of closing the connection.
+    The chunks of a segment are either sent in lockstep with their results,
+    or pipelined through a window of unanswered chunks.
+    Example of use:
+        async with VoskConnectionPool(url, 4, 16000) as pool:
+            texts = await asyncio.gather(*[pool.transcribe(pcm) for pcm in segments])
+    """
+
+    __eof__ = '{"eof" : 1}'
+    __reset__ = '{"reset" : 1}'
+
+    def __init__(self, url: str, size: int, sample_rate: int, words: bool = False):
+        """
+        :param url: The URL of the Vosk server.
+        :param size: The maximal number of connections.
+        :param sample_rate: The sample rate of the audio sent on the connections.
+        :param words: Whether the results contain the timestamps of every word.
+        """
+        self._url = url
+        self._size = size
+        self._sample_rate = sample_rate
+        self._words = words
+        self._idle = []
+        self._semaphore = asyncio.Semaphore(size)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    async def __aenter__(self) -> "VoskConnectionPool":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    async def _open(self):
+        websocket = await websockets.connect(self._url)
+        config = {"sample_rate": self._sample_rate}
+        if self._words:
+            config["words"] = 1
+        await websocket.send(json.dumps({"config": config}))
+        Metrics.increment("vosk.connections")
+        return websocket
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Borrows a connection of the pool, opening it if none is idle.
+        A connection raising an error is closed instead of being given back.
+        """
+        async with self._semaphore:
+            websocket = self._idle.pop() if self._idle else await self._open()
+            try:
+                yield websocket
+            except BaseException:
+                await websocket.close()
+                raise
+            self._idle.append(websocket)
+
+    async def transcribe(self, pcm: bytes | memoryview, chunk_size: int, window: int = 1) -> str:
+        """
+        Transcribes one segment of 16-bit PCM audio on a pooled connection.
+        :param pcm: The 16-bit PCM audio of the segment.
+        :param chunk_size: The number of bytes sent per message.
+        :param window: The number of chunks sent without waiting for their results.
+        1 waits for the result of every chunk before sending the next one.
+        :return: The recognized text of the segment.
+        """
+        results = await self.recognize(pcm, chunk_size, window)
+        return " ".join(result["text"] for result in results if result.get("text"))
+
+    async def recognize(
+        self, pcm: bytes | memoryview, chunk_size: int, window: int = 1, on_progress=None
+    ) -> list[dict]:
+        """
+        Recognizes one segment of 16-bit PCM audio on a pooled connection, and returns
+        the results of the utterances completed on the way followed by the final result.
+        A reused connection closed by the server in the meantime is replaced once.
+        :param pcm: The 16-bit PCM audio of the segment.
+        :param chunk_size: The number of bytes sent per message.
+        :param window: The number of chunks sent without waiting for their results.
+        :param on_progress: Called with the number of answered chunks and the number of chunks.
+        :return: The results, i.e. the answers of Vosk that are not partial results.
+        """
+        for attempt in range(2):
+            try:
+                async with self.connection() as websocket:
+                    return await VoskConnectionPool._stream(
+                        websocket, pcm, chunk_size, window, on_progress
+                    )
+            except websockets.ConnectionClosed:
+                if attempt > 0:
+                    raise
+
+    @staticmethod
+    async def _stream(
+        websocket, pcm: bytes | memoryview, chunk_size: int, window: int, on_progress=None
+    ) -> list[dict]:
+        """
+        Sends the chunks of a segment through a window of at most `window`
+        unanswered messages, while a concurrent task receives the results.
+        With a window of 1, every chunk waits for the result of the previous one.
+        """
+        chunks = range(0, len(pcm), chunk_size)
+        results = []
+
+        def _collect(message: str, answered: int) -> None:
+            message = json.loads(message)
+            if "partial" not in message:
+                results.append(message)
+            if on_progress is not None:
+                on_progress(answered, len(chunks))
+
+        if window <= 1:
+            for answered, i in enumerate(chunks, start=1):
+                await websocket.send(pcm[i : i + chunk_size])
+                _collect(await websocket.recv(), answered)
+            await websocket.send(VoskConnectionPool.__reset__)
+            _collect(await websocket.recv(), len(chunks))
+            return results
+
+        in_flight = asyncio.Semaphore(window)
+
+        async def _send():
+            for i in chunks:
+                await in_flight.acquire()
+                await websocket.send(pcm[i : i + chunk_size])
+            await in_flight.acquire()
+            await websocket.send(VoskConnectionPool.__reset__)
+
+        async def _receive():
+            for answered in range(1, len(chunks) + 2):
+                _collect(await websocket.recv(), min(answered, len(chunks)))
+                in_flight.release()
+
+        sender = asyncio.create_task(_send())
+        receiver = asyncio.create_task(_receive())
+        try:
+            await asyncio.gather(sender, receiver)
+        finally:
+            sender.cancel()
+            receiver.cancel()
+        return results
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for websocket in idle:
+            try:
+                await websocket.send(VoskConnectionPool.__eof__)
+                await websocket.recv()
+            except Exception:
+                pass
+            await websocket.close()
+
@@ -1,6 +1,15 @@
+from src.utils.AlignedTranscript import AlignedTranscript  # noqa: F401
 from src.utils.Annotation import Annotation  # noqa: F401
 from src.utils.AudioTranscript import AudioTranscript  # noqa: F401
 from src.utils.FunctionTool import FunctionTool  # noqa: F401
+from src.utils.IntervalIndex import IntervalIndex  # noqa: F401
+from src.utils.Metrics import Metrics  # noqa: F401
 from src.utils.OpenAIClient import OpenAIClient  # noqa: F401
+from src.utils.PipelineRegistry import PipelineRegistry  # noqa: F401
 from src.utils.Recording import Recording  # noqa: F401
+from src.utils.ResultCache import ResultCache  # noqa: F401
+from src.utils.SegmentPlanner import SegmentPlanner  # noqa: F401
+from src.utils.StreamingTranscript import StreamingTranscript  # noqa: F401
 from src.utils.TextTranscript import TextTranscript  # noqa: F401
+from src.utils.VoiceActivity import VoiceActivity  # noqa: F401
+from src.utils.VoskConnectionPool import VoskConnectionPool  # noqa: F401
@@ -0,0 +1,73 @@
+import base64
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from jose import jwt
+
+AUDIENCE = "ProtoGen-Authorization"
+ISSUER = "http://127.0.0.1/realms/test"
+
+
+class FakeJwksServer:
+    """
+    A local stand-in for the JWKS endpoint of Keycloak, used by the tests and the benchmarks.
+    It serves symmetric HS256 keys, counts the requests, and can delay its answers
+    to emulate the network round-trip. Its keys can be rotated, and it signs tokens
+    with the current key.
+    Example of use:
+        with FakeJwksServer(latency=0.05) as server:
+            TokenValidator(server.url, AUDIENCE, ISSUER).validate(server.token("subject"))
+    """
+
+    def __init__(self, latency: float = 0.):
+        self.latency = latency
+        self.requests = 0
+        self.keys = []
+        self.rotate()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                time.sleep(server.latency)
+                body = json.dumps({"keys": server.keys}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/certs"
+
+    def rotate(self) -> None:
+        """
+        Adds a new key, which signs the tokens from now on.
+        """
+        secret = base64.urlsafe_b64encode(secrets.token_bytes(32)).decode().rstrip("=")
+        self.keys = self.keys + [{"kty": "oct", "kid": f"key-{len(self.keys)}", "alg": "HS256", "k": secret}]
+
+    def token(self, subject: str, lifetime: float = 60., **claims) -> str:
+        key = self.keys[-1]
+        claims = {"sub": subject, "aud": AUDIENCE, "iss": ISSUER, "exp": int(time.time() + lifetime), **claims}
+        return jwt.encode(claims, key, algorithm="HS256", headers={"kid": key["kid"]})
+
+    def __enter__(self) -> "FakeJwksServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._server.shutdown()
+        self._server.server_close()
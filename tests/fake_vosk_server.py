@@ -0,0 +1,143 @@
+import asyncio
+import json
+import threading
+
+from websockets.asyncio.server import serve
+
+
+class FakeVoskServer:
+    """
+    A local stand-in for the Vosk websocket server, used by the tests and the benchmarks.
+    It speaks the same protocol (config, audio chunks, reset and eof messages)
+    and answers every segment with the text "<number of received bytes> bytes".
+    The network round-trip, the handshake and the processing of every message
+    can be slowed down artificially, as well as the processing of the audio
+    by limiting the number of bytes processed per second on each connection. If utterance_bytes is set, every time that many
+    bytes were received, a message is answered with the intermediate result "utterance".
+    If the words are requested in the config, every 0.1 second of audio is recognized
+    as the word "w<index>" instead, timestamped from the start of the connection.
+    Example of use:
+        with FakeVoskServer(latency=0.001) as server:
+            AudioTranscript(segments, server_url=server.url).to_transcript()
+    """
+
+    def __init__(self, latency: float = 0., handshake_latency: float = 0.,
+                 processing: float = 0., utterance_bytes: int = 0, bandwidth: float = 0.):
+        self.latency = latency
+        self.handshake_latency = handshake_latency
+        self.processing = processing
+        self.utterance_bytes = utterance_bytes
+        self.bandwidth = bandwidth
+        self.connections = 0
+        self.messages = 0
+        self.bytes = 0
+        self.sample_rates = []
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._stop = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.port = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}"
+
+    async def _process_request(self, connection, request):
+        await asyncio.sleep(self.handshake_latency)
+        return None
+
+    async def _write(self, websocket, outgoing: asyncio.Queue):
+        while True:
+            deliver_at, response = await outgoing.get()
+            if response is None:
+                return
+            await asyncio.sleep(max(0., deliver_at - self._loop.time()))
+            await websocket.send(response)
+
+    @staticmethod
+    def _words(first: int, last: int) -> dict:
+        words = [
+            {"word": f"w{i}", "start": i * 0.1, "end": i * 0.1 + 0.09, "conf": 1.}
+            for i in range(first, last)
+        ]
+        return {"result": words, "text": " ".join(word["word"] for word in words)}
+
+    async def _handle(self, websocket):
+        self.connections += 1
+        received = 0
+        utterance = 0
+        words = False
+        word_bytes = 0
+        total = 0
+        emitted = 0
+        # Responses are delayed by the round-trip time without delaying
+        # the following messages, like on a real network.
+        outgoing = asyncio.Queue()
+        writer = asyncio.create_task(self._write(websocket, outgoing))
+        try:
+            async for message in websocket:
+                self.messages += 1
+                if self.processing:
+                    await asyncio.sleep(self.processing)
+                deliver_at = self._loop.time() + self.latency
+                if isinstance(message, str) and "config" in message:
+                    config = json.loads(message)["config"]
+                    self.sample_rates.append(config["sample_rate"])
+                    words = bool(config.get("words"))
+                    word_bytes = int(config["sample_rate"] * 0.1) * 2
+                    continue
+                if message in ('{"eof" : 1}', '{"reset" : 1}'):
+                    if words:
+                        result = FakeVoskServer._words(emitted, total // word_bytes)
+                        emitted = total // word_bytes
+                    else:
+                        result = {"text": f"{received} bytes"}
+                    await outgoing.put((deliver_at, json.dumps(result)))
+                    received, utterance = 0, 0
+                    if message == '{"eof" : 1}':
+                        break
+                    continue
+                if self.bandwidth:
+                    await asyncio.sleep(len(message) / self.bandwidth)
+                self.bytes += len(message)
+                received += len(message)
+                utterance += len(message)
+                total += len(message)
+                if self.utterance_bytes and utterance >= self.utterance_bytes:
+                    utterance = 0
+                    if words:
+                        result = FakeVoskServer._words(emitted, total // word_bytes)
+                        emitted = total // word_bytes
+                    else:
+                        result = {"text": "utterance"}
+                    await outgoing.put((deliver_at, json.dumps(result)))
+                else:
+                    await outgoing.put((deliver_at, json.dumps({"partial": ""})))
+        finally:
+            await outgoing.put((0., None))
+            await writer
+
+    async def _serve(self):
+        self._stop = asyncio.Event()
+        async with serve(self._handle, "127.0.0.1", 0, process_request=self._process_request) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            self._started.set()
+            await self._stop.wait()
+
+    def _run(self):
+        self._loop.run_until_complete(self._serve())
+
+    def start(self) -> "FakeVoskServer":
+        self._thread.start()
+        self._started.wait(5)
+        return self
+
+    def stop(self) -> None:
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(5)
+
+    def __enter__(self) -> "FakeVoskServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
@@ -0,0 +1,38 @@
+import pytest
+import torch
+
+from src.utils import AlignedTranscript, Recording
+from tests.fake_vosk_server import FakeVoskServer
+
+
+def test_align():
+    results = [
+        {"result": [{"word": "hallo", "start": 0.1, "end": 0.4},
+                    {"word": "zusammen", "start": 0.5, "end": 1.1}], "text": "hallo zusammen"},
+        {"text": ""},
+        {"result": [{"word": "danke", "start": 1.3, "end": 1.6},
+                    {"word": "schön", "start": 1.7, "end": 2.3},
+                    {"word": "bitte", "start": 2.9, "end": 3.2}], "text": "danke schön bitte"},
+    ]
+    annotation = [("A", 0., 1.2), ("B", 1.25, 2.0), ("A", 3., 4.)]
+    assert AlignedTranscript.align(results, annotation) == [
+        ("A", "hallo zusammen"), ("B", "danke schön"), ("A", "bitte")
+    ]
+    assert AlignedTranscript.align(results, []) == []
+
+
+@pytest.mark.parametrize("window", [1, 8])
+def test_single_session(window):
+    recording = Recording(".wav", None, (torch.zeros(1, 48000), 16000))
+    annotation = [("A", 0., 1.), ("B", 1., 2.), ("A", 2.2, 3.)]
+    with FakeVoskServer(latency=0.001, utterance_bytes=32000) as server:
+        transcript = AlignedTranscript(recording, annotation, server_url=server.url, window=window)
+        result = transcript.to_transcript()
+        assert server.connections == 1
+        assert server.sample_rates == [16000]
+    words = [f"w{i}" for i in range(30)]
+    assert transcript.process_ended
+    assert transcript.process_perc == 1.
+    assert result.transcript == [
+        ("A", " ".join(words[:10])), ("B", " ".join(words[10:21])), ("A", " ".join(words[21:]))
+    ]
@@ -1,26 +1,28 @@
+import threading
+
+import psycopg2
 import pytest
 
 from src.utils.DataBaseConnection import DataBaseConnection
 
 db = None
 
+DB_CONFIG = {
+    "db_name": "protocols_test",
+    "user_name": "protocol_server",
+    "password": "server_pwd",
+    "host": "localhost",
+    "port": 5800,
+}
+
 
 @pytest.fixture(autouse=True)
 def setup_and_teardown():
     global db
-    db = DataBaseConnection(
-        db_name="protocols_test",
-        user_name="protocol_server",
-        password="server_pwd",
-        host="localhost",
-        port=5800,
-    )
-    cursor = db.connection.cursor()
-    cursor.execute("DELETE FROM agendaitem WHERE true")
-    cursor.close()
-    cursor = db.connection.cursor()
-    cursor.execute("DELETE FROM protocolmetadata WHERE true")
-    cursor.close()
+    db = DataBaseConnection(**DB_CONFIG)
+    with db.cursor() as cursor:
+        cursor.execute("DELETE FROM agendaitem WHERE true")
+        cursor.execute("DELETE FROM protocolmetadata WHERE true")
     yield
     db.drop_db()
     db.close()
@@ -28,15 +30,11 @@ def setup_and_teardown():
 
 def test_initialize_tables():
     global db
-    assert db.connection is not None
-    cursor = db.connection.cursor()
-    cursor.execute("SELECT * FROM agendaitem")
-    assert cursor.fetchall() == []
-    cursor.close()
-    cursor = db.connection.cursor()
-    cursor.execute("SELECT * FROM protocolmetadata")
-    assert cursor.fetchall() == []
-    cursor.close()
+    with db.cursor() as cursor:
+        cursor.execute("SELECT * FROM agendaitem")
+        assert cursor.fetchall() == []
+        cursor.execute("SELECT * FROM protocolmetadata")
+        assert cursor.fetchall() == []
 
 
 @pytest.mark.parametrize("n", [i for i in range(1, 10)])
@@ -49,16 +47,13 @@ def test_save_protocol_valid(generate_protocol_mock, n):
             assert db.save_protocol(protocol, f'User number {protocol["title"][16:]}')
 
         query = "SELECT * FROM protocolmetadata"
-        cursor = db.connection.cursor()
-        cursor.execute(query)
-        assert len(cursor.fetchall()) == 10 * (i + 1)
-        cursor.close()
-        cursor = db.connection.cursor()
-        cursor.execute("SELECT * FROM agendaitem")
-        new_items = sum([len(protocol["agendaItems"]) for protocol in protocols])
-        items += new_items
-        assert len(cursor.fetchall()) == items
-        cursor.close()
+        with db.cursor() as cursor:
+            cursor.execute(query)
+            assert len(cursor.fetchall()) == 10 * (i + 1)
+            cursor.execute("SELECT * FROM agendaitem")
+            new_items = sum([len(protocol["agendaItems"]) for protocol in protocols])
+            items += new_items
+            assert len(cursor.fetchall()) == items
 
 
 def test_save_protocol_invalid(generate_protocol_mock):
@@ -75,10 +70,9 @@ def test_get_protocol_by_id_valid(generate_protocol_mock):
     global db
     protocol = generate_protocol_mock()
     db.save_protocol(protocol, "User ID must be here")
-    cursor = db.connection.cursor()
-    cursor.execute("SELECT * FROM protocolmetadata")
-    protocol_id = cursor.fetchone()[0]
-    cursor.close()
+    with db.cursor() as cursor:
+        cursor.execute("SELECT * FROM protocolmetadata")
+        protocol_id = cursor.fetchone()[0]
     assert db.get_protocol_by_id(protocol_id, "User ID must be here") == protocol
 
 
@@ -86,21 +80,155 @@ def test_get_protocol_by_id_invalid(generate_protocol_mock):
     global db
     protocol = generate_protocol_mock()
     db.save_protocol(protocol, "User ID must be here")
-    cursor = db.connection.cursor()
-    cursor.execute("SELECT * FROM protocolmetadata")
-    protocol_id = cursor.fetchall()
+    with db.cursor() as cursor:
+        cursor.execute("SELECT * FROM protocolmetadata")
+        protocol_id = cursor.fetchall()
     assert len(protocol_id) == 1
     protocol_id = protocol_id[0][0]
-    cursor.close()
     with pytest.raises(Exception):
         db.get_protocol_by_id(protocol_id, "User ID must be her")
-    cursor = db.connection.cursor()
-    cursor.execute("SELECT * FROM protocolmetadata")
-    protocol_id = cursor.fetchall()
-    assert len(protocol_id) == 1
+    with db.cursor() as cursor:
+        cursor.execute("SELECT * FROM protocolmetadata")
+        assert len(cursor.fetchall()) == 1
     with pytest.raises(Exception):
         db.get_protocol_by_id(protocol_id + 1, "User ID must be here")
-    cursor = db.connection.cursor()
-    cursor.execute("SELECT * FROM protocolmetadata")
-    protocol_id = cursor.fetchall()
-    assert len(protocol_id) == 1
+    with db.cursor() as cursor:
+        cursor.execute("SELECT * FROM protocolmetadata")
+        assert len(cursor.fetchall()) == 1
+
+
+def test_concurrent_calls_share_the_pool(generate_protocol_mock):
+    pooled = DataBaseConnection(**DB_CONFIG, min_connections=1, max_connections=2)
+    for _ in range(5):
+        assert pooled.save_protocol(generate_protocol_mock(), "Organization")
+    expected = pooled.get_protocol_summaries("Organization")
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(pooled.get_protocol_summaries("Organization")))
+        for _ in range(16)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [expected] * 16
+    pooled.close()
+
+
+def test_connections_kept_open_under_load():
+    pooled = DataBaseConnection(**DB_CONFIG, min_connections=1, max_connections=4)
+    barrier = threading.Barrier(4)
+    pids = []
+
+    def work():
+        for _ in range(3):
+            with pooled.cursor() as cursor:
+                cursor.execute("SELECT pg_backend_pid()")
+                pids.append(cursor.fetchone()[0])
+                # The 4 connections are used at once at every round
+                barrier.wait(5)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Beyond the first connection, the ones opened by the first round are reused by the next ones
+    assert len(pids) == 12 and len(set(pids)) == 4
+    pooled.close()
+
+
+def test_failed_call_rolled_back(generate_protocol_mock):
+    global db
+    with pytest.raises(psycopg2.Error):
+        with db.cursor() as cursor:
+            cursor.execute("DELETE FROM protocolmetadata WHERE true")
+            cursor.execute("SELECT * FROM table_which_does_not_exist")
+    assert db.save_protocol(generate_protocol_mock(), "Organization")
+    assert len(db.get_protocol_summaries("Organization")) == 1
+
+
+def test_reconnect_after_lost_connection(generate_protocol_mock):
+    pooled = DataBaseConnection(**DB_CONFIG, min_connections=1, max_connections=1, health_check_interval=0)
+    assert pooled.save_protocol(generate_protocol_mock(), "Organization")
+    with pooled.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid()")
+        pid, = cursor.fetchone()
+    with db.cursor() as cursor:
+        cursor.execute("SELECT pg_terminate_backend(%s)", (pid,))
+    # The broken connection is detected by its health check and replaced
+    assert len(pooled.get_protocol_summaries("Organization")) == 1
+    pooled.close()
+
+
+def test_save_protocols(generate_protocol_mock):
+    global db
+    protocols = [generate_protocol_mock() for _ in range(25)]
+    protocol_ids = db.save_protocols(protocols, "Organization", page_size=10)
+    assert len(set(protocol_ids)) == 25
+    for protocol_id, protocol in zip(protocol_ids, protocols):
+        assert db.get_protocol_by_id(protocol_id, "Organization") == protocol
+    assert db.save_protocols([], "Organization") == []
+    invalid = generate_protocol_mock()
+    invalid.pop("place")
+    with pytest.raises(AssertionError):
+        db.save_protocols([generate_protocol_mock(), invalid], "Organization")
+    assert len(db.get_protocol_summaries("Organization")) == 25
+
+
+def test_concurrent_saves_keep_their_items(generate_protocol_mock):
+    global db
+    # Identical metadata, which the items must not be attached to by mistake
+    protocols = [generate_protocol_mock() for _ in range(8)]
+    for i, protocol in enumerate(protocols):
+        protocol.update(title="Same title", place="Same place", numberOfAttendees=3)
+        protocol["agendaItems"] = [{"title": f"Item of protocol {i}", "explanation": ""}]
+    threads = [threading.Thread(target=db.save_protocol, args=(protocol, "Organization")) for protocol in protocols]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summaries = db.get_protocol_summaries("Organization")
+    assert sorted(item["title"] for summary in summaries for item in summary["agendaItems"]) == sorted(
+        f"Item of protocol {i}" for i in range(8)
+    )
+    assert all(len(summary["agendaItems"]) == 1 for summary in summaries)
+
+
+def test_get_protocol_summaries(generate_protocol_mock):
+    global db
+    protocols = [generate_protocol_mock() for _ in range(5)]
+    protocols[2]["agendaItems"] = []
+    protocol_ids = db.save_protocols(protocols, "Organization")
+    db.save_protocol(generate_protocol_mock(), "Other organization")
+    summaries = sorted(db.get_protocol_summaries("Organization"), key=lambda summary: summary["id"])
+    assert summaries == [
+        {"id": protocol_id, **{key: value for key, value in protocol.items() if key != "agendaItems"},
+         "agendaItems": protocol["agendaItems"]}
+        for protocol_id, protocol in zip(protocol_ids, protocols)
+    ]
+    assert db.get_protocol_summaries("Unknown organization") == []
+
+
+def test_get_protocol_summaries_by_pages(generate_protocol_mock):
+    global db
+    protocols = [generate_protocol_mock() for _ in range(23)]
+    for protocol in protocols[:4]:
+        protocol["date"] = None
+    for protocol in protocols[4:8]:
+        protocol["date"] = protocols[8]["date"]
+    db.save_protocols(protocols, "Organization")
+    everything = db.get_protocol_summaries("Organization")
+    assert [s["id"] for s in everything[:4]] == sorted([s["id"] for s in everything if s["date"] is None], reverse=True)
+    dated = [(s["date"], s["id"]) for s in everything[4:]]
+    assert dated == sorted(dated, reverse=True)
+    pages, after = [], None
+    while True:
+        page = db.get_protocol_summaries("Organization", limit=5, after=after, items=False)
+        if not page:
+            break
+        pages.append(page)
+        after = page[-1]["date"], page[-1]["id"]
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    metadata = [{key: value for key, value in s.items() if key != "agendaItems"} for s in everything]
+    assert [s for page in pages for s in page] == metadata
@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from src.utils import IntervalIndex
+
+annotation = [("A", 0., 1.), ("B", 1.5, 3.), ("C", 2.5, 4.), ("A", 6., 7.)]
+
+
+@pytest.mark.parametrize("time, expected", [(0.5, "A"), (1., "A"), (1.2, "A"), (1.3, "B"),
+                                            (2., "B"), (2.7, "C"), (3.5, "C"), (4.9, "C"),
+                                            (5.1, "A"), (10., "A"), (-1., "A")])
+def test_label_at(time, expected):
+    assert IntervalIndex(annotation).label_at(time) == expected
+
+
+def test_covering():
+    index = IntervalIndex(annotation)
+    assert index.covering(2.7) == [("C", 2.5, 4.), ("B", 1.5, 3.)]
+    assert index.covering(5.) == []
+
+
+def test_empty():
+    assert IntervalIndex([]).label_at(1.) is None
+
+
+def test_matches_linear_scan():
+    r = random.Random(0)
+    intervals = []
+    for i in range(300):
+        start = r.uniform(0, 1000)
+        intervals.append((f"S{i}", start, start + r.uniform(0, 20)))
+    index = IntervalIndex(intervals)
+    for _ in range(1000):
+        time = r.uniform(-10, 1030)
+        covering = sorted([i for i in intervals if i[1] <= time <= i[2]], key=lambda i: -i[1])
+        assert index.covering(time) == covering
+        if not covering:
+            nearest = min(intervals, key=lambda i: min(abs(i[1] - time), abs(i[2] - time)))
+            assert index.label_at(time) == nearest[0]
+    times = [r.uniform(-10, 1030) for _ in range(1000)]
+    assert index.labels_at(times) == [index.label_at(time) for time in times]
+
+
+def test_labels_at():
+    index = IntervalIndex(annotation)
+    times = [10., 0.5, 2.7, -1., 5.1, 1.2, 1.3, 4.9, 2.7]
+    assert index.labels_at(times) == [index.label_at(time) for time in times]
+    assert IntervalIndex([]).labels_at([1.]) == [None]
+
+
+class Counted(float):
+    """
+    A time counting its comparisons, i.e. the work of the lookups.
+    """
+    comparisons = 0
+
+    def _compare(self, other, compare):
+        Counted.comparisons += 1
+        return compare(float(self), float(other))
+
+    def __lt__(self, other):
+        return self._compare(other, float.__lt__)
+
+    def __le__(self, other):
+        return self._compare(other, float.__le__)
+
+    def __gt__(self, other):
+        return self._compare(other, float.__gt__)
+
+    def __ge__(self, other):
+        return self._compare(other, float.__ge__)
+
+
+def test_labels_at_nested_intervals():
+    # A speaker talking for two hours, interrupted by short interjections, and the words in between
+    intervals = [("A", Counted(0.), Counted(7200.))]
+    intervals += [("B", Counted(3. * i + 1.), Counted(3. * i + 1.5)) for i in range(2000)]
+    times = [3. * i + offset for i in range(2000) for offset in (0.5, 1.2, 2.)]
+    index = IntervalIndex(intervals)
+    Counted.comparisons = 0
+    labels = index.labels_at(times)
+    assert labels == ["A", "B", "A"] * 2000
+    # Looking up each time walks back over all the interjections before it: millions of comparisons
+    assert Counted.comparisons < 10 * (len(intervals) + len(times))
+    # A single lookup stops at the latest interval containing the time, here the last interjection
+    Counted.comparisons = 0
+    assert index.label_at(times[-2]) == "B"
+    assert Counted.comparisons < 30
+
@@ -0,0 +1,139 @@
+import os
+import tempfile
+import threading
+
+import pytest
+
+from src.rest.JobScheduler import JobScheduler, QueueFullError
+from src.rest.ProtocolHandler import ProtocolHandler
+from src.utils import PipelineRegistry, TextTranscript
+
+
+class FakeProtocol:
+    def __init__(self, name: str, order: list, release: threading.Event):
+        self.id = name
+        self.transcript_generation_done = False
+        self._order = order
+        self._release = release
+
+    def generate_transcript(self, audio, extension):
+        self._release.wait(5)
+        self._order.append(self.id)
+        self.transcript_generation_done = True
+        return audio
+
+
+def spooled(content: bytes = b"") -> str:
+    descriptor, path = tempfile.mkstemp(suffix=".wav")
+    with os.fdopen(descriptor, "wb") as file:
+        file.write(content)
+    return path
+
+
+@pytest.fixture
+def blocked_scheduler():
+    release = threading.Event()
+    scheduler = JobScheduler(workers=1, max_queued=5, max_queued_per_subject=3)
+    yield scheduler, release
+    release.set()
+    scheduler.shutdown()
+
+
+def wait_until_empty(scheduler: JobScheduler, protocols: list):
+    for _ in range(500):
+        if all(scheduler.position(p.id) is None for p in protocols):
+            return
+        threading.Event().wait(0.01)
+    assert False, "The scheduler did not run every job."
+
+
+def test_round_robin_between_subjects(blocked_scheduler):
+    scheduler, release = blocked_scheduler
+    order = []
+    blocker = FakeProtocol("blocker", order, release)
+    scheduler.submit(blocker, "C", spooled(), threading.Lock())
+    while scheduler.position("blocker") != 0:
+        threading.Event().wait(0.01)
+    a = [FakeProtocol(f"a{i}", order, release) for i in range(3)]
+    b = [FakeProtocol(f"b{i}", order, release) for i in range(2)]
+    positions = [scheduler.submit(p, "A", spooled(), threading.Lock()) for p in a]
+    positions += [scheduler.submit(p, "B", spooled(), threading.Lock()) for p in b]
+    assert positions == [1, 2, 3, 2, 4]
+    assert [scheduler.position(p.id) for p in a + b] == [1, 3, 5, 2, 4]
+    release.set()
+    wait_until_empty(scheduler, [blocker] + a + b)
+    assert order == ["blocker", "a0", "b0", "a1", "b1", "a2"]
+
+
+def test_queue_limits(blocked_scheduler):
+    scheduler, release = blocked_scheduler
+    order = []
+    scheduler.submit(FakeProtocol("blocker", order, release), "C", spooled(), threading.Lock())
+    while scheduler.position("blocker") != 0:
+        threading.Event().wait(0.01)
+    for i in range(3):
+        scheduler.submit(FakeProtocol(f"a{i}", order, release), "A", spooled(), threading.Lock())
+    with pytest.raises(QueueFullError):
+        scheduler.submit(FakeProtocol("a3", order, release), "A", spooled(), threading.Lock())
+    for i in range(2):
+        scheduler.submit(FakeProtocol(f"b{i}", order, release), "B", spooled(), threading.Lock())
+    with pytest.raises(QueueFullError):
+        scheduler.submit(FakeProtocol("b2", order, release), "B", spooled(), threading.Lock())
+    assert scheduler.queued == 5
+
+
+def test_lock_held_while_running(blocked_scheduler):
+    scheduler, release = blocked_scheduler
+    lock = threading.Lock()
+    protocol = FakeProtocol("p", [], release)
+    scheduler.submit(protocol, "A", spooled(), lock)
+    while scheduler.position("p") != 0:
+        threading.Event().wait(0.01)
+    assert lock.locked()
+    release.set()
+    wait_until_empty(scheduler, [protocol])
+    assert not lock.locked()
+    assert protocol.transcript_generation_done
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        JobScheduler(backend="gpu")
+
+
+def test_process_backend(monkeypatch):
+    def generate_transcript(self, audio, extension):
+        self.update_progress(True, 0.5, False, [("A", "partial")])
+        threading.Event().wait(1.5)
+        return TextTranscript([("A", f"{os.path.getsize(audio)} bytes{extension}")])
+
+    monkeypatch.setattr(PipelineRegistry, "_load", classmethod(lambda cls, model, device: object()))
+    monkeypatch.setattr(ProtocolHandler, "generate_transcript", generate_transcript)
+    scheduler = JobScheduler(workers=1, backend="process")
+    try:
+        protocol = ProtocolHandler()
+        scheduler.submit(protocol, "A", spooled(b"\x00" * 1234), threading.Lock(), ".wav")
+        seen = set()
+        while scheduler.position(protocol.id) is not None:
+            seen.add(protocol.transcript_generation_percentage)
+            threading.Event().wait(0.05)
+        assert 0.5 in seen
+        assert protocol.transcript_generation_done
+        assert protocol.annotation_done
+        assert protocol.transcript.transcript == [("A", "1234 bytes.wav")]
+    finally:
+        scheduler.shutdown()
+        PipelineRegistry.clear()
+
+
+def test_spooled_files_removed(blocked_scheduler):
+    scheduler, release = blocked_scheduler
+    order = []
+    running, queued = spooled(), spooled()
+    protocols = [FakeProtocol("a", order, release), FakeProtocol("b", order, release)]
+    scheduler.submit(protocols[0], "A", running, threading.Lock())
+    scheduler.submit(protocols[1], "B", queued, threading.Lock())
+    assert os.path.exists(running) and os.path.exists(queued)
+    release.set()
+    wait_until_empty(scheduler, protocols)
+    assert not os.path.exists(running) and not os.path.exists(queued)
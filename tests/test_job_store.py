@@ -0,0 +1,159 @@
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+from src.rest.JobScheduler import JobScheduler
+from src.rest.JobStore import JobStore
+from src.rest.ProtocolHandler import ProtocolHandler
+from src.rest.SqlJobStore import SqlJobStore
+from src.utils import TextTranscript
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return JobStore()
+    return SqlJobStore.sqlite(str(tmp_path / "jobs.db"))
+
+
+def state(job_id: str, done: bool = False) -> dict:
+    return {"id": job_id, "done": done, "percentage": 0.5, "transcript": [["A", "hello"]]}
+
+
+def test_save_get_delete(store):
+    assert store.save("A", state("p")) == 1
+    assert store.get("p", "A") == {**state("p"), "version": 1}
+    assert store.get("p", "B") is None
+    assert store.get("q", "A") is None
+    assert store.save("A", {**state("p", done=True), "version": 1}) == 2
+    assert store.get("p", "A")["done"]
+    store.delete("p", "B")
+    assert store.get("p", "A") is not None
+    store.delete("p", "A")
+    assert store.get("p", "A") is None
+
+
+def test_claim_stale_once(store):
+    store.save("A", state("running"))
+    store.save("A", state("finished", done=True))
+    time.sleep(0.2)
+    store.save("B", state("fresh"))
+    claimed = store.claim_stale(0.1)
+    assert claimed == [("A", {**state("running"), "version": 1})]
+    # Claiming saves the state again, so that no other process claims the job
+    assert store.claim_stale(0.1) == []
+
+
+def test_save_over_newer_version_discarded(store):
+    store.save("A", state("p"))
+    first, second = store.get("p", "A"), store.get("p", "A")
+    assert store.save("A", {**first, "percentage": 0.75}) == 2
+    # The second state is based on the version the first save replaced
+    assert store.save("A", {**second, "percentage": 0.25}) is None
+    assert store.get("p", "A") == {**state("p"), "percentage": 0.75, "version": 2}
+
+
+def test_delete_expired(store):
+    store.save("A", state("finished", done=True))
+    store.save("A", state("running"))
+    time.sleep(0.2)
+    store.save("B", state("fresh", done=True))
+    assert store.delete_expired(0.1) == 1
+    assert store.get("finished", "A") is None
+    # The unfinished jobs are claimed instead, and the recent ones are kept
+    assert store.get("running", "A") is not None
+    assert store.get("fresh", "B") is not None
+    assert store.delete_expired(0.1) == 0
+
+
+def test_claim_stale_concurrently(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    for i in range(10):
+        SqlJobStore.sqlite(path).save("A", state(f"p{i}"))
+    time.sleep(0.2)
+    claimed = []
+
+    def claim():
+        claimed.extend(SqlJobStore.sqlite(path).claim_stale(0.1))
+
+    threads = [threading.Thread(target=claim) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(s["id"] for _, s in claimed) == [f"p{i}" for i in range(10)]
+
+
+def test_sqlite_connections_reused(monkeypatch, tmp_path):
+    import sqlite3
+
+    connections = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, "connect", lambda *args, **kwargs: connections.append(1) or connect(*args, **kwargs))
+    store = SqlJobStore.sqlite(str(tmp_path / "jobs.db"))
+
+    def poll(job_id):
+        for _ in range(20):
+            store.save("A", store.get(job_id, "A") or state(job_id))
+
+    threads = [threading.Thread(target=poll, args=(f"p{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [store.get(f"p{i}", "A")["version"] for i in range(4)] == [20] * 4
+    assert len(connections) <= 4
+
+
+def test_handler_state_round_trip():
+    protocol = ProtocolHandler()
+    protocol.update_progress(True, 1., True, [("A", "hello")])
+    protocol.set_generated_transcript(TextTranscript([("A", "hello"), ("B", "world")]))
+    restored = ProtocolHandler.from_state(protocol.state())
+    assert restored.id == protocol.id
+    assert restored.transcript_generation_done
+    assert restored.transcript.transcript == [("A", "hello"), ("B", "world")]
+    assert restored.state() == protocol.state()
+
+
+def test_scheduler_persists_jobs(monkeypatch, store):
+    release = threading.Event()
+
+    def generate_transcript(self, audio, extension):
+        self.update_progress(True, 0.5, False, [("A", "partial")])
+        release.wait(5)
+        transcript = TextTranscript([("A", "done")])
+        self.set_generated_transcript(transcript)
+        return transcript
+
+    monkeypatch.setattr(ProtocolHandler, "generate_transcript", generate_transcript)
+    monkeypatch.setattr(JobScheduler, "__persist_interval__", 0.05)
+    scheduler = JobScheduler(workers=1, store=store)
+    try:
+        protocol = ProtocolHandler()
+        descriptor, audio = tempfile.mkstemp(suffix=".wav")
+        os.close(descriptor)
+        scheduler.submit(protocol, "A", audio, threading.Lock(), ".wav")
+        for _ in range(20):
+            saved = store.get(protocol.id, "A")
+            if saved["percentage"] == 0.5:
+                break
+            threading.Event().wait(0.05)
+        assert saved["audio"] == audio and not saved["done"]
+        if store.persistent:
+            assert saved["percentage"] == 0.5 and saved["queuePosition"] == 0
+        else:
+            # Only saved when submitted and when ended, the process holding the progress itself
+            assert saved["percentage"] == 0. and saved["version"] == 1
+        release.set()
+        while scheduler.position(protocol.id) is not None:
+            threading.Event().wait(0.01)
+        saved = store.get(protocol.id, "A")
+        assert saved["done"]
+        assert ProtocolHandler.from_state(saved).transcript.transcript == [("A", "done")]
+    finally:
+        release.set()
+        scheduler.shutdown()
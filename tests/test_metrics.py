@@ -0,0 +1,30 @@
+import pytest
+
+from src.utils import Metrics
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    Metrics.reset()
+    yield
+    Metrics.reset()
+
+
+def test_counters_and_gauges():
+    Metrics.increment("a")
+    Metrics.increment("a", 2.)
+    Metrics.set_gauge("b", 5.)
+    Metrics.set_gauge("b", 3.)
+    snapshot = Metrics.snapshot()
+    assert snapshot["counters"] == {"a": 3.}
+    assert snapshot["gauges"] == {"b": 3.}
+
+
+def test_timings():
+    Metrics.observe("t", 1.)
+    Metrics.observe("t", 3.)
+    with Metrics.timer("u"):
+        pass
+    timings = Metrics.snapshot()["timings"]
+    assert timings["t"] == {"count": 2, "total": 4., "max": 3., "last": 3., "mean": 2.}
+    assert timings["u"]["count"] == 1
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from src.utils import Metrics, PipelineRegistry
+
+
+@pytest.fixture
+def fake_loader(monkeypatch):
+    loads = []
+
+    def _load(cls, model, device):
+        time.sleep(0.05)
+        loads.append((model, device))
+        return object()
+
+    monkeypatch.setattr(PipelineRegistry, "_load", classmethod(_load))
+    PipelineRegistry.clear()
+    Metrics.reset()
+    yield loads
+    PipelineRegistry.clear()
+    Metrics.reset()
+
+
+def test_pipeline_shared(fake_loader):
+    first = PipelineRegistry.get("model", "cpu")
+    second = PipelineRegistry.get("model", "cpu")
+    other = PipelineRegistry.get("model", "cuda")
+    assert first is second
+    assert first is not other
+    assert fake_loader == [("model", "cpu"), ("model", "cuda")]
+
+
+def test_pipeline_loaded_once_concurrently(fake_loader):
+    pipelines = []
+    threads = [
+        threading.Thread(target=lambda: pipelines.append(PipelineRegistry.get("model", "cpu")))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(fake_loader) == 1
+    assert all(pipeline is pipelines[0] for pipeline in pipelines)
+    assert Metrics.snapshot()["timings"]["pipeline.load"]["count"] == 1
+
+
+def test_inference_bounded(fake_loader, monkeypatch):
+    monkeypatch.setenv("PYANNOTE_MAX_CONCURRENCY", "2")
+    running = []
+    maximum = []
+    lock = threading.Lock()
+
+    def _infer():
+        with PipelineRegistry.inference("model", "cpu"):
+            with lock:
+                running.append(1)
+                maximum.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+
+    threads = [threading.Thread(target=_infer) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(maximum) <= 2
+    assert Metrics.snapshot()["timings"]["pipeline.inference"]["count"] == 6
@@ -0,0 +1,57 @@
+import os
+from os import path
+
+import pytest
+
+from src.rest.ProtocolHandler import ProtocolHandler
+from src.utils import Annotation, AudioTranscript, PipelineRegistry, ResultCache
+
+__test_dir__ = path.dirname(path.realpath(__file__))
+
+
+@pytest.fixture
+def transcription(monkeypatch, tmp_path):
+    def annotate(self, recording):
+        self._is_done = True
+        return [("SPEAKER_00", 0.5, 2.), ("SPEAKER_01", 2.5, 3.5)]
+
+    async def process_with_vosk(self):
+        return [(speaker, f"{recording.duration:.1f} s") for speaker, recording in self._transcript]
+
+    monkeypatch.setattr(PipelineRegistry, "_load", classmethod(lambda cls, model, device: object()))
+    monkeypatch.setattr(Annotation, "annotate", annotate)
+    monkeypatch.setattr(AudioTranscript, "_process_with_vosk", process_with_vosk)
+    monkeypatch.setattr(ProtocolHandler, "__result_cache__", ResultCache(str(tmp_path / "cache"), 0))
+    monkeypatch.setenv("TRANSCRIPTION_MODE", "segments")
+    monkeypatch.setenv("VAD_THRESHOLD_DB", "-inf")
+    monkeypatch.setenv("PROTOGEN_SPOOL_DIR", str(tmp_path))
+    yield f"{__test_dir__}/audio_files/test_de_1.wav"
+    PipelineRegistry.clear()
+
+
+def test_audio_released_after_transcript(transcription, monkeypatch):
+    monkeypatch.delenv("AUDIO_RETENTION_SECONDS", raising=False)
+    protocol = ProtocolHandler()
+    protocol.generate_transcript(transcription)
+    assert protocol.recording is None
+    assert protocol.memory_bytes == 0
+    assert protocol.annotation_done
+    assert protocol.transcript_generation_done
+    assert protocol.transcript_generation_percentage == 1.
+    assert protocol.transcript.transcript == [("SPEAKER_00", "1.5 s"), ("SPEAKER_01", "1.0 s")]
+
+
+def test_audio_retained_on_disk(transcription, monkeypatch, tmp_path):
+    monkeypatch.setenv("AUDIO_RETENTION_SECONDS", "0.1")
+    protocol = ProtocolHandler()
+    protocol.generate_transcript(transcription)
+    assert protocol.recording is not None
+    assert protocol.memory_bytes == 0
+    assert protocol.recording.duration > 3.5
+    assert not protocol.release_expired_audio()
+    # The spilled audio is only reachable through its mapping
+    assert not any(name.endswith(".pcm") for name in os.listdir(tmp_path))
+    protocol._audio_expires -= 0.1
+    assert protocol.release_expired_audio()
+    assert protocol.recording is None
+    assert protocol.transcript_generation_done
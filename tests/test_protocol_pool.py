@@ -0,0 +1,84 @@
+import threading
+import time
+
+import torch
+
+from src.rest.ProtocolHandler import ProtocolHandler
+from src.rest.ProtocolPool import ProtocolPool
+from src.utils import Metrics, Recording, TextTranscript
+
+SAMPLE_RATE = 16000
+
+
+def handler(seconds: float = 1., transcript: bool = True) -> ProtocolHandler:
+    protocol = ProtocolHandler()
+    protocol._recording = Recording(".wav", None, (torch.zeros(1, int(seconds * SAMPLE_RATE)), SAMPLE_RATE))
+    if transcript:
+        protocol.set_generated_transcript(TextTranscript([("A", "hello")]))
+    return protocol
+
+
+def test_get_put_pop():
+    pool = ProtocolPool(ttl=60, max_bytes=2 ** 30)
+    protocol, lock = handler(), threading.Lock()
+    pool.put(protocol, "A", lock)
+    assert (protocol.id, "A") in pool
+    assert pool.get(protocol.id, "A") == (protocol, lock)
+    assert pool.get(protocol.id, "B") is None
+    assert pool.pop(protocol.id, "A") == (protocol, lock)
+    assert len(pool) == 0
+
+
+def test_idle_finished_sessions_expire():
+    expired = []
+    pool = ProtocolPool(ttl=0.05, max_bytes=2 ** 30, on_expire=lambda *key: expired.append(key))
+    finished, running, busy = handler(), handler(transcript=False), handler()
+    running.update_progress(True, 0.5, False)
+    busy_lock = threading.Lock()
+    for protocol, lock in ((finished, threading.Lock()), (running, threading.Lock()), (busy, busy_lock)):
+        pool.put(protocol, "A", lock)
+    busy_lock.acquire()
+    pool.evict()
+    assert len(pool) == 3
+    threading.Event().wait(0.1)
+    pool.evict()
+    assert expired == [(finished.id, "A")]
+    assert (running.id, "A") in pool and (busy.id, "A") in pool
+
+
+def test_audio_released_least_recently_used_first():
+    Metrics.reset()
+    size = handler().memory_bytes
+    pool = ProtocolPool(ttl=60, max_bytes=3 * size)
+    protocols = [handler(), handler(transcript=False), handler(), handler()]
+    for protocol in protocols:
+        pool.put(protocol, "A", threading.Lock())
+    # The first session becomes the most recently used one
+    pool.get(protocols[0].id, "A")
+    pool.evict()
+    # The untranscribed session keeps its audio, the oldest transcribed one releases it
+    assert [p.memory_bytes for p in protocols] == [size, size, 0, size]
+    assert protocols[2].transcript_generation_done
+    assert protocols[2].transcript.transcript == [("A", "hello")]
+    assert len(pool) == 4
+    gauges = Metrics.snapshot()["gauges"]
+    assert gauges["protocol_pool.bytes"] == 3 * size
+    assert gauges["protocol_pool.size"] == 4
+
+
+def test_retained_audio_released_beyond_budget(tmp_path):
+    Metrics.reset()
+    protocols = [handler() for _ in range(3)]
+    for protocol in protocols:
+        # As retained by AUDIO_RETENTION_SECONDS after the transcript generation
+        protocol._recording = protocol.recording.spill(str(tmp_path))
+        protocol._audio_expires = time.monotonic() + 3600
+    size = protocols[0].retained_bytes
+    assert size == SAMPLE_RATE * 2 and protocols[0].memory_bytes == 0
+    pool = ProtocolPool(ttl=60, max_bytes=2 * size)
+    for protocol in protocols:
+        pool.put(protocol, "A", threading.Lock())
+    pool.evict()
+    assert [p.retained_bytes for p in protocols] == [0, size, size]
+    assert protocols[0].recording is None
+    assert Metrics.snapshot()["gauges"]["protocol_pool.bytes"] == 2 * size
@@ -0,0 +1,160 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+
+import pytest
+
+from src.rest.JobScheduler import JobScheduler
+from src.rest.ProtocolHandler import ProtocolHandler
+from src.rest.ProtocolPool import ProtocolPool
+from src.rest.ProtocolSessions import ProtocolSessions
+from src.rest.SqlJobStore import SqlJobStore
+from src.utils import TextTranscript
+
+
+def sessions(path: str) -> ProtocolSessions:
+    return ProtocolSessions(ProtocolPool(ttl=3600, max_bytes=2 ** 30), SqlJobStore.sqlite(path))
+
+
+def serve(path: str, connection) -> None:
+    """
+    Another process of the server, renaming the speakers of a session or reading its transcript on request.
+    """
+    other = sessions(path)
+    while (request := connection.recv()) is not None:
+        protocol_id, speakers = request
+        if speakers is not None:
+            other.edit(protocol_id, "alice", lambda protocol: protocol.edit_speakers(speakers))
+        protocol, _ = other.find(protocol_id, "alice")
+        connection.send(protocol.transcript.transcript)
+
+
+@pytest.fixture
+def processes(tmp_path):
+    """
+    The sessions of this process, holding a generated transcript, and the connection to another process.
+    """
+    path = str(tmp_path / "jobs.db")
+    pool, store = ProtocolPool(ttl=3600, max_bytes=2 ** 30), SqlJobStore.sqlite(path)
+    protocol = ProtocolHandler()
+    protocol.set_generated_transcript(TextTranscript([("SPEAKER_00", "hello"), ("SPEAKER_01", "world")]))
+    pool.put(protocol, "alice", threading.Lock())
+    protocol.version = store.save("alice", protocol.state())
+    connection, other_connection = multiprocessing.Pipe()
+    other = multiprocessing.get_context("fork").Process(target=serve, args=(path, other_connection))
+    other.start()
+
+    def request(speakers: dict | None = None):
+        connection.send((protocol.id, speakers))
+        return connection.recv()
+
+    yield ProtocolSessions(pool, store), protocol.id, request
+    connection.send(None)
+    other.join(10)
+
+
+def test_edits_seen_by_every_process(processes):
+    local, protocol_id, request = processes
+    assert request({"SPEAKER_00": "Alice", "SPEAKER_01": "Bob"}) == [("Alice", "hello"), ("Bob", "world")]
+    # This process holds the session it generated, which is stale now
+    protocol, _ = local.find(protocol_id, "alice")
+    assert protocol.transcript.transcript == [("Alice", "hello"), ("Bob", "world")]
+    local.edit(protocol_id, "alice", lambda protocol: protocol.edit_speakers({"Alice": "Carol", "Bob": "Bob"}))
+    # The other process holds the session it edited, which is stale now
+    assert request() == [("Carol", "hello"), ("Bob", "world")]
+
+
+def test_edit_applied_again_after_concurrent_edit(processes):
+    local, protocol_id, request = processes
+    calls = []
+
+    def edit(protocol: ProtocolHandler) -> None:
+        calls.append(protocol.transcript.transcript)
+        if len(calls) == 1:
+            # The other process saves the session while this one edits it
+            request({"SPEAKER_00": "Alice", "SPEAKER_01": "Bob"})
+            protocol.edit_speakers({"SPEAKER_00": "Ann", "SPEAKER_01": "Ben"})
+        else:
+            protocol.edit_speakers({"Alice": "Alice", "Bob": "Bert"})
+
+    local.edit(protocol_id, "alice", edit)
+    assert calls == [[("SPEAKER_00", "hello"), ("SPEAKER_01", "world")], [("Alice", "hello"), ("Bob", "world")]]
+    assert request() == [("Alice", "hello"), ("Bert", "world")]
+
+
+def test_rehydrated_session_shared_by_requests(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    protocol = ProtocolHandler()
+    protocol.set_generated_transcript(TextTranscript([("SPEAKER_00", "hello")]))
+    SqlJobStore.sqlite(path).save("alice", protocol.state())
+    local = sessions(path)
+    first, second = local.find(protocol.id, "alice"), local.find(protocol.id, "alice")
+    assert first[0] is second[0] and first[1] is second[1]
+    with pytest.raises(KeyError):
+        local.find(protocol.id, "bob")
+
+
+def test_session_ended_by_another_process(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    pool, store = ProtocolPool(ttl=3600, max_bytes=2 ** 30), SqlJobStore.sqlite(path)
+    protocol = ProtocolHandler()
+    protocol.set_generated_transcript(TextTranscript([("SPEAKER_00", "hello")]))
+    pool.put(protocol, "alice", threading.Lock())
+    protocol.version = store.save("alice", protocol.state())
+    # E.g. the other process saved the protocol to the database
+    sessions(path).forget(protocol.id, "alice")
+    with pytest.raises(KeyError):
+        ProtocolSessions(pool, store).find(protocol.id, "alice")
+    assert (protocol.id, "alice") not in pool
+
+
+@pytest.mark.parametrize("scheduled", [True, False])
+def test_running_job_not_rehydrated(monkeypatch, tmp_path, scheduled):
+    release = threading.Event()
+
+    def generate_transcript(self, audio, extension):
+        for i in range(1, 20):
+            self.update_progress(True, i / 20, False, [("A", "partial")])
+            threading.Event().wait(0.01)
+        release.wait(5)
+        transcript = TextTranscript([("A", "done")])
+        self.set_generated_transcript(transcript)
+        return transcript
+
+    store = SqlJobStore.sqlite(str(tmp_path / "jobs.db"))
+    save = store.save
+
+    def slow_save(subject, state):
+        # A request may find the session between the save and the update of the version of its handler
+        version = save(subject, state)
+        threading.Event().wait(0.02)
+        return version
+
+    monkeypatch.setattr(store, "save", slow_save)
+    monkeypatch.setattr(ProtocolHandler, "generate_transcript", generate_transcript)
+    monkeypatch.setattr(JobScheduler, "__persist_interval__", 0.01)
+    scheduler = JobScheduler(workers=1, store=store)
+    pool = ProtocolPool(ttl=3600, max_bytes=2 ** 30)
+    local = ProtocolSessions(
+        pool, store, scheduled=(lambda protocol_id: scheduler.position(protocol_id) is not None) if scheduled else None
+    )
+    try:
+        protocol, lock = ProtocolHandler(), threading.Lock()
+        pool.put(protocol, "alice", lock)
+        descriptor, audio = tempfile.mkstemp(suffix=".wav")
+        os.close(descriptor)
+        scheduler.submit(protocol, "alice", audio, lock, ".wav")
+        found = set()
+        for _ in range(100):
+            found.add(id(local.find(protocol.id, "alice")[0]))
+            threading.Event().wait(0.005)
+        release.set()
+        while scheduler.position(protocol.id) is not None:
+            found.add(id(local.find(protocol.id, "alice")[0]))
+        # Without knowing the jobs of the scheduler, the live handler is replaced by a snapshot
+        assert (found == {id(protocol)}) == scheduled
+        assert pool.get(protocol.id, "alice")[0] is protocol or not scheduled
+    finally:
+        release.set()
+        scheduler.shutdown()
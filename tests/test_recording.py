@@ -1,6 +1,15 @@
-import pytest
+import sys
+import wave
+from glob import glob
 from os import path
 
+import numpy as np
+import pytest
+import soundfile
+import torch
+import torchaudio
+from pydub import AudioSegment
+
 from src.utils import Recording
 
 __test_dir__ = path.dirname(path.realpath(__file__))
@@ -72,3 +81,148 @@ def test_trim_recording(n: int, test_recording):
                 assert abs(r.content.duration_seconds - 0.5) < 1e-8
             case "C":
                 assert abs(r.content.duration_seconds - 1.3) < 1e-8
+
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+def test_trim_recording_views(n: int):
+    recording = Recording.from_file_path(f"{__test_dir__}/audio_files/test_de_{n}.wav")
+    waveform, sample_rate = recording.waveform.values()
+    pcm = recording.pcm
+    assert bytes(pcm) == (waveform * 32768.0).round().clamp(-32768, 32767).short().numpy().tobytes()
+
+    (_, outer), = recording.trim_recording([("A", 0.5, 2.5)])
+    (_, inner), = outer.trim_recording([("B", 0.5, 1.)])
+    assert outer.offset == int(0.5 * sample_rate)
+    assert inner.offset == int(1. * sample_rate)
+    for segment in (outer, inner):
+        length = segment.waveform["waveform"].shape[-1]
+        start = segment.offset * 2
+        assert segment.pcm.obj is pcm.obj
+        assert bytes(segment.pcm) == bytes(pcm[start:start + length * 2])
+        assert b"".join(segment.chunks(1000)) == bytes(segment.pcm)
+        assert segment.waveform["waveform"].untyped_storage().data_ptr() == waveform.untyped_storage().data_ptr()
+    assert abs(inner.content.duration_seconds - 0.5) < 1e-8
+
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+def test_content_is_decoded_lazily(n: int, test_recording):
+    file_path = f"{__test_dir__}/audio_files/test_de_{n}.wav"
+    with open(file_path, "rb") as file:
+        recording = Recording.from_file(file, ".wav")
+    assert recording._content is None
+    test_recording(n, recording)
+    assert recording.content.raw_data == AudioSegment.from_file(file_path).raw_data
+
+
+def test_from_file_path_memory_maps_wav(tmp_path):
+    samples = (np.arange(2 * 1600, dtype=np.int16).reshape(-1, 2) * 7) - 5000
+    file_path = str(tmp_path / "stereo.wav")
+    with wave.open(file_path, "wb") as file:
+        file.setnchannels(2)
+        file.setsampwidth(2)
+        file.setframerate(8000)
+        file.writeframes(samples.tobytes())
+    recording = Recording.from_file_path(file_path)
+    assert isinstance(recording.pcm.obj, np.memmap)
+    assert recording._waveform is None
+    assert recording.duration == 0.2
+    (_, segment), = recording.trim_recording([("A", 0.05, 0.1)])
+    assert bytes(segment.pcm) == samples[400:800].tobytes()
+    assert recording._waveform is None
+    waveform, sample_rate = torchaudio.load(file_path)
+    assert sample_rate == recording.sample_rate == 8000
+    assert torch.equal(recording.waveform["waveform"], waveform)
+    assert torch.equal(segment.waveform["waveform"], waveform[:, 400:800])
+
+
+def test_normalized():
+    time = torch.arange(48000 * 2) / 48000
+    left = 0.5 * torch.sin(2 * torch.pi * 440 * time)
+    right = 0.25 * torch.sin(2 * torch.pi * 440 * time)
+    recording = Recording(".wav", None, (torch.stack([left, right]), 48000))
+    normalized = recording.normalized()
+    assert normalized is recording.normalized()
+    assert normalized.sample_rate == 16000
+    assert normalized.duration == recording.duration
+    waveform = normalized.waveform["waveform"]
+    assert waveform.shape == (1, 32000)
+    expected = 0.375 * torch.sin(2 * torch.pi * 440 * torch.arange(32000) / 16000)
+    assert torch.allclose(waveform[0, 100:-100], expected[100:-100], atol=1e-2)
+    assert normalized.normalized() is normalized
+    assert len(normalized.pcm) == 32000 * 2
+
+
+def test_nbytes(tmp_path):
+    recording = Recording(".wav", None, (torch.zeros(2, 48000), 48000))
+    assert recording.nbytes == 2 * 48000 * 4
+    normalized = recording.normalized()
+    assert recording.nbytes == 2 * 48000 * 4 + 16000 * 4
+    (_, segment), = normalized.trim_recording([("A", 0.25, 0.5)])
+    assert segment.waveform["waveform"].shape == (1, 4000)
+    assert segment.nbytes == 0
+    normalized.pcm
+    assert normalized.nbytes == 16000 * (4 + 2)
+    segment.content
+    assert segment.nbytes == 4000 * 2
+    file_path = str(tmp_path / "mono.wav")
+    with wave.open(file_path, "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(16000)
+        file.writeframes(np.zeros(1600, dtype=np.int16).tobytes())
+    assert Recording.from_file_path(file_path).nbytes == 0
+
+
+FAKE_FFMPEG = """#!{python}
+import sys
+
+import soundfile
+
+arguments = sys.argv[1:]
+samples, _ = soundfile.read(arguments[arguments.index("-i") + 1], dtype="int16")
+with open(arguments[-1], "wb") as file:
+    file.write(samples.tobytes())
+"""
+
+
+@pytest.fixture
+def flac_file(tmp_path):
+    samples = ((torch.arange(16000) % 200 - 100) * 100).short()
+    file_path = str(tmp_path / "recording.flac")
+    soundfile.write(file_path, samples.numpy(), 16000, subtype="PCM_16")
+    return file_path, samples
+
+
+def test_compressed_decoded_by_ffmpeg(tmp_path, monkeypatch, flac_file):
+    file_path, samples = flac_file
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    ffmpeg.chmod(0o755)
+    monkeypatch.setattr(Recording, "__ffmpeg__", str(ffmpeg))
+    recording = Recording.from_file_path(file_path)
+    assert recording.extension == ".flac"
+    assert isinstance(recording.pcm.obj, np.memmap)
+    assert bytes(recording.pcm) == samples.numpy().tobytes()
+    assert recording.normalized() is recording
+    assert sorted(path.basename(p) for p in glob(str(tmp_path / "*"))) == ["ffmpeg", "recording.flac"]
+
+
+def test_compressed_decoded_without_ffmpeg(monkeypatch, flac_file):
+    file_path, samples = flac_file
+    monkeypatch.setattr(Recording, "__ffmpeg__", "ffmpeg-which-is-not-installed")
+    recording = Recording.from_file_path(file_path)
+    assert recording.sample_rate == 16000
+    assert bytes(recording.pcm) == samples.numpy().tobytes()
+
+
+def test_spill(tmp_path):
+    waveform = torch.sin(torch.arange(2 * 8000) / 10).reshape(2, 8000) / 2
+    recording = Recording(".wav", None, (waveform, 8000))
+    spilled = recording.spill(str(tmp_path))
+    assert isinstance(spilled.pcm.obj, np.memmap)
+    assert spilled.nbytes == 0
+    assert bytes(spilled.pcm) == bytes(recording.pcm)
+    assert (spilled.channels, spilled.sample_rate) == (2, 8000)
+    assert torch.allclose(spilled.waveform["waveform"], waveform, atol=1 / 32768)
+    assert spilled.spill() is spilled
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,64 @@
+import pytest
+from flask import Flask, g, jsonify
+
+from src.rest.RequestAuthenticator import RequestAuthenticator
+from src.rest.TokenValidator import TokenValidator
+from src.utils import Metrics
+from tests.fake_jwks_server import AUDIENCE, ISSUER, FakeJwksServer
+
+
+@pytest.fixture
+def client():
+    Metrics.reset()
+    with FakeJwksServer() as server:
+        app = Flask(__name__)
+        RequestAuthenticator(TokenValidator(server.url, AUDIENCE, ISSUER), public_endpoints={"metrics"}).init_app(app)
+
+        @app.route("/api/whoami")
+        def whoami():
+            return jsonify({"subject": g.subject, "organization": g.organization_id})
+
+        @app.route("/api/metrics")
+        def metrics():
+            return jsonify({})
+
+        yield app.test_client(), server
+    Metrics.reset()
+
+
+def test_claims_on_request_context(client):
+    client, server = client
+    token = server.token("alice", organization_info={"Club": {"id": "42"}})
+    for _ in range(3):
+        response = client.get("/api/whoami", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+        assert response.json == {"subject": "alice", "organization": "42"}
+    assert server.requests == 1
+    snapshot = Metrics.snapshot()
+    assert snapshot["timings"]["auth.request"]["count"] == 3
+    assert snapshot["counters"]["auth.token_cache_hits"] == 2
+
+
+@pytest.mark.parametrize("organizations", [None, {}, {"A": {"id": "1"}, "B": {"id": "2"}}])
+def test_no_single_organization(client, organizations):
+    client, server = client
+    token = server.token("alice", organization_info=organizations)
+    response = client.get("/api/whoami", headers={"Authorization": f"Bearer {token}"})
+    assert response.json == {"subject": "alice", "organization": None}
+
+
+@pytest.mark.parametrize("header", [None, "", "Bearer", "Basic YWxpY2U6c2VjcmV0", "Bearer not-a-token"])
+def test_unauthenticated_requests_rejected(client, header):
+    client, _ = client
+    response = client.get("/api/whoami", headers={} if header is None else {"Authorization": header})
+    assert response.status_code == 401
+    assert "error" in response.json
+    assert Metrics.snapshot()["counters"]["auth.rejected"] == 1
+
+
+def test_public_and_unknown_endpoints(client):
+    client, server = client
+    assert client.get("/api/metrics").status_code == 200
+    assert client.get("/api/unknown").status_code == 404
+    assert client.options("/api/whoami").status_code == 200
+    assert server.requests == 0
@@ -0,0 +1,116 @@
+import os
+import time
+from os import path
+
+import pytest
+
+from src.rest.ProtocolHandler import ProtocolHandler
+from src.utils import Annotation, AudioTranscript, Metrics, PipelineRegistry, Recording, ResultCache
+
+__test_dir__ = path.dirname(path.realpath(__file__))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    Metrics.reset()
+    yield ResultCache(str(tmp_path / "cache"), 1 << 20)
+    Metrics.reset()
+
+
+def test_digest_depends_on_decoded_audio_only():
+    file_path = f"{__test_dir__}/audio_files/test_de_1.wav"
+    with open(file_path, "rb") as file:
+        decoded = Recording.from_file(file, ".wav")
+    mapped = Recording.from_file_path(file_path)
+    other = Recording.from_file_path(f"{__test_dir__}/audio_files/test_de_2.wav")
+    assert ResultCache.digest(decoded) == ResultCache.digest(mapped)
+    assert ResultCache.digest(decoded) != ResultCache.digest(other)
+
+
+def test_key_depends_on_config():
+    key = ResultCache.key("digest", "transcript", model="a", mode="segments")
+    assert key == ResultCache.key("digest", "transcript", mode="segments", model="a")
+    assert key != ResultCache.key("digest", "transcript", model="b", mode="segments")
+    assert key != ResultCache.key("digest", "annotation", model="a", mode="segments")
+    assert key != ResultCache.key("other", "transcript", model="a", mode="segments")
+
+
+def test_get_and_put(cache):
+    assert cache.get("key") is None
+    cache.put("key", [["SPEAKER_00", "hallo"]])
+    assert cache.get("key") == [["SPEAKER_00", "hallo"]]
+    counters = Metrics.snapshot()["counters"]
+    assert counters["cache.hits"] == 1 and counters["cache.misses"] == 1
+
+
+def test_least_recently_used_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path), 2500)
+    value = "x" * 1000
+    cache.put("a", value)
+    time.sleep(0.01)
+    cache.put("b", value)
+    time.sleep(0.01)
+    assert cache.get("a") == value
+    time.sleep(0.01)
+    cache.put("c", value)
+    assert cache.get("a") == value
+    assert cache.get("b") is None
+    assert cache.get("c") == value
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "c.json"]
+
+
+def test_disabled(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), 0)
+    cache.put("key", "value")
+    assert cache.get("key") is None
+    assert not os.path.exists(tmp_path / "cache")
+
+
+def test_repeated_upload_served_from_cache(cache, monkeypatch):
+    calls = {"annotate": 0, "transcribe": 0}
+
+    def annotate(self, recording):
+        calls["annotate"] += 1
+        self._is_done = True
+        return [("SPEAKER_00", 0.5, 2.), ("SPEAKER_01", 2.5, 3.5)]
+
+    async def process_with_vosk(self):
+        calls["transcribe"] += 1
+        if calls["transcribe"] == 1:
+            raise ConnectionError("Vosk is not reachable")
+        return [(speaker, f"{recording.duration:.1f} s") for speaker, recording in self._transcript]
+
+    monkeypatch.setattr(PipelineRegistry, "_load", classmethod(lambda cls, model, device: object()))
+    monkeypatch.setattr(Annotation, "annotate", annotate)
+    monkeypatch.setattr(AudioTranscript, "_process_with_vosk", process_with_vosk)
+    monkeypatch.setattr(ProtocolHandler, "__result_cache__", cache)
+    monkeypatch.setenv("TRANSCRIPTION_MODE", "segments")
+    monkeypatch.setenv("VAD_THRESHOLD_DB", "-inf")
+    file_path = f"{__test_dir__}/audio_files/test_de_1.wav"
+    try:
+        # The transcription fails, but the annotation is kept
+        failed = ProtocolHandler()
+        failed.generate_transcript(file_path)
+        assert failed.transcript_generation_percentage == -1
+        assert calls == {"annotate": 1, "transcribe": 1}
+
+        first = ProtocolHandler()
+        first.generate_transcript(file_path)
+        assert calls == {"annotate": 1, "transcribe": 2}
+        assert first.annotation_done
+        expected = [("SPEAKER_00", "1.5 s"), ("SPEAKER_01", "1.0 s")]
+        assert first.transcript.transcript == expected
+
+        second = ProtocolHandler()
+        second.generate_transcript(file_path)
+        assert calls == {"annotate": 1, "transcribe": 2}
+        assert second.transcript.transcript == expected
+        assert second.annotation_done
+        assert second.transcript_generation_done
+        assert second.transcript_generation_percentage == 1.
+
+        monkeypatch.setenv("VAD_PADDING_SECONDS", "0.5")
+        ProtocolHandler().generate_transcript(file_path)
+        assert calls == {"annotate": 1, "transcribe": 3}
+    finally:
+        PipelineRegistry.clear()
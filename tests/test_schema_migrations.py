@@ -0,0 +1,143 @@
+import threading
+from datetime import date
+
+import pytest
+
+from src.utils.DataBaseConnection import DataBaseConnection
+from src.utils.SchemaMigrations import SchemaMigrations
+from tests.test_databse_connection import DB_CONFIG
+
+db = None
+
+
+@pytest.fixture(autouse=True)
+def setup_and_teardown():
+    global db
+    db = DataBaseConnection(**DB_CONFIG)
+    db.drop_db()
+    yield
+    db.drop_db()
+    db.close()
+
+
+def make_protocol(index: int, items: int = 3) -> dict:
+    return {
+        "title": f"Protocol {index}",
+        "date": date(2000 + index % 25, index % 12 + 1, index % 28 + 1),
+        "place": "Room",
+        "numberOfAttendees": 10,
+        "agendaItems": [{"title": f"Item {i}", "explanation": f"Explanation {i}"} for i in range(items)],
+    }
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def explain(query: str, parameters: tuple) -> list[dict]:
+    """
+    Returns the nodes of the plan of a query, the sequential scans disabled
+    so that the plan shows which index the query can use whatever the size of the tables.
+    """
+    with db.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute("EXPLAIN (FORMAT JSON) " + query, parameters)
+        (result,), = cursor.fetchall()
+    return list(plan_nodes(result[0]["Plan"]))
+
+
+def test_migrate_empty_database():
+    assert SchemaMigrations.version(db.cursor) == 0
+    assert SchemaMigrations.migrate(db.cursor) == [version for version, _, _ in SchemaMigrations.MIGRATIONS]
+    assert SchemaMigrations.version(db.cursor) == SchemaMigrations.latest_version()
+    assert SchemaMigrations.migrate(db.cursor) == []
+    with db.cursor() as cursor:
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename IN ('protocolmetadata', 'agendaitem')")
+        indexes = {row[0] for row in cursor.fetchall()}
+    assert {"protocolmetadata_organization_date_id", "agendaitem_id_position"} <= indexes
+    with db.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('protocoljob') IS NOT NULL")
+        assert cursor.fetchone()[0]
+
+
+def test_migrate_database_before_migrations():
+    # The tables as created by the servers before the migrations
+    with db.cursor() as cursor:
+        cursor.execute(SchemaMigrations.MIGRATIONS[0][2])
+        cursor.execute(
+            "INSERT INTO ProtocolMetadata (title, date, place, organization, numberOfAttendees) "
+            "VALUES ('Title', '2024-01-01', 'Place', 'organization', 10) RETURNING id"
+        )
+        protocol_id = cursor.fetchone()[0]
+        for i in range(5):
+            cursor.execute(
+                "INSERT INTO AgendaItem (id, title, explanation) VALUES (%s, %s, %s)",
+                (protocol_id, f"Item {i}", f"Explanation {i}"),
+            )
+    assert SchemaMigrations.migrate(db.cursor) == [1, 2, 3]
+    with db.cursor() as cursor:
+        cursor.execute("SELECT title, position FROM AgendaItem WHERE id = %s ORDER BY position", (protocol_id,))
+        assert cursor.fetchall() == [(f"Item {i}", i) for i in range(5)]
+    protocol = db.get_protocol_by_id(protocol_id, "organization")
+    assert [item["title"] for item in protocol["agendaItems"]] == [f"Item {i}" for i in range(5)]
+
+
+def test_concurrent_migrations():
+    applied = []
+    threads = [threading.Thread(target=lambda: applied.extend(SchemaMigrations.migrate(db.cursor))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(applied) == [version for version, _, _ in SchemaMigrations.MIGRATIONS]
+
+
+def test_items_keep_their_order():
+    db.initialize_tables()
+    protocol = make_protocol(0, items=12)
+    # The items are stored in another order than the one in which they are read
+    protocol["agendaItems"].reverse()
+    assert db.save_protocol(protocol, "organization")
+    protocol_id, = db.save_protocols([protocol], "organization")
+    expected = [item["title"] for item in protocol["agendaItems"]]
+    assert [item["title"] for item in db.get_protocol_by_id(protocol_id, "organization")["agendaItems"]] == expected
+    for summary in db.get_protocol_summaries("organization"):
+        assert [item["title"] for item in summary["agendaItems"]] == expected
+
+
+def test_protocol_summaries_use_index():
+    db.initialize_tables()
+    for organization in range(10):
+        db.save_protocols([make_protocol(i) for i in range(100)], f"organization {organization}")
+    with db.cursor() as cursor:
+        cursor.execute("ANALYZE ProtocolMetadata; ANALYZE AgendaItem")
+    # The query of the pages of get_protocol_summaries, without the agenda items
+    nodes = explain(
+        "SELECT p.id, p.title FROM ProtocolMetadata p "
+        "WHERE p.organization = %s AND (p.date, p.id) < (%s, %s) "
+        "ORDER BY p.date DESC NULLS FIRST, p.id DESC LIMIT %s",
+        ("organization 3", date(2020, 1, 1), 10 ** 9, 50),
+    )
+    assert "protocolmetadata_organization_date_id" in {node.get("Index Name") for node in nodes}
+    # The index returns the protocols in the order of the pages
+    assert "Sort" not in {node["Node Type"] for node in nodes}
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "SELECT title, explanation FROM AgendaItem WHERE id = %s ORDER BY position",
+        # The lookup of the items of a removed protocol, by the cascade delete
+        "DELETE FROM AgendaItem WHERE id = %s",
+    ],
+)
+def test_agenda_items_use_index(query):
+    db.initialize_tables()
+    protocol_ids = db.save_protocols([make_protocol(i) for i in range(1000)], "organization")
+    with db.cursor() as cursor:
+        cursor.execute("ANALYZE AgendaItem")
+    nodes = explain(query, (protocol_ids[500],))
+    assert "agendaitem_id_position" in {node.get("Index Name") for node in nodes}
+    assert "Sort" not in {node["Node Type"] for node in nodes}
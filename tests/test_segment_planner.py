@@ -0,0 +1,67 @@
+import pytest
+import torch
+
+from src.utils import Recording, SegmentPlanner
+
+SAMPLE_RATE = 16000
+
+
+def make_recording(duration: float, pauses: list[tuple[float, float]]) -> Recording:
+    time = torch.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+    waveform = 0.3 * torch.sin(2 * torch.pi * 200 * time)
+    for start, end in pauses:
+        waveform[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)] = 0.
+    return Recording(".wav", None, (waveform.unsqueeze(0), SAMPLE_RATE))
+
+
+@pytest.mark.parametrize("annotation, expected", [
+    ([("A", 0., 1.), ("A", 1.5, 2.), ("A", 2.4, 3.)], [("A", 0., 3.)]),
+    ([("A", 0., 1.), ("A", 2.5, 3.)], [("A", 0., 1.), ("A", 2.5, 3.)]),
+    ([("A", 0., 1.), ("B", 1.1, 1.5), ("A", 1.6, 2.)], [("A", 0., 1.), ("B", 1.1, 1.5), ("A", 1.6, 2.)]),
+    ([("A", 1.4, 2.), ("A", 0., 1.)], [("A", 0., 2.)]),
+    ([("A", 0., 3.5), ("A", 3.6, 5.)], [("A", 0., 3.5), ("A", 3.6, 5.)]),
+    ([("A", 0., 2.), ("A", 0.5, 1.)], [("A", 0., 2.)]),
+])
+def test_merge(annotation, expected):
+    planner = SegmentPlanner(max_gap=0.5, target=2., max_duration=4.)
+    assert planner.merge(annotation) == expected
+
+
+def test_split_at_pauses():
+    recording = make_recording(10., [(2.4, 2.6), (7.3, 7.5)])
+    planner = SegmentPlanner(max_gap=0.5, target=3., max_duration=4.)
+    segments = planner.split(recording, ("A", 0., 10.))
+    assert [speaker for speaker, _, _ in segments] == ["A"] * 4
+    assert segments[0][1] == 0. and segments[-1][2] == 10.
+    assert all(a[2] == b[1] for a, b in zip(segments, segments[1:]))
+    cuts = [start for _, start, _ in segments[1:]]
+    assert 2.4 <= cuts[0] <= 2.6
+    assert 7.3 <= cuts[2] <= 7.5
+    assert all(end - start <= 4. for _, start, end in segments)
+
+
+@pytest.mark.parametrize("duration", [10.5, 17., 23.9])
+def test_split_within_max_duration(duration):
+    # Pauses right after the nominal cuts, where the segments before them would exceed the maximal duration
+    recording = make_recording(duration, [(t + 0.6, t + 0.7) for t in range(3, int(duration), 3)])
+    planner = SegmentPlanner(target=3., max_duration=3.)
+    segments = planner.split(recording, ("A", 0., duration))
+    assert segments[0][1] == 0. and segments[-1][2] == duration
+    assert all(a[2] == b[1] for a, b in zip(segments, segments[1:]))
+    assert all(end - start <= 3. + 1e-9 for _, start, end in segments)
+
+
+def test_short_turns_not_split():
+    recording = make_recording(10., [])
+    planner = SegmentPlanner(target=3., max_duration=4.)
+    assert planner.split(recording, ("A", 1., 5.)) == [("A", 1., 5.)]
+
+
+def test_plan():
+    recording = make_recording(12., [(5.2, 5.4)])
+    planner = SegmentPlanner(max_gap=0.5, target=5., max_duration=6.)
+    annotation = [("A", 0., 0.5), ("A", 0.8, 1.), ("B", 1.2, 11.)]
+    segments = planner.plan(recording, annotation)
+    assert segments[0] == ("A", 0., 1.)
+    assert [speaker for speaker, _, _ in segments[1:]] == ["B", "B"]
+    assert 5.2 <= segments[1][2] <= 5.4
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+import torch
+from pydub import AudioSegment
+
+from src.utils import Annotation, PipelineRegistry, Recording, StreamingTranscript
+from tests.fake_vosk_server import FakeVoskServer
+
+SAMPLE_RATE = 100
+TRUTH = [("A", 0., 30.), ("B", 30., 55.), ("A", 55., 100.), ("C", 100., 130.), ("B", 130., 150.)]
+
+
+class FakeTurn:
+    def __init__(self, start: float, end: float):
+        self.start = start
+        self.end = end
+
+
+class FakeDiarization:
+    def __init__(self, tracks):
+        self._tracks = tracks
+
+    def itertracks(self, yield_label=False):
+        return iter(self._tracks)
+
+    def labels(self):
+        return sorted({label for (_, _, label) in self._tracks})
+
+
+class FakePipeline:
+    """
+    Diarizes the ground truth, reading the position of the window in the waveform
+    (whose samples are their own indices), and names the speakers differently in every window.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, waveform: dict, return_embeddings: bool = False):
+        time.sleep(0.1)
+        samples = waveform["waveform"]
+        start = samples[0, 0].item() / SAMPLE_RATE
+        end = start + samples.shape[-1] / SAMPLE_RATE
+        self.calls += 1
+        labels = {speaker: f"SPK{(ord(speaker) + self.calls) % 3}" for speaker in "ABC"}
+        tracks = [
+            (FakeTurn(max(s, start) - start, min(e, end) - start), None, labels[speaker])
+            for (speaker, s, e) in TRUTH if min(e, end) > max(s, start)
+        ]
+        diarization = FakeDiarization(tracks)
+        if not return_embeddings:
+            return diarization
+        # One voice per speaker of the ground truth, slightly different in every window
+        voices = {labels[speaker]: np.eye(3)[ord(speaker) - ord("A")] + 0.1 * self.calls for speaker in "ABC"}
+        return diarization, np.array([voices[label] for label in diarization.labels()])
+
+
+@pytest.fixture
+def annotation(monkeypatch):
+    pipeline = FakePipeline()
+    monkeypatch.setattr(PipelineRegistry, "_load", classmethod(lambda cls, model, device: pipeline))
+    PipelineRegistry.clear()
+    yield Annotation()
+    PipelineRegistry.clear()
+
+
+@pytest.fixture
+def recording():
+    waveform = torch.arange(150 * SAMPLE_RATE, dtype=torch.float32).unsqueeze(0)
+    return Recording(".wav", AudioSegment.silent(150000, SAMPLE_RATE), (waveform, SAMPLE_RATE))
+
+
+EXPECTED = [("A", 0., 30.), ("B", 30., 50.), ("B", 50., 55.), ("A", 55., 90.),
+            ("A", 90., 100.), ("C", 100., 130.), ("B", 130., 150.)]
+
+
+def test_annotate_windows(annotation, recording):
+    windows = list(annotation.annotate_windows(recording, window=60., overlap=20.))
+    assert annotation.is_done
+    assert len(windows) == 4
+    turns = [turn for window in windows for turn in window]
+    names = {truth[0]: turn[0] for truth, turn in zip(EXPECTED, turns)}
+    assert len(set(names.values())) == 3
+    assert turns == [(names[s], start, end) for (s, start, end) in EXPECTED]
+
+
+def test_streaming_transcript(annotation, recording):
+    with FakeVoskServer(latency=0.001) as server:
+        transcript = StreamingTranscript(recording, annotation, diarization_window=60., diarization_overlap=20.,
+                                         server_url=server.url, pool_size=2)
+        result = []
+        thread = threading.Thread(target=lambda: result.append(transcript.to_transcript()))
+        thread.start()
+        partial_before_annotation_done = False
+        while thread.is_alive():
+            if not annotation.is_done and transcript.processed_result:
+                partial_before_annotation_done = True
+            time.sleep(0.01)
+    assert transcript.process_ended
+    assert partial_before_annotation_done
+    texts = [text for (_, text) in transcript.processed_result]
+    assert texts == [f"{int(round((end - start) * SAMPLE_RATE)) * 2} bytes" for (_, start, end) in EXPECTED]
+    assert len(result[0].transcript) == 5
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+from jose.exceptions import JWTError
+
+from src.rest.TokenValidator import TokenValidator
+from src.utils import Metrics
+from tests.fake_jwks_server import AUDIENCE, ISSUER, FakeJwksServer
+
+
+@pytest.fixture
+def server():
+    Metrics.reset()
+    with FakeJwksServer() as server:
+        yield server
+    Metrics.reset()
+
+
+def test_jwks_and_tokens_cached(server):
+    validator = TokenValidator(server.url, AUDIENCE, ISSUER)
+    first, second = server.token("alice", organization="A"), server.token("bob")
+    for _ in range(3):
+        assert validator.validate(first)["sub"] == "alice"
+        assert validator.validate(second)["sub"] == "bob"
+    assert validator.validate(first)["organization"] == "A"
+    assert server.requests == 1
+    counters = Metrics.snapshot()["counters"]
+    assert counters["auth.token_cache_misses"] == 2
+    assert counters["auth.token_cache_hits"] == 5
+    assert counters["auth.jwks_fetches"] == 1
+
+
+def test_jwks_fetched_again_after_ttl(server):
+    validator = TokenValidator(server.url, AUDIENCE, ISSUER, jwks_ttl=0.05)
+    validator.validate(server.token("alice"))
+    threading.Event().wait(0.1)
+    validator.validate(server.token("bob"))
+    assert server.requests == 2
+
+
+def test_unknown_key_refreshes_jwks(server):
+    validator = TokenValidator(server.url, AUDIENCE, ISSUER, refresh_interval=0.05)
+    validator.validate(server.token("alice"))
+    server.rotate()
+    # The keys were fetched too recently to be fetched again
+    with pytest.raises(JWTError):
+        validator.validate(server.token("bob"))
+    threading.Event().wait(0.1)
+    assert validator.validate(server.token("bob"))["sub"] == "bob"
+    assert server.requests == 2
+
+
+def test_invalid_tokens_rejected(server):
+    validator = TokenValidator(server.url, AUDIENCE, ISSUER)
+    with pytest.raises(JWTError):
+        validator.validate(server.token("alice", lifetime=-10))
+    with pytest.raises(JWTError):
+        validator.validate(server.token("alice", aud="other"))
+    token = server.token("alice")
+    header, payload, signature = token.split(".")
+    with pytest.raises(JWTError):
+        validator.validate(f"{header}.{payload}.{signature[:-4]}AAAA")
+    assert validator.validate(token)["sub"] == "alice"
+
+
+def test_single_fetch_under_concurrency(server):
+    server.latency = 0.2
+    validator = TokenValidator(server.url, AUDIENCE, ISSUER)
+    tokens = [server.token(f"user{i}") for i in range(16)]
+    subjects = []
+    threads = [threading.Thread(target=lambda t=t: subjects.append(validator.validate(t)["sub"])) for t in tokens]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(subjects) == sorted(f"user{i}" for i in range(16))
+    assert server.requests == 1
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import torch
+
+from src.utils import Metrics, Recording, VoiceActivity
+
+SAMPLE_RATE = 16000
+
+
+def make_recording(*parts: tuple[float, float]) -> Recording:
+    """
+    Builds a recording of consecutive (duration, amplitude) parts of a 200 Hz tone over faint noise.
+    """
+    generator = torch.Generator().manual_seed(0)
+    waveform = []
+    for duration, amplitude in parts:
+        time = torch.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+        noise = (torch.rand(len(time), generator=generator) - 0.5) * 2e-4
+        waveform.append(amplitude * torch.sin(2 * torch.pi * 200 * time) + noise)
+    return Recording(".wav", None, (torch.cat(waveform).unsqueeze(0), SAMPLE_RATE))
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    Metrics.reset()
+    yield
+    Metrics.reset()
+
+
+def test_trims_leading_and_trailing_silence():
+    recording = make_recording((1., 0.), (2., 0.3), (1.5, 0.))
+    start, end = VoiceActivity(padding=0.2).speech_bounds(recording)
+    assert start == pytest.approx(0.8, abs=0.04)
+    assert end == pytest.approx(3.2, abs=0.04)
+    trimmed = VoiceActivity(padding=0.2).trim(recording)
+    assert trimmed.offset == int(start * SAMPLE_RATE)
+    assert trimmed.duration == pytest.approx(end - start, abs=1e-3)
+
+
+def test_keeps_speech_without_pauses():
+    recording = make_recording((2., 0.3))
+    assert VoiceActivity().trim(recording) is recording
+
+
+def test_keeps_quiet_speech_after_loud_speech():
+    recording = make_recording((0.5, 0.), (1., 0.5), (1., 0.02), (0.5, 0.))
+    start, end = VoiceActivity(padding=0.).speech_bounds(recording)
+    assert start == pytest.approx(0.5, abs=0.04)
+    assert end == pytest.approx(2.5, abs=0.04)
+
+
+def test_filter_drops_silent_segments():
+    recording = make_recording((1., 0.), (1., 0.3), (2., 0.))
+    segments = recording.trim_recording([("A", 0., 0.9), ("B", 0.5, 2.5), ("C", 2.2, 4.)])
+    filtered = VoiceActivity(padding=0.1).filter(segments)
+    assert [speaker for speaker, _ in filtered] == ["B"]
+    (_, trimmed), = filtered
+    assert trimmed.offset / SAMPLE_RATE == pytest.approx(0.9, abs=0.04)
+    counters = Metrics.snapshot()["counters"]
+    assert counters["vad.dropped_segments"] == 2
+    assert counters["vad.removed_seconds"] == pytest.approx(0.9 + 1.8 + 2. - 1.2, abs=0.1)
+
+
+def test_disabled():
+    recording = make_recording((1., 0.))
+    assert VoiceActivity(threshold_db=-np.inf).trim(recording) is recording
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+import torch
+
+from src.utils import AudioTranscript, Recording, VoskConnectionPool
+from tests.fake_vosk_server import FakeVoskServer
+
+
+@pytest.fixture
+def vosk_server():
+    with FakeVoskServer(latency=0.001) as server:
+        yield server
+
+
+def make_segments(lengths: list[int], sample_rate: int = 16000) -> list[tuple[str, Recording]]:
+    return [
+        (f"SPEAKER_{i % 2:02}", Recording(".wav", None, (torch.zeros(1, length), sample_rate)))
+        for i, length in enumerate(lengths)
+    ]
+
+
+def test_pool_reuses_connections(vosk_server):
+    async def _transcribe():
+        async with VoskConnectionPool(vosk_server.url, 2, 16000) as pool:
+            return await asyncio.gather(*[pool.transcribe(b"\x00" * n, 1000) for n in range(100, 2100, 100)])
+
+    texts = asyncio.run(_transcribe())
+    assert texts == [f"{n} bytes" for n in range(100, 2100, 100)]
+    assert vosk_server.connections == 2
+    assert vosk_server.sample_rates == [16000, 16000]
+
+
+@pytest.mark.parametrize("pool_size", [0, 1, 3, 8])
+def test_transcript_keeps_order(vosk_server, pool_size):
+    lengths = [8000 - 300 * i for i in range(12)]
+    transcript = AudioTranscript(make_segments(lengths), pool_size=pool_size, server_url=vosk_server.url)
+    result = transcript.to_transcript()
+    assert transcript.process_ended
+    assert transcript.process_perc == 1.
+    assert transcript.processed_result == [
+        (f"SPEAKER_{i % 2:02}", f"{2 * length} bytes") for i, length in enumerate(lengths)
+    ]
+    assert len(result.transcript) == len(lengths)
+    assert vosk_server.connections == (len(lengths) if pool_size == 0 else min(pool_size, len(lengths)))
+
+
+def test_unreachable_server():
+    transcript = AudioTranscript(make_segments([1000]), pool_size=2, server_url="ws://127.0.0.1:1")
+    assert transcript.to_transcript().transcript == []
+    assert transcript.process_ended
+    assert transcript.process_perc < 0
+
+
+@pytest.mark.parametrize("window", [1, 2, 16])
+def test_streaming_window(window):
+    with FakeVoskServer(latency=0.002, utterance_bytes=6000) as server:
+        async def _transcribe():
+            async with VoskConnectionPool(server.url, 1, 16000) as pool:
+                return [await pool.transcribe(b"\x00" * n, 1000, window) for n in [500, 5000, 13000]]
+
+        texts = asyncio.run(_transcribe())
+        assert texts == ["500 bytes", "5000 bytes", "utterance utterance 13000 bytes"]
+        assert server.connections == 1
+
+
+@pytest.mark.parametrize("window, chunk_seconds", [(1, 0.2), (8, 0.2), (8, 0.05)])
+def test_transcript_streaming_modes(vosk_server, window, chunk_seconds):
+    lengths = [16000, 3000, 7000]
+    transcript = AudioTranscript(make_segments(lengths), pool_size=2, server_url=vosk_server.url,
+                                 window=window, chunk_seconds=chunk_seconds)
+    transcript.to_transcript()
+    assert transcript.processed_result == [
+        (f"SPEAKER_{i % 2:02}", f"{2 * length} bytes") for i, length in enumerate(lengths)
+    ]
+    chunks = sum(-(-2 * length // (2 * int(16000 * chunk_seconds))) for length in lengths)
+    assert vosk_server.messages == chunks + len(lengths) + 2 + 2